@@ -23,6 +23,7 @@ datastore.
 """
 
 import base64
+import collections
 import time
 
 from oslo.config import cfg
@@ -352,14 +353,26 @@ class CloudController(object):
         else:
             snapshots = self.volume_api.get_all_snapshots(context)
 
+        # Map the ids of all the snapshots and volumes in a single pass
+        ec2_ids = {
+            'snapshot': ec2utils.ids_to_ec2_snap_ids(s['id']
+                                                     for s in snapshots),
+            'volume': ec2utils.ids_to_ec2_vol_ids(s['volume_id']
+                                                  for s in snapshots)}
         formatted_snapshots = []
         for s in snapshots:
-            formatted = self._format_snapshot(context, s)
+            formatted = self._format_snapshot(context, s, ec2_ids=ec2_ids)
             if formatted:
                 formatted_snapshots.append(formatted)
         return {'snapshotSet': formatted_snapshots}
 
-    def _format_snapshot(self, context, snapshot):
+    def _format_snapshot(self, context, snapshot, ec2_ids=None):
+        """Format a snapshot for the EC2 API.
+
+        :param ec2_ids: dict of the ec2 ids of the snapshots and volumes,
+                        keyed by 'snapshot' and 'volume', looked up one by
+                        one when not given
+        """
         # NOTE(mikal): this is just a set of strings in cinder. If they
         # implement an enum, then we should move this code to use it. The
         # valid ec2 statuses are "pending", "completed", and "error".
@@ -376,8 +389,12 @@ class CloudController(object):
             return None
 
         s = {}
-        s['snapshotId'] = ec2utils.id_to_ec2_snap_id(snapshot['id'])
-        s['volumeId'] = ec2utils.id_to_ec2_vol_id(snapshot['volume_id'])
+        if ec2_ids is not None:
+            s['snapshotId'] = ec2_ids['snapshot'][snapshot['id']]
+            s['volumeId'] = ec2_ids['volume'][snapshot['volume_id']]
+        else:
+            s['snapshotId'] = ec2utils.id_to_ec2_snap_id(snapshot['id'])
+            s['volumeId'] = ec2utils.id_to_ec2_vol_id(snapshot['volume_id'])
         s['status'] = mapped_status
         s['startTime'] = snapshot['created_at']
         s['progress'] = snapshot['progress']
@@ -782,10 +799,27 @@ class CloudController(object):
                 volumes.append(volume)
         else:
             volumes = self.volume_api.get_all(context)
-        volumes = [self._format_volume(context, v) for v in volumes]
+        # Map the ids of all the volumes, snapshots and instances in a
+        # single pass
+        ec2_ids = {
+            'instance': ec2utils.ids_to_ec2_inst_ids(
+                    v['instance_uuid'] for v in volumes
+                    if v.get('instance_uuid')),
+            'volume': ec2utils.ids_to_ec2_vol_ids(v['id'] for v in volumes),
+            'snapshot': ec2utils.ids_to_ec2_snap_ids(
+                    v['snapshot_id'] for v in volumes
+                    if v.get('snapshot_id') is not None)}
+        volumes = [self._format_volume(context, v, ec2_ids=ec2_ids)
+                   for v in volumes]
         return {'volumeSet': volumes}
 
-    def _format_volume(self, context, volume):
+    def _format_volume(self, context, volume, ec2_ids=None):
+        """Format a volume for the EC2 API.
+
+        :param ec2_ids: dict of the ec2 ids of the instances, volumes and
+                        snapshots, keyed by 'instance', 'volume' and
+                        'snapshot', looked up one by one when not given
+        """
         valid_ec2_api_volume_status_map = {
             'attaching': 'in-use',
             'detaching': 'in-use'}
@@ -798,11 +832,17 @@ class CloudController(object):
             instance = db.instance_get_by_uuid(context.elevated(),
                     instance_uuid)
 
-            instance_ec2_id = ec2utils.id_to_ec2_inst_id(instance_uuid)
+            if ec2_ids is not None:
+                instance_ec2_id = ec2_ids['instance'][instance_uuid]
+            else:
+                instance_ec2_id = ec2utils.id_to_ec2_inst_id(instance_uuid)
             instance_data = '%s[%s]' % (instance_ec2_id,
                                         instance['host'])
         v = {}
-        v['volumeId'] = ec2utils.id_to_ec2_vol_id(volume['id'])
+        if ec2_ids is not None:
+            v['volumeId'] = ec2_ids['volume'][volume['id']]
+        else:
+            v['volumeId'] = ec2utils.id_to_ec2_vol_id(volume['id'])
         v['status'] = valid_ec2_api_volume_status_map.get(volume['status'],
                                                           volume['status'])
         v['size'] = volume['size']
@@ -817,7 +857,9 @@ class CloudController(object):
                                    'volumeId': v['volumeId']}]
         else:
             v['attachmentSet'] = [{}]
-        if volume.get('snapshot_id') is not None:
+        if volume.get('snapshot_id') is not None and ec2_ids is not None:
+            v['snapshotId'] = ec2_ids['snapshot'][volume['snapshot_id']]
+        elif volume.get('snapshot_id') is not None:
             v['snapshotId'] = ec2utils.id_to_ec2_snap_id(volume['snapshot_id'])
         else:
             v['snapshotId'] = None
@@ -923,18 +965,28 @@ class CloudController(object):
                 'status': volume['attach_status'],
                 'volumeId': ec2utils.id_to_ec2_vol_id(volume_id)}
 
-    def _format_kernel_id(self, context, instance_ref, result, key):
+    def _format_kernel_id(self, context, instance_ref, result, key,
+                          image_ids=None):
         kernel_uuid = instance_ref['kernel_id']
         if kernel_uuid is None or kernel_uuid == '':
             return
-        result[key] = ec2utils.glance_id_to_ec2_id(context, kernel_uuid, 'aki')
+        if image_ids is not None:
+            result[key] = ec2utils.image_ec2_id(image_ids[kernel_uuid], 'aki')
+        else:
+            result[key] = ec2utils.glance_id_to_ec2_id(context, kernel_uuid,
+                                                       'aki')
 
-    def _format_ramdisk_id(self, context, instance_ref, result, key):
+    def _format_ramdisk_id(self, context, instance_ref, result, key,
+                           image_ids=None):
         ramdisk_uuid = instance_ref['ramdisk_id']
         if ramdisk_uuid is None or ramdisk_uuid == '':
             return
-        result[key] = ec2utils.glance_id_to_ec2_id(context, ramdisk_uuid,
-                                                   'ari')
+        if image_ids is not None:
+            result[key] = ec2utils.image_ec2_id(image_ids[ramdisk_uuid],
+                                                'ari')
+        else:
+            result[key] = ec2utils.glance_id_to_ec2_id(context, ramdisk_uuid,
+                                                       'ari')
 
     def describe_instance_attribute(self, context, instance_id, attribute,
                                     **kwargs):
@@ -1054,12 +1106,18 @@ class CloudController(object):
         return {'instancesSet': instances_set}
 
     def _format_instance_bdm(self, context, instance_uuid, root_device_name,
-                             result):
-        """Format InstanceBlockDeviceMappingResponseItemType."""
+                             result, bdms=None):
+        """Format InstanceBlockDeviceMappingResponseItemType.
+
+        :param bdms: block device mappings of the instance, looked up when
+                     not given
+        """
         root_device_type = 'instance-store'
         mapping = []
-        for bdm in db.block_device_mapping_get_all_by_instance(context,
-                                                               instance_uuid):
+        if bdms is None:
+            bdms = db.block_device_mapping_get_all_by_instance(context,
+                                                               instance_uuid)
+        for bdm in bdms:
             volume_id = bdm['volume_id']
             if (volume_id is None or bdm['no_device']):
                 continue
@@ -1138,18 +1196,39 @@ class CloudController(object):
             except exception.NotFound:
                 instances = []
 
+        if not context.is_admin:
+            instances = [instance for instance in instances
+                         if not pipelib.is_vpn_image(instance['image_ref'])]
+
+        # NOTE: look up what all the instances refer to with one query per
+        # kind rather than with several queries per instance
+        instance_uuids = [instance['uuid'] for instance in instances]
+        ec2_ids = ec2utils.ids_to_ec2_inst_ids(instance_uuids)
+        image_uuids = set()
+        for instance in instances:
+            image_uuids.add(instance['image_ref'])
+            image_uuids.update(image_uuid for image_uuid in
+                               (instance['kernel_id'], instance['ramdisk_id'])
+                               if image_uuid)
+        image_ids = ec2utils.glance_ids_to_ids(context, list(image_uuids))
+        metadata = self.compute_api.get_instances_metadata(context, instances)
+        bdms = collections.defaultdict(list)
+        for bdm in db.block_device_mapping_get_all_by_instance_uuids(
+                context, instance_uuids):
+            bdms[bdm['instance_uuid']].append(bdm)
+        zones = ec2utils.get_availability_zones_by_hosts(
+                set(instance['host'] for instance in instances))
+
         for instance in instances:
-            if not context.is_admin:
-                if pipelib.is_vpn_image(instance['image_ref']):
-                    continue
             i = {}
             instance_uuid = instance['uuid']
-            ec2_id = ec2utils.id_to_ec2_inst_id(instance_uuid)
-            i['instanceId'] = ec2_id
-            image_uuid = instance['image_ref']
-            i['imageId'] = ec2utils.glance_id_to_ec2_id(context, image_uuid)
-            self._format_kernel_id(context, instance, i, 'kernelId')
-            self._format_ramdisk_id(context, instance, i, 'ramdiskId')
+            i['instanceId'] = ec2_ids[instance_uuid]
+            i['imageId'] = ec2utils.image_ec2_id(
+                    image_ids[instance['image_ref']])
+            self._format_kernel_id(context, instance, i, 'kernelId',
+                                   image_ids=image_ids)
+            self._format_ramdisk_id(context, instance, i, 'ramdiskId',
+                                    image_ids=image_ids)
             i['instanceState'] = _state_description(
                 instance['vm_state'], instance['shutdown_terminate'])
 
@@ -1172,8 +1251,7 @@ class CloudController(object):
             i['dnsName'] = i['publicDnsName'] or i['privateDnsName']
             i['keyName'] = instance['key_name']
             i['tagSet'] = []
-            for k, v in self.compute_api.get_instance_metadata(
-                    context, instance).iteritems():
+            for k, v in metadata[instance_uuid].iteritems():
                 i['tagSet'].append({'key': k, 'value': v})
 
             if context.is_admin:
@@ -1187,10 +1265,9 @@ class CloudController(object):
             i['amiLaunchIndex'] = instance['launch_index']
             self._format_instance_root_device_name(instance, i)
             self._format_instance_bdm(context, instance['uuid'],
-                                      i['rootDeviceName'], i)
-            host = instance['host']
-            zone = ec2utils.get_availability_zone_by_host(host)
-            i['placement'] = {'availabilityZone': zone}
+                                      i['rootDeviceName'], i,
+                                      bdms=bdms[instance_uuid])
+            i['placement'] = {'availabilityZone': zones[instance['host']]}
             if instance['reservation_id'] not in reservations:
                 r = {}
                 r['reservationId'] = instance['reservation_id']
@@ -16,41 +16,125 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import functools
 import re
 
+from oslo.config import cfg
+
 from nova import availability_zones
 from nova import context
 from nova import db
 from nova import exception
 from nova.network import model as network_model
 from nova.openstack.common import log as logging
-from nova.openstack.common import memorycache
 from nova.openstack.common import timeutils
 from nova.openstack.common import uuidutils
 
+ec2utils_opts = [
+    cfg.IntOpt('ec2_id_cache_size',
+               default=10000,
+               help='Number of mappings between EC2 ids and uuids cached '
+                    'by each EC2 API worker'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(ec2utils_opts)
+
 LOG = logging.getLogger(__name__)
-# NOTE(vish): cache mapping for one week
-_CACHE_TIME = 7 * 24 * 60 * 60
 _CACHE = None
 
 
+class _LRUCache(object):
+    """Bounded cache of the ID mappings, least recently used out first.
+
+    The mappings never change once created, so entries do not expire.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
+
+
+def _get_cache():
+    global _CACHE
+    if not _CACHE:
+        _CACHE = _LRUCache(CONF.ec2_id_cache_size)
+    return _CACHE
+
+
+def _cache_key(func, reqid):
+    return "%s:%s" % (func.__name__, reqid)
+
+
 def memoize(func):
     @functools.wraps(func)
     def memoizer(context, reqid):
-        global _CACHE
-        if not _CACHE:
-            _CACHE = memorycache.get_client()
-        key = "%s:%s" % (func.__name__, reqid)
-        key = str(key)
-        value = _CACHE.get(key)
+        cache = _get_cache()
+        key = _cache_key(func, reqid)
+        value = cache.get(key)
         if value is None:
             value = func(context, reqid)
-            _CACHE.set(key, value, time=_CACHE_TIME)
+            cache.set(key, value)
         return value
     return memoizer
 
 
+def _memoized_get_many(func, context, reqids, fetch_many):
+    """Look up reqids like the memoized func, fetching misses at once.
+
+    :param fetch_many: called with the context and the list of reqids
+                       missing from the cache, returns a dict of their
+                       values
+    :returns: dict of the values keyed by reqid
+    """
+    cache = _get_cache()
+    result = {}
+    misses = []
+    for reqid in set(reqids):
+        value = cache.get(_cache_key(func, reqid))
+        if value is None:
+            misses.append(reqid)
+        else:
+            result[reqid] = value
+    if misses:
+        for reqid, value in fetch_many(context, misses).iteritems():
+            cache.set(_cache_key(func, reqid), value)
+            result[reqid] = value
+    return result
+
+
+def get_cache_stats():
+    """Return the size and hit counters of the ID mapping cache."""
+    return _get_cache().get_stats()
+
+
 def reset_cache():
     global _CACHE
     _CACHE = None
@@ -115,6 +199,30 @@ def glance_id_to_id(context, glance_id):
         return db.s3_image_create(context, glance_id)['id']
 
 
+def _glance_ids_to_ids(context, glance_ids):
+    ids = {}
+    for s3_image in db.s3_image_get_all_by_uuids(context, glance_ids):
+        ids.setdefault(s3_image['uuid'], s3_image['id'])
+    missing = [glance_id for glance_id in glance_ids if glance_id not in ids]
+    if missing:
+        ids.update(db.s3_image_bulk_create(context, missing))
+    return ids
+
+
+def glance_ids_to_ids(context, glance_ids):
+    """Convert a list of glance ids to internal (db) ids.
+
+    :returns: dict of the internal ids keyed by glance id
+    """
+    ids = _memoized_get_many(glance_id_to_id, context,
+                             [glance_id for glance_id in glance_ids
+                              if glance_id is not None],
+                             _glance_ids_to_ids)
+    if None in glance_ids:
+        ids[None] = None
+    return ids
+
+
 def ec2_id_to_glance_id(context, ec2_id):
     image_id = ec2_id_to_id(ec2_id)
     return id_to_glance_id(context, image_id)
@@ -168,6 +276,11 @@ def get_availability_zone_by_host(host, conductor_api=None):
         context.get_admin_context(), host, conductor_api)
 
 
+def get_availability_zones_by_hosts(hosts):
+    return availability_zones.get_host_availability_zones(
+        context.get_admin_context(), hosts)
+
+
 def id_to_ec2_id(instance_id, template='i-%08x'):
     """Convert an instance ID (int) to an ec2 ID (i-[base 16 number])."""
     return template % int(instance_id)
@@ -185,6 +298,30 @@ def id_to_ec2_inst_id(instance_id):
         return id_to_ec2_id(instance_id)
 
 
+def _ids_to_ec2_ids(ids, get_int_ids, id_to_ec2_id_func, template):
+    ids = list(ids)
+    ctxt = context.get_admin_context()
+    int_ids = get_int_ids(ctxt, [resource_id for resource_id in ids
+                                 if uuidutils.is_uuid_like(resource_id)])
+    ec2_ids = {}
+    for resource_id in ids:
+        if resource_id in int_ids:
+            ec2_ids[resource_id] = id_to_ec2_id(int_ids[resource_id],
+                                                template)
+        else:
+            ec2_ids[resource_id] = id_to_ec2_id_func(resource_id)
+    return ec2_ids
+
+
+def ids_to_ec2_inst_ids(instance_ids):
+    """Get or create the ec2 instance IDs of a list of uuids.
+
+    :returns: dict of the ec2 IDs keyed by instance id
+    """
+    return _ids_to_ec2_ids(instance_ids, get_int_ids_from_instance_uuids,
+                           id_to_ec2_inst_id, 'i-%08x')
+
+
 def ec2_inst_id_to_uuid(context, ec2_id):
     """"Convert an instance id to uuid."""
     int_id = ec2_id_to_id(ec2_id)
@@ -216,6 +353,24 @@ def id_to_ec2_vol_id(volume_id):
         return id_to_ec2_id(volume_id, 'vol-%08x')
 
 
+def ids_to_ec2_snap_ids(snapshot_ids):
+    """Get or create the ec2 snapshot IDs of a list of uuids.
+
+    :returns: dict of the ec2 IDs keyed by snapshot id
+    """
+    return _ids_to_ec2_ids(snapshot_ids, get_int_ids_from_snapshot_uuids,
+                           id_to_ec2_snap_id, 'snap-%08x')
+
+
+def ids_to_ec2_vol_ids(volume_ids):
+    """Get or create the ec2 volume IDs of a list of uuids.
+
+    :returns: dict of the ec2 IDs keyed by volume id
+    """
+    return _ids_to_ec2_ids(volume_ids, get_int_ids_from_volume_uuids,
+                           id_to_ec2_vol_id, 'vol-%08x')
+
+
 def ec2_vol_id_to_uuid(ec2_id):
     """Get the corresponding UUID for the given ec2-id."""
     ctxt = context.get_admin_context()
@@ -278,6 +433,28 @@ def get_int_id_from_instance_uuid(context, instance_uuid):
         return db.ec2_instance_create(context, instance_uuid)['id']
 
 
+def _bulk_get_or_create(get_ids, bulk_create):
+    def get_or_create(context, uuids):
+        int_ids = get_ids(context, uuids)
+        missing = [uuid for uuid in uuids if uuid not in int_ids]
+        if missing:
+            int_ids.update(bulk_create(context, missing))
+        return int_ids
+    return get_or_create
+
+
+def get_int_ids_from_instance_uuids(context, instance_uuids):
+    """Get or create the internal ids of a list of instance uuids.
+
+    :returns: dict of the internal ids keyed by uuid
+    """
+    return _memoized_get_many(get_int_id_from_instance_uuid, context,
+                              instance_uuids,
+                              _bulk_get_or_create(
+                                db.get_ec2_instance_ids_by_uuids,
+                                db.ec2_instance_bulk_create))
+
+
 @memoize
 def get_int_id_from_volume_uuid(context, volume_uuid):
     if volume_uuid is None:
@@ -288,6 +465,18 @@ def get_int_id_from_volume_uuid(context, volume_uuid):
         return db.ec2_volume_create(context, volume_uuid)['id']
 
 
+def get_int_ids_from_volume_uuids(context, volume_uuids):
+    """Get or create the internal ids of a list of volume uuids.
+
+    :returns: dict of the internal ids keyed by uuid
+    """
+    return _memoized_get_many(get_int_id_from_volume_uuid, context,
+                              volume_uuids,
+                              _bulk_get_or_create(
+                                db.get_ec2_volume_ids_by_uuids,
+                                db.ec2_volume_bulk_create))
+
+
 @memoize
 def get_volume_uuid_from_int_id(context, int_id):
     return db.get_volume_uuid_by_ec2_id(context, int_id)
@@ -312,6 +501,18 @@ def get_int_id_from_snapshot_uuid(context, snapshot_uuid):
         return db.ec2_snapshot_create(context, snapshot_uuid)['id']
 
 
+def get_int_ids_from_snapshot_uuids(context, snapshot_uuids):
+    """Get or create the internal ids of a list of snapshot uuids.
+
+    :returns: dict of the internal ids keyed by uuid
+    """
+    return _memoized_get_many(get_int_id_from_snapshot_uuid, context,
+                              snapshot_uuids,
+                              _bulk_get_or_create(
+                                db.get_ec2_snapshot_ids_by_uuids,
+                                db.ec2_snapshot_bulk_create))
+
+
 @memoize
 def get_snapshot_uuid_from_int_id(context, int_id):
     return db.get_snapshot_uuid_by_ec2_id(context, int_id)
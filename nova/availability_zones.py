@@ -67,6 +67,19 @@ def get_host_availability_zone(context, host, conductor_api=None):
         return CONF.default_availability_zone
 
 
+def get_host_availability_zones(context, hosts):
+    """Return the availability zones of hosts, as a dict keyed by host."""
+    metadata = db.aggregate_host_get_by_metadata_key(context,
+            key='availability_zone')
+    zones = {}
+    for host in hosts:
+        if metadata.get(host):
+            zones[host] = list(metadata[host])[0]
+        else:
+            zones[host] = CONF.default_availability_zone
+    return zones
+
+
 def get_availability_zones(context):
     """Return available and unavailable zones."""
     enabled_services = db.service_get_all(context, False)
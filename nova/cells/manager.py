@@ -17,7 +17,6 @@
 Cells Service Manager
 """
 import datetime
-import time
 
 from oslo.config import cfg
 
@@ -64,7 +63,7 @@ class CellsManager(manager.Manager):
 
     Scheduling requests get passed to the scheduler class.
     """
-    RPC_API_VERSION = '1.7'
+    RPC_API_VERSION = '1.8'
 
     def __init__(self, *args, **kwargs):
         # Mostly for tests.
@@ -113,6 +112,8 @@ class CellsManager(manager.Manager):
 
         On every run of the periodic task, we will attempt to sync
         'CONF.cells.instance_update_num_instances' number of instances.
+        They are loaded with a single query and sent up in batches of
+        'CONF.cells.instance_update_batch_size'.
         When we get the list of instances, we shuffle them so that multiple
         nova-cells services aren't attempting to sync the same instances
         in lockstep.
@@ -151,31 +152,21 @@ class CellsManager(manager.Manager):
                     return
             return instance
 
-        rd_context = ctxt.elevated(read_deleted='yes')
-
+        instance_uuids = []
         for i in xrange(CONF.cells.instance_update_num_instances):
-            while True:
-                # Yield to other greenthreads
-                time.sleep(0)
-                instance_uuid = _next_instance()
-                if not instance_uuid:
-                    return
-                try:
-                    instance = self.db.instance_get_by_uuid(rd_context,
-                            instance_uuid)
-                except exception.InstanceNotFound:
-                    continue
-                self._sync_instance(ctxt, instance)
+            instance_uuid = _next_instance()
+            if not instance_uuid:
                 break
+            instance_uuids.append(instance_uuid)
+        if not instance_uuids:
+            return
 
-    def _sync_instance(self, ctxt, instance):
-        """Broadcast an instance_update or instance_destroy message up to
-        parent cells.
-        """
-        if instance['deleted']:
-            self.instance_destroy_at_top(ctxt, instance)
-        else:
-            self.instance_update_at_top(ctxt, instance)
+        # Fetch the whole batch with one query.  Instances that went
+        # away meanwhile are simply not part of it.
+        rd_context = ctxt.elevated(read_deleted='yes')
+        instances = self.db.instance_get_all_by_filters(rd_context,
+                {'uuid': instance_uuids}, 'deleted', 'asc')
+        self.msg_runner.sync_instances_at_top(ctxt, instances)
 
     def schedule_run_instance(self, ctxt, host_sched_kwargs):
         """Pick a cell (possibly ourselves) to build new instance(s)
@@ -230,17 +221,59 @@ class CellsManager(manager.Manager):
         self.msg_runner.sync_instances(ctxt, project_id, updated_since,
                                        deleted)
 
-    def service_get_all(self, ctxt, filters):
-        """Return services in this cell and in all child cells."""
+    def _get_partial_results(self, responses, partial):
+        """Return (cell_name, value) for the responses to a call to
+        several cells, and the names of the cells that did not respond
+        in time.
+
+        Timed out cells raise CellTimeout unless partial is set, or if
+        no cell other than our own responded.  Other failures are
+        raised.
+        """
+        results = []
+        timed_out = []
+        for response in responses:
+            try:
+                value = response.value_or_raise()
+            except exception.CellTimeout:
+                timed_out.append(response.cell_name)
+                continue
+            results.append((response.cell_name, value))
+        if timed_out:
+            other_cells = [cell_name for cell_name, _value in results
+                           if cell_name != self.msg_runner.our_name]
+            if not partial or not other_cells:
+                raise exception.CellTimeout(
+                        _("Timeout waiting for response from cells: "
+                          "%(cell_names)s") %
+                        {'cell_names': ', '.join(timed_out)})
+        return results, timed_out
+
+    @staticmethod
+    def _partial_response(value, timed_out, partial):
+        """Return value as is, or along with the names of the timed out
+        cells for partial calls.
+        """
+        if not partial:
+            return value
+        return {'results': value, 'timed_out_cells': timed_out}
+
+    def service_get_all(self, ctxt, filters, partial=False):
+        """Return services in this cell and in all child cells.
+
+        If partial is set, this returns a dict with the services as
+        'results' and the names of the cells that did not respond in
+        time as 'timed_out_cells', instead of raising CellTimeout.
+        """
         responses = self.msg_runner.service_get_all(ctxt, filters)
         ret_services = []
         # 1 response per cell.  Each response is a list of services.
-        for response in responses:
-            services = response.value_or_raise()
+        results, timed_out = self._get_partial_results(responses, partial)
+        for cell_name, services in results:
             for service in services:
-                cells_utils.add_cell_to_service(service, response.cell_name)
+                cells_utils.add_cell_to_service(service, cell_name)
                 ret_services.append(service)
-        return ret_services
+        return self._partial_response(ret_services, timed_out, partial)
 
     def service_get_by_compute_host(self, ctxt, host_name):
         """Return a service entry for a compute host in a certain cell."""
@@ -280,7 +313,8 @@ class CellsManager(manager.Manager):
         return response.value_or_raise()
 
     def task_log_get_all(self, ctxt, task_name, period_beginning,
-                         period_ending, host=None, state=None):
+                         period_ending, host=None, state=None,
+                         partial=False):
         """Get task logs from the DB from all cells or a particular
         cell.
 
@@ -290,6 +324,8 @@ class CellsManager(manager.Manager):
         the host if specified.
 
         'state' also may be None.  If it's not, filter by the state as well.
+
+        'partial' works as for service_get_all().
         """
         if host is None:
             cell_name = None
@@ -305,13 +341,12 @@ class CellsManager(manager.Manager):
         # 1 response per cell.  Each response is a list of task log
         # entries.
         ret_task_logs = []
-        for response in responses:
-            task_logs = response.value_or_raise()
+        results, timed_out = self._get_partial_results(responses, partial)
+        for cell_name, task_logs in results:
             for task_log in task_logs:
-                cells_utils.add_cell_to_task_log(task_log,
-                                                 response.cell_name)
+                cells_utils.add_cell_to_task_log(task_log, cell_name)
                 ret_task_logs.append(task_log)
-        return ret_task_logs
+        return self._partial_response(ret_task_logs, timed_out, partial)
 
     def compute_node_get(self, ctxt, compute_id):
         """Get a compute node by ID in a specific cell."""
@@ -323,31 +358,37 @@ class CellsManager(manager.Manager):
         cells_utils.add_cell_to_compute_node(node, cell_name)
         return node
 
-    def compute_node_get_all(self, ctxt, hypervisor_match=None):
-        """Return list of compute nodes in all cells."""
+    def compute_node_get_all(self, ctxt, hypervisor_match=None,
+                             partial=False):
+        """Return list of compute nodes in all cells.
+
+        'partial' works as for service_get_all().
+        """
         responses = self.msg_runner.compute_node_get_all(ctxt,
                 hypervisor_match=hypervisor_match)
         # 1 response per cell.  Each response is a list of compute_node
         # entries.
         ret_nodes = []
-        for response in responses:
-            nodes = response.value_or_raise()
+        results, timed_out = self._get_partial_results(responses, partial)
+        for cell_name, nodes in results:
             for node in nodes:
-                cells_utils.add_cell_to_compute_node(node,
-                                                     response.cell_name)
+                cells_utils.add_cell_to_compute_node(node, cell_name)
                 ret_nodes.append(node)
-        return ret_nodes
+        return self._partial_response(ret_nodes, timed_out, partial)
 
-    def compute_node_stats(self, ctxt):
-        """Return compute node stats totals from all cells."""
+    def compute_node_stats(self, ctxt, partial=False):
+        """Return compute node stats totals from all cells.
+
+        'partial' works as for service_get_all().
+        """
         responses = self.msg_runner.compute_node_stats(ctxt)
         totals = {}
-        for response in responses:
-            data = response.value_or_raise()
+        results, timed_out = self._get_partial_results(responses, partial)
+        for _cell_name, data in results:
             for key, val in data.iteritems():
                 totals.setdefault(key, 0)
                 totals[key] += val
-        return totals
+        return self._partial_response(totals, timed_out, partial)
 
     def actions_get(self, ctxt, cell_name, instance_uuid):
         response = self.msg_runner.actions_get(ctxt, cell_name, instance_uuid)
@@ -23,6 +23,7 @@ reached.
 The interface into this module is the MessageRunner class.
 """
 import sys
+import time
 
 from eventlet import queue
 from oslo.config import cfg
@@ -53,15 +54,27 @@ cell_messaging_opts = [
             help='Maximum number of hops for cells routing.'),
     cfg.StrOpt('scheduler',
             default='nova.cells.scheduler.CellsScheduler',
-            help='Cells scheduler to use')]
+            help='Cells scheduler to use'),
+    cfg.FloatOpt('broadcast_call_timeout',
+            default=30.0,
+            help='Seconds to wait for all cells to respond to a call '
+                 'broadcast to them.  Cells that have not responded by '
+                 'then are returned as timed out, along with the results '
+                 'of the others.')]
 
 CONF = cfg.CONF
 CONF.import_opt('name', 'nova.cells.opts', group='cells')
 CONF.import_opt('call_timeout', 'nova.cells.opts', group='cells')
+CONF.import_opt('instance_update_batch_size', 'nova.cells.opts',
+                group='cells')
 CONF.register_opts(cell_messaging_opts, group='cells')
 
 LOG = logging.getLogger(__name__)
 
+# Every hop gives the next hops this share of the time it has left to
+# respond to a broadcast call, so that their results still get to it.
+_HOP_TIMEOUT_FACTOR = 0.8
+
 # Separator used between cell names for the 'full cell name' and routing
 # path.
 _PATH_CELL_SEP = cells_utils._PATH_CELL_SEP
@@ -229,7 +242,8 @@ class _BaseMessage(object):
         wait_time = CONF.cells.call_timeout
         try:
             for x in xrange(num_responses):
-                json_responses = self.resp_queue.get(timeout=wait_time)
+                _sender, json_responses = self.resp_queue.get(
+                        timeout=wait_time)
                 responses.extend(json_responses)
         except queue.Empty:
             raise exception.CellTimeout()
@@ -237,6 +251,32 @@ class _BaseMessage(object):
             self._cleanup_response_queue()
         return responses
 
+    def _wait_for_json_responses_until(self, next_hops, deadline):
+        """Wait for responses from the next hops until the time.time()
+        deadline, taking each one as it arrives.  Return the combined
+        list of JSON-ified responses and the names of the next hops that
+        did not respond in time.
+
+        Destroy the eventlet queue when done.
+        """
+        responses = []
+        pending = set(next_hop.name for next_hop in next_hops)
+        try:
+            while pending:
+                wait_time = deadline - time.time()
+                if wait_time <= 0:
+                    break
+                try:
+                    sender, json_responses = self.resp_queue.get(
+                            timeout=wait_time)
+                except queue.Empty:
+                    break
+                pending.discard(sender)
+                responses.extend(json_responses)
+        finally:
+            self._cleanup_response_queue()
+        return responses, pending
+
     def _send_json_responses(self, json_responses, neighbor_only=False,
             fanout=False):
         """Send list of responses to this message.  Responses passed here
@@ -447,13 +487,18 @@ class _BroadcastMessage(_BaseMessage):
     message_type = 'broadcast'
 
     def __init__(self, msg_runner, ctxt, method_name, method_kwargs,
-            direction, run_locally=True, **kwargs):
+            direction, run_locally=True, response_timeout=None, **kwargs):
         super(_BroadcastMessage, self).__init__(msg_runner, ctxt,
                 method_name, method_kwargs, direction, **kwargs)
         # The local cell creating this message has the option
         # to be able to process the message locally or not.
         self.run_locally = run_locally
         self.is_broadcast = True
+        # Seconds this hop has to send back its responses, if needed
+        if response_timeout is None:
+            response_timeout = CONF.cells.broadcast_call_timeout
+        self.response_timeout = response_timeout
+        self.base_attrs_to_json.append('response_timeout')
 
     def _get_next_hops(self):
         """Set the next hops and return the number of hops.  The next
@@ -494,6 +539,12 @@ class _BroadcastMessage(_BaseMessage):
         single list and are returned to the neighbor cell until the
         source is reached.
 
+        Each hop only waits for response_timeout seconds, and gives the
+        next hops a share of that.  Responses are taken as they arrive,
+        and a neighbor cell that has not responded by then is returned
+        as a CellTimeout failure for that cell, so that one slow cell
+        only costs the results of its own part of the tree.
+
         When the source is reached, a list of Response instances are
         returned to the caller.
 
@@ -520,6 +571,8 @@ class _BroadcastMessage(_BaseMessage):
 
         # We'll need to aggregate all of the responses (from ourself
         # and our sibling cells) into 1 response
+        deadline = time.time() + self.response_timeout
+        self.response_timeout *= _HOP_TIMEOUT_FACTOR
         try:
             self._setup_response_queue()
             self._send_to_cells(next_hops)
@@ -539,17 +592,30 @@ class _BroadcastMessage(_BaseMessage):
             local_response = None
 
         try:
-            remote_responses = self._wait_for_json_responses(
-                    num_responses=len(next_hops))
+            remote_responses, timed_out = (
+                    self._wait_for_json_responses_until(next_hops,
+                                                        deadline))
         except Exception as exc:
-            # Error waiting for responses, most likely a timeout.
-            # Send a single response back with the failure.
+            # Error waiting for responses.  Send a single response back
+            # with the failure.
             exc_info = sys.exc_info()
             err_str = _("Error waiting for responses from neighbor cells: "
                         "%(exc)s")
             LOG.exception(err_str, {'exc': exc})
             return self._send_response_from_exception(exc_info)
 
+        for cell_name in sorted(timed_out):
+            LOG.warning(_("Timed out waiting for cell %(cell_name)s to "
+                          "respond to %(method_name)s"),
+                        {'cell_name': cell_name,
+                         'method_name': self.method_name})
+            try:
+                raise exception.CellTimeout()
+            except exception.CellTimeout:
+                response = Response(self.routing_path + _PATH_CELL_SEP +
+                                    cell_name, sys.exc_info(), True)
+            remote_responses.append(response.to_json())
+
         if local_response:
             remote_responses.append(local_response.to_json())
         return self._send_json_responses(remote_responses)
@@ -636,8 +702,11 @@ class _ResponseMessageMethods(_BaseMessageMethods):
     eventlet queue to signal the caller that's waiting.
     """
     def parse_responses(self, message, orig_message, responses):
+        # The response came straight from the neighbor cell it names
+        # first, at least for responses to broadcasts
+        sender = message.routing_path.split(_PATH_CELL_SEP)[0]
         self.msg_runner._put_response(message.response_uuid,
-                responses)
+                responses, sender=sender)
 
 
 class _TargetedMessageMethods(_BaseMessageMethods):
@@ -786,10 +855,10 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
         """Are we the API level?"""
         return not self.state_manager.get_parent_cells()
 
-    def instance_update_at_top(self, message, instance, **kwargs):
-        """Update an instance in the DB if we're a top level cell."""
-        if not self._at_the_top():
-            return
+    def _prepare_instance_update(self, message, instance):
+        """Turn an instance coming from a child cell into the values to
+        update it with at the top, and return its info_cache.
+        """
         instance_uuid = instance['uuid']
 
         # Remove things that we can't update in the top level cells.
@@ -833,6 +902,14 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
                 instance.get('vm_state'))
         if expected_vm_states:
                 instance['expected_vm_state'] = expected_vm_states
+        return info_cache
+
+    def instance_update_at_top(self, message, instance, **kwargs):
+        """Update an instance in the DB if we're a top level cell."""
+        if not self._at_the_top():
+            return
+        instance_uuid = instance['uuid']
+        info_cache = self._prepare_instance_update(message, instance)
 
         # It's possible due to some weird condition that the instance
         # was already set as deleted... so we'll attempt to update
@@ -854,6 +931,23 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
                 # network information.
                 pass
 
+    def instances_update_at_top(self, message, instances, **kwargs):
+        """Update a batch of instances in the DB in one transaction if
+        we're a top level cell.  Instances whose vm_state does not allow
+        the update are skipped without failing the rest of the batch.
+        """
+        if not self._at_the_top():
+            return
+        updates = []
+        for instance in instances:
+            info_cache = self._prepare_instance_update(message, instance)
+            updates.append((instance['uuid'], instance, info_cache or None))
+        with utils.temporary_mutation(message.ctxt, read_deleted="yes"):
+            skipped = self.db.instance_bulk_update(message.ctxt, updates)
+        LOG.debug(_("Updated %(updated)d of %(total)d instances"),
+                  {'updated': len(updates) - len(skipped),
+                   'total': len(updates)})
+
     def instance_destroy_at_top(self, message, instance, **kwargs):
         """Destroy an instance from the DB if we're a top level cell."""
         if not self._at_the_top():
@@ -899,12 +993,6 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
             return
         self.db.bw_usage_update(message.ctxt, **bw_update_info)
 
-    def _sync_instance(self, ctxt, instance):
-        if instance['deleted']:
-            self.msg_runner.instance_destroy_at_top(ctxt, instance)
-        else:
-            self.msg_runner.instance_update_at_top(ctxt, instance)
-
     def sync_instances(self, message, project_id, updated_since, deleted,
                        **kwargs):
         projid_str = project_id is None and "<all>" or project_id
@@ -917,8 +1005,7 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
         instances = cells_utils.get_instances_to_sync(message.ctxt,
                 updated_since=updated_since, project_id=project_id,
                 deleted=deleted)
-        for instance in instances:
-            self._sync_instance(message.ctxt, instance)
+        self.msg_runner.sync_instances_at_top(message.ctxt, instances)
 
     def service_get_all(self, message, filters):
         if filters is None:
@@ -1012,8 +1099,9 @@ class MessageRunner(object):
         fn = getattr(methods, message.method_name)
         return fn(message, **message.method_kwargs)
 
-    def _put_response(self, response_uuid, response):
-        """Put a response into a response queue.  This is called when
+    def _put_response(self, response_uuid, response, sender=None):
+        """Put a response into a response queue, along with the name of
+        the neighbor cell that sent it.  This is called when
         a _ResponseMessage is processed in the cell that initiated a
         'call' to another cell.
         """
@@ -1022,7 +1110,7 @@ class MessageRunner(object):
             # Response queue is gone.  We must have restarted or we
             # received a response after our timeout period.
             return
-        resp_queue.put(response)
+        resp_queue.put((sender, response))
 
     def _setup_response_queue(self, message):
         """Set up an eventlet queue to use to wait for replies.
@@ -1146,6 +1234,32 @@ class MessageRunner(object):
                                     run_locally=False)
         message.process()
 
+    def instances_update_at_top(self, ctxt, instances):
+        """Update instances at the top level cell, sending
+        CONF.cells.instance_update_batch_size of them per message.
+        """
+        batch_size = max(CONF.cells.instance_update_batch_size, 1)
+        for i in xrange(0, len(instances), batch_size):
+            method_kwargs = dict(instances=instances[i:i + batch_size])
+            message = _BroadcastMessage(self, ctxt,
+                                        'instances_update_at_top',
+                                        method_kwargs, 'up',
+                                        run_locally=False)
+            message.process()
+
+    def sync_instances_at_top(self, ctxt, instances):
+        """Send updates for instances to the top level cell: batched
+        updates for the active ones, and a destroy for each deleted one.
+        """
+        to_update = []
+        for instance in instances:
+            if instance['deleted']:
+                self.instance_destroy_at_top(ctxt, instance)
+            else:
+                to_update.append(instance)
+        if to_update:
+            self.instances_update_at_top(ctxt, to_update)
+
     def instance_destroy_at_top(self, ctxt, instance):
         """Destroy an instance at the top level cell."""
         message = _BroadcastMessage(self, ctxt, 'instance_destroy_at_top',
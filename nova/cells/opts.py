@@ -43,6 +43,10 @@ cells_opts = [
                 default=10.0,
                 help='Percentage of cell capacity to hold in reserve. '
                      'Affects both memory and disk utilization'),
+    cfg.IntOpt('instance_update_batch_size',
+                default=100,
+                help='Maximum number of instance updates sent to parent '
+                     'cells in a single message'),
 ]
 
 cfg.CONF.register_opts(cells_opts, group='cells')
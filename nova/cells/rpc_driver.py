@@ -16,9 +16,15 @@
 """
 Cells RPC Communication Driver
 """
+import base64
+import copy
+import zlib
+
+import eventlet
 from oslo.config import cfg
 
 from nova.cells import driver
+from nova.openstack.common import log as logging
 from nova.openstack.common import rpc
 from nova.openstack.common.rpc import dispatcher as rpc_dispatcher
 from nova.openstack.common.rpc import proxy as rpc_proxy
@@ -28,14 +34,35 @@ cell_rpc_driver_opts = [
                    default='cells.intercell',
                    help="Base queue name to use when communicating between "
                         "cells.  Various topics by message type will be "
-                        "appended to this.")]
+                        "appended to this."),
+        cfg.FloatOpt('rpc_driver_coalesce_interval',
+                   default=0.0,
+                   help="Seconds to hold back instance updates for parent "
+                        "cells, so that a newer update for the same "
+                        "instance replaces a pending one.  0 sends every "
+                        "update right away.  Only set this once all cells "
+                        "understand instances_update_at_top."),
+        cfg.IntOpt('rpc_driver_compress_threshold',
+                   default=0,
+                   help="Compress messages to other cells whose JSON is "
+                        "larger than this many bytes.  0 disables "
+                        "compression.  All cells need to understand "
+                        "compressed messages before this is enabled.")]
+
+LOG = logging.getLogger(__name__)
 
 CONF = cfg.CONF
 CONF.register_opts(cell_rpc_driver_opts, group='cells')
 CONF.import_opt('call_timeout', 'nova.cells.opts', group='cells')
+CONF.import_opt('instance_update_batch_size', 'nova.cells.opts',
+                group='cells')
 
 _CELL_TO_CELL_RPC_API_VERSION = '1.0'
 
+# Broadcast methods whose pending messages may be merged per instance
+_COALESCED_METHODS = {'instance_update_at_top': 'instance',
+                      'instances_update_at_top': 'instances'}
+
 
 class CellsRPCDriver(driver.BaseCellsDriver):
     """Driver for cell<->cell communication via RPC.  This is used to
@@ -47,6 +74,13 @@ class CellsRPCDriver(driver.BaseCellsDriver):
 
     One instance is also created by the cells manager for setting up
     the consumers.
+
+    Instance updates going up to parent cells are not sent right away.
+    They are queued for CONF.cells.rpc_driver_coalesce_interval seconds,
+    and an update for an instance that is already queued is merged into
+    the pending one, its fields winning over the older ones.  The queue
+    is sent as batched 'instances_update_at_top' messages, and before
+    any other message so that ordering is kept.
     """
     BASE_RPC_API_VERSION = _CELL_TO_CELL_RPC_API_VERSION
 
@@ -55,6 +89,15 @@ class CellsRPCDriver(driver.BaseCellsDriver):
         self.rpc_connections = []
         self.intercell_rpcapi = InterCellRPCAPI(
                 self.BASE_RPC_API_VERSION)
+        # (routing_path, instance uuid) -> merged instance, and
+        # routing_path -> (cell_state, latest message)
+        self._pending_updates = {}
+        self._pending_messages = {}
+        self._flusher = None
+        self._stats = {'updates_queued': 0,
+                       'updates_coalesced': 0,
+                       'updates_sent': 0,
+                       'messages_sent': 0}
 
     def _start_consumer(self, dispatcher, topic):
         """Start an RPC consumer."""
@@ -92,8 +135,99 @@ class CellsRPCDriver(driver.BaseCellsDriver):
             conn.close()
 
     def send_message_to_cell(self, cell_state, message):
-        """Use the IntercellRPCAPI to send a message to a cell."""
+        """Use the IntercellRPCAPI to send a message to a cell.  Instance
+        updates are queued to be coalesced instead, see the class
+        docstring.
+        """
+        if self._should_coalesce(message):
+            self._queue_update(cell_state, message)
+            return
+        self.flush()
+        self._send(cell_state, message)
+
+    def _send(self, cell_state, message):
         self.intercell_rpcapi.send_message_to_cell(cell_state, message)
+        self._stats['messages_sent'] += 1
+
+    @staticmethod
+    def _should_coalesce(message):
+        return (CONF.cells.rpc_driver_coalesce_interval > 0 and
+                message.message_type == 'broadcast' and
+                message.direction == 'up' and
+                not message.need_response and
+                message.method_name in _COALESCED_METHODS)
+
+    def _queue_update(self, cell_state, message):
+        kwarg = _COALESCED_METHODS[message.method_name]
+        instances = message.method_kwargs[kwarg]
+        if kwarg == 'instance':
+            instances = [instances]
+        # Instances are attributed to the cell the message came from,
+        # so only updates with the same routing path can be merged.
+        routing_path = message.routing_path
+        for instance in instances:
+            self._stats['updates_queued'] += 1
+            key = (routing_path, instance['uuid'])
+            pending = self._pending_updates.get(key)
+            if pending is None:
+                self._pending_updates[key] = dict(instance)
+            else:
+                self._stats['updates_coalesced'] += 1
+                pending.update(instance)
+        self._pending_messages[routing_path] = (cell_state, message)
+        if self._flusher is None:
+            self._flusher = eventlet.spawn_after(
+                    CONF.cells.rpc_driver_coalesce_interval,
+                    self._flush_from_timer)
+
+    def _flush_from_timer(self):
+        self._flusher = None
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception(_("Error sending queued instance updates"))
+
+    def flush(self):
+        """Send the queued instance updates, grouped by the routing path
+        they came in on, in messages of at most
+        CONF.cells.instance_update_batch_size instances.
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if not self._pending_updates:
+            return
+        pending_updates = self._pending_updates
+        pending_messages = self._pending_messages
+        self._pending_updates = {}
+        self._pending_messages = {}
+
+        by_path = {}
+        for (routing_path, _uuid), instance in pending_updates.iteritems():
+            by_path.setdefault(routing_path, []).append(instance)
+        batch_size = max(CONF.cells.instance_update_batch_size, 1)
+        for routing_path, instances in by_path.iteritems():
+            cell_state, template = pending_messages[routing_path]
+            for i in xrange(0, len(instances), batch_size):
+                batch = instances[i:i + batch_size]
+                # Copy the latest queued message, so the batch goes on
+                # with its context, routing path and hop count
+                message = copy.copy(template)
+                message.method_name = 'instances_update_at_top'
+                message.method_kwargs = dict(instances=batch)
+                self._send(cell_state, message)
+                self._stats['updates_sent'] += len(batch)
+        LOG.debug(_("Sent queued instance updates: %s"), self.get_stats())
+
+    def get_stats(self):
+        """Return counters for the outbound queue of this cell."""
+        stats = dict(self._stats)
+        stats['queue_depth'] = len(self._pending_updates)
+        stats['compressed'] = self.intercell_rpcapi.compressed
+        queued = stats['updates_queued']
+        stats['coalescing_ratio'] = (
+                queued and float(stats['updates_coalesced']) / queued)
+        return stats
 
 
 class InterCellRPCAPI(rpc_proxy.RpcProxy):
@@ -103,9 +237,11 @@ class InterCellRPCAPI(rpc_proxy.RpcProxy):
 
     API version history:
         1.0 - Initial version.
+        1.1 - Adds process_compressed_message()
     """
     def __init__(self, default_version):
         super(InterCellRPCAPI, self).__init__(None, default_version)
+        self.compressed = 0
 
     @staticmethod
     def _get_server_params_for_cell(next_hop):
@@ -131,16 +267,38 @@ class InterCellRPCAPI(rpc_proxy.RpcProxy):
         """
         ctxt = message.ctxt
         json_message = message.to_json()
-        rpc_message = self.make_msg('process_message', message=json_message)
+        threshold = CONF.cells.rpc_driver_compress_threshold
+        if threshold and len(json_message) > threshold:
+            rpc_message = self.make_msg('process_compressed_message',
+                    message=compress_message(json_message))
+            version = '1.1'
+            self.compressed += 1
+        else:
+            rpc_message = self.make_msg('process_message',
+                                        message=json_message)
+            version = None
         topic_base = CONF.cells.rpc_driver_queue_base
         topic = '%s.%s' % (topic_base, message.message_type)
         server_params = self._get_server_params_for_cell(cell_state)
+        kwargs = {'topic': topic}
+        if version:
+            kwargs['version'] = version
         if message.fanout:
             self.fanout_cast_to_server(ctxt, server_params,
-                    rpc_message, topic=topic)
+                    rpc_message, **kwargs)
         else:
             self.cast_to_server(ctxt, server_params,
-                    rpc_message, topic=topic)
+                    rpc_message, **kwargs)
+
+
+def compress_message(json_message):
+    """Compress a JSON message so it can be passed through RPC."""
+    return base64.b64encode(zlib.compress(json_message))
+
+
+def decompress_message(compressed_message):
+    """Undo compress_message()."""
+    return zlib.decompress(base64.b64decode(compressed_message))
 
 
 class InterCellRPCDispatcher(object):
@@ -152,6 +310,7 @@ class InterCellRPCDispatcher(object):
     logic is defined by the message class in the messaging module.
     """
     BASE_RPC_API_VERSION = _CELL_TO_CELL_RPC_API_VERSION
+    RPC_API_VERSION = '1.1'
 
     def __init__(self, msg_runner):
         """Init the Intercell RPC Dispatcher."""
@@ -164,3 +323,9 @@ class InterCellRPCDispatcher(object):
         """
         message = self.msg_runner.message_from_json(message)
         message.process()
+
+    def process_compressed_message(self, _ctxt, message):
+        """Same as process_message() for a message compressed with
+        compress_message().
+        """
+        self.process_message(_ctxt, decompress_message(message))
@@ -50,6 +50,8 @@ class CellsAPI(rpc_proxy.RpcProxy):
               action_events_get()
         1.6 - Adds consoleauth_delete_tokens() and validate_console_port()
         1.7 - Adds service_update()
+        1.8 - Adds partial to service_get_all(), task_log_get_all(),
+              compute_node_get_all() and compute_node_stats()
     '''
     BASE_RPC_API_VERSION = '1.0'
 
@@ -165,12 +167,27 @@ class CellsAPI(rpc_proxy.RpcProxy):
                                              deleted=deleted),
                          version='1.1')
 
-    def service_get_all(self, ctxt, filters=None):
-        """Ask all cells for their list of services."""
-        return self.call(ctxt,
-                         self.make_msg('service_get_all',
-                                       filters=filters),
-                         version='1.2')
+    def _call_partial(self, ctxt, msg, version, partial):
+        """Call a method that returns the results of all cells, asking
+        for partial results if requested.
+        """
+        if partial:
+            msg['args']['partial'] = True
+            version = '1.8'
+        return self.call(ctxt, msg, version=version)
+
+    def service_get_all(self, ctxt, filters=None, partial=False):
+        """Ask all cells for their list of services.
+
+        If partial is set, cells that do not respond in time are left out
+        and a dict is returned with the services as 'results' and the
+        names of those cells as 'timed_out_cells'.  Otherwise they raise
+        CellTimeout.
+        """
+        return self._call_partial(ctxt,
+                                  self.make_msg('service_get_all',
+                                                filters=filters),
+                                  '1.2', partial)
 
     def service_get_by_compute_host(self, ctxt, host_name):
         """Get the service entry for a host in a particular cell.  The
@@ -209,14 +226,19 @@ class CellsAPI(rpc_proxy.RpcProxy):
                          version='1.2')
 
     def task_log_get_all(self, ctxt, task_name, period_beginning,
-                         period_ending, host=None, state=None):
-        """Get the task logs from the DB in child cells."""
-        return self.call(ctxt, self.make_msg('task_log_get_all',
-                                   task_name=task_name,
-                                   period_beginning=period_beginning,
-                                   period_ending=period_ending,
-                                   host=host, state=state),
-                         version='1.3')
+                         period_ending, host=None, state=None,
+                         partial=False):
+        """Get the task logs from the DB in child cells.
+
+        'partial' works as for service_get_all().
+        """
+        return self._call_partial(ctxt,
+                                  self.make_msg('task_log_get_all',
+                                      task_name=task_name,
+                                      period_beginning=period_beginning,
+                                      period_ending=period_ending,
+                                      host=host, state=state),
+                                  '1.3', partial)
 
     def compute_node_get(self, ctxt, compute_id):
         """Get a compute node by ID in a specific cell."""
@@ -224,19 +246,25 @@ class CellsAPI(rpc_proxy.RpcProxy):
                                              compute_id=compute_id),
                          version='1.4')
 
-    def compute_node_get_all(self, ctxt, hypervisor_match=None):
+    def compute_node_get_all(self, ctxt, hypervisor_match=None,
+                             partial=False):
         """Return list of compute nodes in all cells, optionally
         filtering by hypervisor host.
+
+        'partial' works as for service_get_all().
         """
-        return self.call(ctxt,
-                         self.make_msg('compute_node_get_all',
-                                       hypervisor_match=hypervisor_match),
-                         version='1.4')
+        return self._call_partial(ctxt,
+                                  self.make_msg('compute_node_get_all',
+                                      hypervisor_match=hypervisor_match),
+                                  '1.4', partial)
 
-    def compute_node_stats(self, ctxt):
-        """Return compute node stats from all cells."""
-        return self.call(ctxt, self.make_msg('compute_node_stats'),
-                         version='1.4')
+    def compute_node_stats(self, ctxt, partial=False):
+        """Return compute node stats from all cells.
+
+        'partial' works as for service_get_all().
+        """
+        return self._call_partial(ctxt, self.make_msg('compute_node_stats'),
+                                  '1.4', partial)
 
     def actions_get(self, ctxt, instance):
         if not instance['cell_name']:
@@ -117,6 +117,13 @@ class CellStateManager(base.Base):
         self.my_cell_state = cell_state_cls(CONF.cells.name, is_me=True)
         self.parent_cells = {}
         self.child_cells = {}
+        # Cache for _update_our_capacity(): the reserve level and flavor
+        # sizes the units were computed for, the units of each compute
+        # host and their sums over all hosts
+        self._unit_sizes = None
+        self._host_units = {}
+        self._ram_units = []
+        self._disk_units = []
         self.last_cell_db_check = datetime.datetime.min
         self._cell_db_sync()
         my_cell_capabs = {}
@@ -195,6 +202,13 @@ class CellStateManager(base.Base):
 
         NOTE(comstud): Perhaps we should only report a single number
         available per instance_type.
+
+        Units are computed once per distinct flavor size and cached per
+        compute host, so only the hosts whose resources changed since
+        the last update are computed again.  The compute nodes and
+        instance types are still read from the DB on every update: they
+        are how changes are found, as nothing tells the cells service
+        when a host's free resources or the flavors change.
         """
 
         reserve_level = CONF.cells.reserve_percent / 100.0
@@ -215,42 +229,77 @@ class CellStateManager(base.Base):
 
         _get_compute_hosts()
         if not compute_hosts:
+            self._unit_sizes = None
+            self._host_units = {}
             self.my_cell_state.update_capacities({})
             return
 
-        ram_mb_free_units = {}
-        disk_mb_free_units = {}
-        total_ram_mb_free = 0
-        total_disk_mb_free = 0
-
-        def _free_units(total, free, per_inst):
-            if per_inst:
-                min_free = total * reserve_level
-                free = max(0, free - min_free)
-                return int(free / per_inst)
-            else:
-                return 0
-
-        def _update_from_values(values, instance_type):
+        # Units are reported per size, added up over the flavors of
+        # that size, so keep the number of flavors for every size.
+        ram_flavors = {}
+        disk_flavors = {}
+        instance_types = self.db.instance_type_get_all(context)
+        for instance_type in instance_types:
             memory_mb = instance_type['memory_mb']
             disk_mb = (instance_type['root_gb'] +
                     instance_type['ephemeral_gb']) * 1024
-            ram_mb_free_units.setdefault(str(memory_mb), 0)
-            disk_mb_free_units.setdefault(str(disk_mb), 0)
-            ram_free_units = _free_units(compute_values['total_ram_mb'],
-                    compute_values['free_ram_mb'], memory_mb)
-            disk_free_units = _free_units(compute_values['total_disk_mb'],
-                    compute_values['free_disk_mb'], disk_mb)
-            ram_mb_free_units[str(memory_mb)] += ram_free_units
-            disk_mb_free_units[str(disk_mb)] += disk_free_units
-
-        instance_types = self.db.instance_type_get_all(context)
+            ram_flavors[memory_mb] = ram_flavors.get(memory_mb, 0) + 1
+            disk_flavors[disk_mb] = disk_flavors.get(disk_mb, 0) + 1
+        ram_sizes = sorted(ram_flavors)
+        disk_sizes = sorted(disk_flavors)
+
+        unit_sizes = (reserve_level, ram_sizes, disk_sizes)
+        if unit_sizes != self._unit_sizes:
+            # All the cached units are for other sizes
+            self._unit_sizes = unit_sizes
+            self._host_units = {}
+            self._ram_units = [0] * len(ram_sizes)
+            self._disk_units = [0] * len(disk_sizes)
+
+        def _free_units(total, free, sizes):
+            free = max(0, free - total * reserve_level)
+            return [per_inst and int(free / per_inst) for per_inst in sizes]
+
+        def _add_units(sums, units, sign):
+            for i, unit in enumerate(units):
+                sums[i] += sign * unit
+
+        changed = 0
+        for host in set(self._host_units) - set(compute_hosts):
+            compute_values, ram_units, disk_units = self._host_units.pop(
+                    host)
+            _add_units(self._ram_units, ram_units, -1)
+            _add_units(self._disk_units, disk_units, -1)
+        for host, compute_values in compute_hosts.iteritems():
+            cached = self._host_units.get(host)
+            if cached is not None:
+                if cached[0] == compute_values:
+                    continue
+                _add_units(self._ram_units, cached[1], -1)
+                _add_units(self._disk_units, cached[2], -1)
+            changed += 1
+            ram_units = _free_units(compute_values['total_ram_mb'],
+                    compute_values['free_ram_mb'], ram_sizes)
+            disk_units = _free_units(compute_values['total_disk_mb'],
+                    compute_values['free_disk_mb'], disk_sizes)
+            _add_units(self._ram_units, ram_units, 1)
+            _add_units(self._disk_units, disk_units, 1)
+            self._host_units[host] = (compute_values, ram_units, disk_units)
+        LOG.debug(_("Updated capacity of %(changed)d of %(total)d compute "
+                    "hosts"),
+                  {'changed': changed, 'total': len(compute_hosts)})
 
-        for compute_values in compute_hosts.values():
+        total_ram_mb_free = 0
+        total_disk_mb_free = 0
+        for compute_values in compute_hosts.itervalues():
             total_ram_mb_free += compute_values['free_ram_mb']
             total_disk_mb_free += compute_values['free_disk_mb']
-            for instance_type in instance_types:
-                _update_from_values(compute_values, instance_type)
+        ram_mb_free_units = dict(
+                (str(size), units * ram_flavors[size])
+                for size, units in zip(ram_sizes, self._ram_units))
+        disk_mb_free_units = dict(
+                (str(size), units * disk_flavors[size])
+                for size, units in zip(disk_sizes, self._disk_units))
 
         capacities = {'ram_free': {'total_mb': total_ram_mb_free,
                                    'units_by_mb': ram_mb_free_units},
@@ -18,6 +18,8 @@
 """Starter script for Bare-Metal Deployment Service."""
 
 
+import contextlib
+import errno
 import os
 import sys
 import threading
@@ -30,18 +32,74 @@ import socket
 import stat
 from wsgiref import simple_server
 
+from oslo.config import cfg
+
 from nova import config
 from nova import context as nova_context
+from nova import exception
+from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import processutils
+from nova.openstack.common import timeutils
 from nova import utils
 from nova.virt.baremetal import baremetal_states
 from nova.virt.baremetal import db
-
+from nova.virt.baremetal import deploy_waiter
+from nova.virt import images
+
+
+opts = [
+    cfg.IntOpt('deploy_workers',
+               default=4,
+               help='Number of deployments nova-baremetal-deploy-helper '
+                    'runs in parallel'),
+    cfg.BoolOpt('deploy_skip_zeros',
+                default=False,
+                help='Only write the parts of raw images that hold data. '
+                     'Holes and zero filled blocks are not written, so '
+                     'they keep what the disk held before; only enable '
+                     'this if the target disks read back zeros'),
+    ]
+
+baremetal_group = cfg.OptGroup(name='baremetal',
+                               title='Baremetal Options')
+
+CONF = cfg.CONF
+CONF.register_group(baremetal_group)
+CONF.register_opts(opts, baremetal_group)
 
 QUEUE = Queue.Queue()
 LOG = logging.getLogger(__name__)
 
+# Images are written in blocks of this size
+BLOCK_SIZE = 1024 * 1024
+# Runs of data separated by at most this many empty blocks are written
+# with a single dd, which is cheaper than starting another one.
+MERGE_GAP_BLOCKS = 16
+
+# From <unistd.h>; lseek() whence values to find data and holes in files
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
+# Deploy record of the deployment running in the current worker thread
+_CURRENT = threading.local()
+
+
+@contextlib.contextmanager
+def _phase(name):
+    """Account the time spent in the enclosed block to a deploy phase."""
+    tracker = getattr(_CURRENT, 'tracker', None)
+    if tracker is None:
+        yield
+        return
+    record = _CURRENT.record
+    record['phase'] = name
+    start = time.time()
+    try:
+        yield
+    finally:
+        tracker.add_phase_time(name, time.time() - start)
+
 
 # All functions are called from deploy() directly or indirectly.
 # They are split for stub-out.
@@ -101,15 +159,129 @@ def is_block_device(dev):
     return stat.S_ISBLK(s.st_mode)
 
 
-def dd(src, dst):
-    """Execute dd from src to dst."""
-    utils.execute('dd',
-                  'if=%s' % src,
-                  'of=%s' % dst,
-                  'bs=1M',
-                  'oflag=direct',
-                  run_as_root=True,
-                  check_exit_code=[0])
+def get_data_ranges(path):
+    """Return the (offset, end) byte ranges of a file that are not holes.
+
+    Files on filesystems without SEEK_DATA/SEEK_HOLE support are reported
+    as a single range.
+    """
+    size = os.path.getsize(path)
+    fd = os.open(path, os.O_RDONLY)
+    ranges = []
+    try:
+        offset = 0
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # Nothing but a hole up to the end of the file
+                    break
+                if e.errno == errno.EINVAL and offset == 0:
+                    return [(0, size)]
+                raise
+            end = os.lseek(fd, start, SEEK_HOLE)
+            ranges.append((start, end))
+            offset = end
+    finally:
+        os.close(fd)
+    return ranges
+
+
+def get_data_blocks(path, skip_zeros=True):
+    """Return the runs of BLOCK_SIZE blocks of path that must be written.
+
+    Runs are (first_block, block_count) tuples. Holes are always left out;
+    blocks holding nothing but zeros only if skip_zeros is set. Runs that
+    are separated by less than MERGE_GAP_BLOCKS blocks are merged.
+    """
+    blocks = []
+    zero_block = '\0' * BLOCK_SIZE
+    with open(path, 'rb') as f:
+        for start, end in get_data_ranges(path):
+            block = start // BLOCK_SIZE
+            last = (end + BLOCK_SIZE - 1) // BLOCK_SIZE
+            if not skip_zeros:
+                blocks.extend(xrange(block, last))
+                continue
+            f.seek(block * BLOCK_SIZE)
+            while block < last:
+                data = f.read(BLOCK_SIZE)
+                if not data:
+                    break
+                if data != zero_block[:len(data)]:
+                    blocks.append(block)
+                block += 1
+
+    runs = []
+    for block in blocks:
+        if runs and block - sum(runs[-1]) <= MERGE_GAP_BLOCKS:
+            first, count = runs[-1]
+            runs[-1] = (first, max(count, block - first + 1))
+        else:
+            runs.append((block, 1))
+    return runs
+
+
+def get_image_info(image_path, disk_format):
+    """Return the qemu-img info of an image of a known format.
+
+    The format is passed to qemu-img rather than probed from the contents
+    of the image, and images backed by another file are refused.
+    """
+    out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
+                             'qemu-img', 'info', '-f', disk_format,
+                             image_path)
+    info = images.QemuImgInfo(out)
+    if info.backing_file is not None:
+        raise exception.ImageUnacceptable(image_id=image_path,
+                reason=_("fmt=%(fmt)s backed by: %(backing_file)s") %
+                       {'fmt': disk_format,
+                        'backing_file': info.backing_file})
+    return info
+
+
+def write_image(src, dst, disk_format='raw'):
+    """Write an image to a device.
+
+    Images that are not raw are streamed to the device by qemu-img
+    convert. Raw images are written by dd; if [baremetal]deploy_skip_zeros
+    is set, holes and blocks of zeros are left out.
+
+    :returns: the number of bytes written to the device, or None for
+              images converted by qemu-img, which does not report it
+    """
+    if disk_format != 'raw':
+        get_image_info(src, disk_format)
+        utils.execute('qemu-img', 'convert', '-f', disk_format,
+                      '-O', 'raw', src, dst,
+                      run_as_root=True)
+        LOG.info(_('converted %(src)s from %(disk_format)s to %(dst)s') %
+                 locals())
+        return None
+
+    written = 0
+    size = os.path.getsize(src)
+    if CONF.baremetal.deploy_skip_zeros:
+        runs = get_data_blocks(src)
+    else:
+        runs = [(0, (size + BLOCK_SIZE - 1) // BLOCK_SIZE)]
+    for block, count in runs:
+        utils.execute('dd',
+                      'if=%s' % src,
+                      'of=%s' % dst,
+                      'bs=%d' % BLOCK_SIZE,
+                      'skip=%d' % block,
+                      'seek=%d' % block,
+                      'count=%d' % count,
+                      'oflag=direct',
+                      'conv=notrunc',
+                      run_as_root=True,
+                      check_exit_code=[0])
+        written += min(count * BLOCK_SIZE, size - block * BLOCK_SIZE)
+    LOG.info(_('wrote %(written)d of %(size)d bytes of %(src)s to '
+               '%(dst)s') % locals())
+    return written
 
 
 def mkswap(dev, label='swap1'):
@@ -153,6 +325,18 @@ def notify(address, port):
         s.close()
 
 
+def announce_deploy_state(context, node_id, task_state):
+    """Tell the compute host of a node about the end of its deployment."""
+    try:
+        node = db.bm_node_get(context, node_id)
+        deploy_waiter.DeployRPCAPI().deploy_done(
+                context, node['service_host'], node_id, task_state)
+    except Exception:
+        # The compute host polls the node state in any case
+        LOG.exception(_('failed to announce the end of the deployment '
+                        'to node %s') % node_id)
+
+
 def get_dev(address, port, iqn, lun):
     """Returns a device path for given parameters."""
     dev = "/dev/disk/by-path/ip-%s:%s-iscsi-%s-lun-%s" \
@@ -160,16 +344,20 @@ def get_dev(address, port, iqn, lun):
     return dev
 
 
-def get_image_mb(image_path):
+def get_image_mb(image_path, disk_format='raw'):
     """Get size of an image in Megabyte."""
     mb = 1024 * 1024
-    image_byte = os.path.getsize(image_path)
+    if disk_format == 'raw':
+        image_byte = os.path.getsize(image_path)
+    else:
+        # The whole virtual disk ends up on the root partition
+        image_byte = get_image_info(image_path, disk_format).virtual_size
     # round up size to MB
     image_mb = int((image_byte + mb - 1) / mb)
     return image_mb
 
 
-def work_on_disk(dev, root_mb, swap_mb, image_path):
+def work_on_disk(dev, root_mb, swap_mb, image_path, disk_format='raw'):
     """Creates partitions and write an image to the root partition."""
     root_part = "%s-part1" % dev
     swap_part = "%s-part2" % dev
@@ -177,51 +365,131 @@ def work_on_disk(dev, root_mb, swap_mb, image_path):
     if not is_block_device(dev):
         LOG.warn("parent device '%s' not found", dev)
         return
-    make_partitions(dev, root_mb, swap_mb)
+    with _phase('make_partitions'):
+        make_partitions(dev, root_mb, swap_mb)
     if not is_block_device(root_part):
         LOG.warn("root device '%s' not found", root_part)
         return
     if not is_block_device(swap_part):
         LOG.warn("swap device '%s' not found", swap_part)
         return
-    dd(image_path, root_part)
-    mkswap(swap_part)
+    with _phase('write_image'):
+        write_image(image_path, root_part, disk_format)
+    with _phase('mkswap'):
+        mkswap(swap_part)
     root_uuid = block_uuid(root_part)
     return root_uuid
 
 
 def deploy(address, port, iqn, lun, image_path, pxe_config_path,
-           root_mb, swap_mb):
-    """All-in-one function to deploy a node."""
+           root_mb, swap_mb, disk_format='raw'):
+    """All-in-one function to deploy a node.
+
+    disk_format is the known format of the image; it is never probed
+    from the image itself.
+    """
     dev = get_dev(address, port, iqn, lun)
-    image_mb = get_image_mb(image_path)
+    image_mb = get_image_mb(image_path, disk_format)
     if image_mb > root_mb:
         root_mb = image_mb
-    discovery(address, port)
-    login_iscsi(address, port, iqn)
+    with _phase('discovery'):
+        discovery(address, port)
+    with _phase('login_iscsi'):
+        login_iscsi(address, port, iqn)
     try:
-        root_uuid = work_on_disk(dev, root_mb, swap_mb, image_path)
+        root_uuid = work_on_disk(dev, root_mb, swap_mb, image_path,
+                                 disk_format)
     except processutils.ProcessExecutionError, err:
         # Log output if there was a error
         LOG.error("Cmd     : %s" % err.cmd)
         LOG.error("StdOut  : %s" % err.stdout)
         LOG.error("StdErr  : %s" % err.stderr)
     finally:
-        logout_iscsi(address, port, iqn)
+        with _phase('logout_iscsi'):
+            logout_iscsi(address, port, iqn)
     switch_pxe_config(pxe_config_path, root_uuid)
-    # Ensure the node started netcat on the port after POST the request.
-    time.sleep(3)
-    notify(address, 10000)
+    with _phase('notify'):
+        # Ensure the node started netcat on the port after POST the request.
+        time.sleep(3)
+        notify(address, 10000)
+
+
+class DeployTracker(object):
+    """Book-keeping shared by all deploy workers.
+
+    Keeps the deployments in flight and accumulates per-phase timings.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = {}
+        self.phase_timings = {}
+        self.completed = 0
+        self.failed = 0
+
+    def start(self, node_id, params):
+        """Register a deployment.
+
+        :returns: the deploy record
+        """
+        with self._lock:
+            record = {'node_id': node_id,
+                      'address': params.get('address'),
+                      'phase': 'queued',
+                      'started_at': timeutils.utcnow()}
+            self.in_flight[node_id] = record
+            return record
+
+    def finish(self, node_id, success):
+        with self._lock:
+            self.in_flight.pop(node_id, None)
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def add_phase_time(self, name, duration):
+        with self._lock:
+            timing = self.phase_timings.setdefault(
+                name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['total'] += duration
+            timing['max'] = max(timing['max'], duration)
+
+    def get_status(self):
+        """Return a JSON-friendly summary of the deployments."""
+        with self._lock:
+            in_flight = []
+            for record in self.in_flight.values():
+                record = dict(record)
+                record['elapsed'] = timeutils.delta_seconds(
+                    record['started_at'], timeutils.utcnow())
+                record['started_at'] = timeutils.strtime(
+                    record['started_at'])
+                in_flight.append(record)
+            phase_timings = {}
+            for name, timing in self.phase_timings.items():
+                timing = dict(timing)
+                timing['avg'] = timing['total'] / timing['count']
+                phase_timings[name] = timing
+            return {'in_flight': in_flight,
+                    'phase_timings': phase_timings,
+                    'completed': self.completed,
+                    'failed': self.failed}
+
+
+TRACKER = DeployTracker()
 
 
 class Worker(threading.Thread):
     """Thread that handles requests in queue."""
 
-    def __init__(self):
+    def __init__(self, tracker=None):
         super(Worker, self).__init__()
         self.setDaemon(True)
         self.stop = False
         self.queue_timeout = 1
+        self.tracker = tracker or TRACKER
 
     def run(self):
         while not self.stop:
@@ -232,35 +500,88 @@ class Worker(threading.Thread):
             except Queue.Empty:
                 pass
             else:
-                # Requests comes here from BareMetalDeploy.post()
-                LOG.info(_('start deployment for node %(node_id)s, '
-                           'params %(params)s') % locals())
-                context = nova_context.get_admin_context()
+                record = self.tracker.start(node_id, params)
+                _CURRENT.tracker = self.tracker
+                _CURRENT.record = record
+                success = False
                 try:
-                    db.bm_node_update(context, node_id,
-                          {'task_state': baremetal_states.DEPLOYING})
-                    deploy(**params)
-                except Exception:
-                    LOG.exception(_('deployment to node %s failed') % node_id)
-                    db.bm_node_update(context, node_id,
-                          {'task_state': baremetal_states.DEPLOYFAIL})
-                else:
-                    LOG.info(_('deployment to node %s done') % node_id)
-                    db.bm_node_update(context, node_id,
-                          {'task_state': baremetal_states.DEPLOYDONE})
+                    success = self._deploy(node_id, params)
+                finally:
+                    _CURRENT.tracker = None
+                    self.tracker.finish(node_id, success)
+
+    def _deploy(self, node_id, params):
+        # Requests comes here from BareMetalDeploy.post()
+        LOG.info(_('start deployment for node %(node_id)s, '
+                   'params %(params)s') % locals())
+        context = nova_context.get_admin_context()
+        try:
+            db.bm_node_update(context, node_id,
+                  {'task_state': baremetal_states.DEPLOYING})
+            deploy(**params)
+        except Exception:
+            LOG.exception(_('deployment to node %s failed') % node_id)
+            db.bm_node_update(context, node_id,
+                  {'task_state': baremetal_states.DEPLOYFAIL})
+            announce_deploy_state(context, node_id,
+                                  baremetal_states.DEPLOYFAIL)
+            return False
+        else:
+            LOG.info(_('deployment to node %s done') % node_id)
+            db.bm_node_update(context, node_id,
+                  {'task_state': baremetal_states.DEPLOYDONE})
+            announce_deploy_state(context, node_id,
+                                  baremetal_states.DEPLOYDONE)
+            return True
+
+
+class DeployPool(object):
+    """A pool of Workers serving QUEUE."""
+
+    def __init__(self, size=None, tracker=None):
+        self.size = size or CONF.baremetal.deploy_workers
+        self.tracker = tracker or TRACKER
+        self.workers = []
+
+    def ensure_workers(self):
+        """Start workers until the pool is full, replacing dead ones."""
+        self.workers = [w for w in self.workers if w.isAlive()]
+        while len(self.workers) < self.size:
+            worker = Worker(self.tracker)
+            worker.start()
+            self.workers.append(worker)
+
+    def put(self, node_id, params):
+        self.ensure_workers()
+        QUEUE.put((node_id, params))
+
+    def stop(self, timeout=None):
+        for worker in self.workers:
+            worker.stop = True
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+    def get_status(self):
+        status = self.tracker.get_status()
+        status['queue_depth'] = QUEUE.qsize()
+        status['workers'] = len([w for w in self.workers if w.isAlive()])
+        return status
 
 
 class BareMetalDeploy(object):
     """WSGI server for bare-metal deployment."""
 
-    def __init__(self):
-        self.worker = Worker()
-        self.worker.start()
+    def __init__(self, pool=None):
+        self.pool = pool or DeployPool()
+        self.pool.ensure_workers()
 
     def __call__(self, environ, start_response):
         method = environ['REQUEST_METHOD']
         if method == 'POST':
             return self.post(environ, start_response)
+        elif method == 'GET':
+            return self.get(environ, start_response)
         else:
             start_response('501 Not Implemented',
                            [('Content-type', 'text/plain')])
@@ -299,17 +620,21 @@ class BareMetalDeploy(object):
                   'pxe_config_path': d['pxe_config_path'],
                   'root_mb': int(d['root_mb']),
                   'swap_mb': int(d['swap_mb']),
+                  # The image cache stores images converted to raw by
+                  # fetch_to_raw(); their format is not probed again
+                  'disk_format': 'raw',
                  }
-        # Restart worker, if needed
-        if not self.worker.isAlive():
-            self.worker = Worker()
-            self.worker.start()
         LOG.info("request is queued: node %s, params %s", node_id, params)
-        QUEUE.put((node_id, params))
         # Requests go to Worker.run()
+        self.pool.put(node_id, params)
         start_response('200 OK', [('Content-type', 'text/plain')])
         return ''
 
+    def get(self, environ, start_response):
+        """Report queue depth, in-flight deploys and phase timings."""
+        start_response('200 OK', [('Content-type', 'application/json')])
+        return jsonutils.dumps(self.pool.get_status())
+
 
 def main():
     config.parse_args(sys.argv)
@@ -67,6 +67,7 @@ from nova import context
 from nova import db
 from nova.db import migration
 from nova import exception
+from nova.objectstore import s3server
 from nova.openstack.common import cliutils
 from nova.openstack.common.db import exception as db_exc
 from nova.openstack.common import importutils
@@ -1156,6 +1157,26 @@ class CellCommands(object):
                 '-' * 5, '-' * 10)
 
 
+class ObjectStoreCommands(object):
+    """Commands for managing the nova-objectstore buckets."""
+
+    @args('--bucket', metavar='<bucket>',
+          help='Bucket to rebuild the key index of, all by default')
+    def rebuild_index(self, bucket=None):
+        """Rebuild the key index of buckets from the objects on disk."""
+        bucket_names = None
+        if bucket:
+            if not os.path.isdir(os.path.join(CONF.buckets_path, bucket)):
+                print _("No such bucket: %s") % bucket
+                return 2
+            bucket_names = [bucket]
+        counts = s3server.rebuild_indexes(CONF.buckets_path,
+                                          bucket_names=bucket_names)
+        for bucket_name, count in sorted(counts.items()):
+            print _("Indexed %(count)d objects in bucket "
+                    "%(bucket_name)s") % locals()
+
+
 CATEGORIES = {
     'account': AccountCommands,
     'agent': AgentBuildCommands,
@@ -1168,6 +1189,7 @@ CATEGORIES = {
     'instance_type': InstanceTypeCommands,
     'logs': GetLogCommands,
     'network': NetworkCommands,
+    'objectstore': ObjectStoreCommands,
     'project': ProjectCommands,
     'service': ServiceCommands,
     'shell': ShellCommands,
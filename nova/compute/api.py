@@ -2411,6 +2411,21 @@ class API(base.Base):
         rv = self.db.instance_metadata_get(context, instance['uuid'])
         return dict(rv.iteritems())
 
+    def get_instances_metadata(self, context, instances):
+        """Get the metadata of several instances with a single query.
+
+        :returns: dict of the metadata of each instance keyed by uuid
+        """
+        for instance in instances:
+            check_policy(context, 'get_instance_metadata', instance)
+        metadata = dict((instance['uuid'], {}) for instance in instances)
+        if metadata:
+            rows = self.db.instance_metadata_get_all(
+                    context, [{'resource_id': metadata.keys()}])
+            for row in rows:
+                metadata[row['instance_id']][row['key']] = row['value']
+        return metadata
+
     @wrap_check_policy
     def get_all_instance_metadata(self, context, search_filts):
         """Get all metadata."""
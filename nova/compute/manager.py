@@ -36,6 +36,7 @@ import time
 import traceback
 import uuid
 
+import eventlet
 from eventlet import greenthread
 from oslo.config import cfg
 
@@ -104,6 +105,10 @@ compute_opts = [
                 default=False,
                 help='Whether to start guests that were running before the '
                      'host rebooted'),
+    cfg.IntOpt('sync_power_state_pool_size',
+               default=20,
+               help='Maximum number of instances to query or update '
+                    'concurrently while syncing power states'),
     ]
 
 interval_opts = [
@@ -3786,11 +3791,12 @@ class ComputeManager(manager.SchedulerDependentManager):
     def _sync_power_states(self, context):
         """Align power states between the database and the hypervisor.
 
-        To sync power state data we make a DB call to get the number of
-        virtual machines known by the hypervisor and if the number matches the
-        number of virtual machines known by the database, we proceed in a lazy
-        loop, one database record at a time, checking if the hypervisor has the
-        same power state as is in the database.
+        The power state of all instances on this host is fetched from the
+        hypervisor in one bulk query where the driver supports it, and with
+        a bounded pool of concurrent get_info() calls otherwise. Only the
+        instances whose power state disagrees with the database, or whose
+        vm_state calls for action, are re-read from the database (in a
+        single query) and handed to _sync_instance_power_state.
         """
         db_instances = self.conductor_api.instance_get_all_by_host(
             context, self.host, columns_to_join=[])
@@ -3802,34 +3808,121 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.warn(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
+        idle_instances = []
         for db_instance in db_instances:
             if db_instance['task_state'] is not None:
                 LOG.info(_("During sync_power_state the instance has a "
                            "pending task. Skip."), instance=db_instance)
                 continue
-            # No pending tasks. Now try to figure out the real vm_power_state.
+            idle_instances.append(db_instance)
+        if not idle_instances:
+            return
+
+        pool = eventlet.GreenPool(CONF.sync_power_state_pool_size)
+        vm_power_states = self._get_vm_power_states(idle_instances, pool)
+
+        out_of_sync = []
+        for db_instance in idle_instances:
+            vm_power_state = vm_power_states.get(db_instance['uuid'],
+                                                 power_state.NOSTATE)
+            if self._power_state_needs_sync(db_instance['vm_state'],
+                                            db_instance['power_state'],
+                                            vm_power_state):
+                out_of_sync.append((db_instance, vm_power_state))
+        if not out_of_sync:
+            return
+
+        # We re-query the DB to get the latest instance info to minimize
+        # (not eliminate) race condition.
+        filters = {'uuid': [db_instance['uuid']
+                            for db_instance, state in out_of_sync],
+                   'deleted': False,
+                   'soft_deleted': True}
+        current = dict((instance['uuid'], instance) for instance in
+                       self.conductor_api.instance_get_all_by_filters(
+                           context, filters, columns_to_join=[]))
+
+        for db_instance, vm_power_state in out_of_sync:
+            u = current.get(db_instance['uuid'])
+            if u is None:
+                LOG.info(_("During sync_power_state the instance has "
+                           "been deleted. Skip."), instance=db_instance)
+                continue
+            pool.spawn_n(self._sync_instance_power_state_safe, context,
+                         db_instance, vm_power_state, u)
+        pool.waitall()
+
+    def _get_vm_power_states(self, db_instances, pool):
+        """Return a dict of instance uuid to hypervisor power state."""
+        try:
+            return self.driver.get_power_states(db_instances)
+        except NotImplementedError:
+            pass
+
+        def _get_power_state(db_instance):
             try:
-                vm_instance = self.driver.get_info(db_instance)
-                vm_power_state = vm_instance['state']
+                vm_power_state = self.driver.get_info(db_instance)['state']
             except exception.InstanceNotFound:
                 vm_power_state = power_state.NOSTATE
-            # Note(maoy): the above get_info call might take a long time,
-            # for example, because of a broken libvirt driver.
-            self._sync_instance_power_state(context,
-                                            db_instance,
-                                            vm_power_state)
+            return db_instance['uuid'], vm_power_state
 
-    def _sync_instance_power_state(self, context, db_instance, vm_power_state):
+        # Note(maoy): the get_info call might take a long time, for
+        # example, because of a broken libvirt driver; querying several
+        # instances at once keeps one slow instance from holding up all
+        # the others.
+        return dict(pool.imap(_get_power_state, db_instances))
+
+    @staticmethod
+    def _power_state_needs_sync(vm_state, db_power_state, vm_power_state):
+        """Whether _sync_instance_power_state has anything to do.
+
+        This mirrors the checks made by _sync_instance_power_state so that
+        instances which are in sync need not be re-read from the database.
+        """
+        if vm_power_state != db_power_state:
+            return True
+        if vm_state == vm_states.ACTIVE:
+            return vm_power_state in (power_state.SHUTDOWN,
+                                      power_state.CRASHED,
+                                      power_state.SUSPENDED,
+                                      power_state.PAUSED,
+                                      power_state.NOSTATE)
+        if vm_state == vm_states.STOPPED:
+            return vm_power_state not in (power_state.NOSTATE,
+                                          power_state.SHUTDOWN,
+                                          power_state.CRASHED)
+        if vm_state in (vm_states.SOFT_DELETED, vm_states.DELETED):
+            return vm_power_state not in (power_state.NOSTATE,
+                                          power_state.SHUTDOWN)
+        return False
+
+    def _sync_instance_power_state_safe(self, context, db_instance,
+                                        vm_power_state, current):
+        try:
+            self._sync_instance_power_state(context, db_instance,
+                                            vm_power_state, current=current)
+        except Exception:
+            LOG.exception(_("Unexpected error during sync_power_state."),
+                          instance=db_instance)
+
+    def _sync_instance_power_state(self, context, db_instance, vm_power_state,
+                                   current=None):
         """Align instance power state between the database and hypervisor.
 
         If the instance is not found on the hypervisor, but is in the database,
-        then a stop() API will be called on the instance."""
+        then a stop() API will be called on the instance.
 
-        # We re-query the DB to get the latest instance info to minimize
-        # (not eliminate) race condition.
-        u = self.conductor_api.instance_get_by_uuid(context,
-                                                    db_instance['uuid'],
-                                                    columns_to_join=[])
+        :param current: the instance as freshly read from the database; it
+                        is re-queried when not given.
+        """
+
+        u = current
+        if u is None:
+            # We re-query the DB to get the latest instance info to
+            # minimize (not eliminate) race condition.
+            u = self.conductor_api.instance_get_by_uuid(context,
+                                                        db_instance['uuid'],
+                                                        columns_to_join=[])
         db_power_state = u["power_state"]
         vm_state = u['vm_state']
 
@@ -3977,10 +4070,23 @@ class ComputeManager(manager.SchedulerDependentManager):
         new_resource_tracker_dict = {}
         nodenames = set(self.driver.get_available_nodes())
         for nodename in nodenames:
-            rt = self._get_resource_tracker(nodename)
-            rt.update_available_resource(context)
+            rt = self._resource_tracker_dict.get(nodename)
+            if not rt:
+                rt = resource_tracker.ResourceTracker(self.host,
+                                                      self.driver,
+                                                      nodename)
             new_resource_tracker_dict[nodename] = rt
 
+        if len(new_resource_tracker_dict) > 1:
+            # Audit all nodes together rather than making several round
+            # trips per node.
+            resource_tracker.update_available_resources(
+                context, self.host, self.driver,
+                new_resource_tracker_dict.values())
+        else:
+            for rt in new_resource_tracker_dict.values():
+                rt.update_available_resource(context)
+
         # Delete orphan compute node not reported by driver but still in db
         compute_nodes_in_db = self._get_compute_nodes_in_db(context)
 
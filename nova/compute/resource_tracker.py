@@ -31,6 +31,7 @@ from nova import exception
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
 from nova import utils
 
 resource_tracker_opts = [
@@ -40,7 +41,11 @@ resource_tracker_opts = [
                help='Amount of memory in MB to reserve for the host'),
     cfg.StrOpt('compute_stats_class',
                default='nova.compute.stats.Stats',
-               help='Class that will manage stats for the local compute host')
+               help='Class that will manage stats for the local compute host'),
+    cfg.IntOpt('compute_node_heartbeat_interval', default=300,
+               help='Number of seconds after which an unchanged compute node '
+                    'record is written anyway, to refresh its updated_at. '
+                    'Set to 0 to write the record on every resource audit.'),
 ]
 
 CONF = cfg.CONF
@@ -64,6 +69,10 @@ class ResourceTracker(object):
         self.tracked_instances = {}
         self.tracked_migrations = {}
         self.conductor_api = conductor.API()
+        # Values last written to the compute node record by the resource
+        # audit, used to skip writes when nothing changed:
+        self._pushed_values = None
+        self._pushed_at = None
 
     @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
     def instance_claim(self, context, instance_ref, limits=None):
@@ -245,39 +254,50 @@ class ResourceTracker(object):
         resources = self.driver.get_available_resource(self.nodename)
 
         if not resources:
-            # The virt driver does not support this function
-            LOG.audit(_("Virt driver does not support "
-                 "'get_available_resource'  Compute tracking is disabled."))
-            self.compute_node = None
+            self._disable_tracking()
             return
 
-        self._verify_resources(resources)
-
-        self._report_hypervisor_resource_view(resources)
-
         # Grab all instances assigned to this node:
         instances = self.conductor_api.instance_get_all_by_host_and_node(
             context, self.host, self.nodename)
 
-        # Now calculate usage based on instance utilization:
-        self._update_usage_from_instances(resources, instances)
-
         # Grab all in-progress migrations:
         capi = self.conductor_api
         migrations = capi.migration_get_in_progress_by_host_and_node(context,
                 self.host, self.nodename)
 
+        self._audit_resources(context, resources, instances, migrations,
+                              self.driver.get_per_instance_usage())
+
+        self._sync_compute_node(context, resources)
+
+    def _disable_tracking(self):
+        # The virt driver does not support this function
+        LOG.audit(_("Virt driver does not support "
+             "'get_available_resource'  Compute tracking is disabled."))
+        self.compute_node = None
+
+    def _audit_resources(self, context, resources, instances, migrations,
+                         usage):
+        """Calculate the usage of this node from the instances and
+        migrations on it, on top of the hypervisor's view in resources.
+        """
+        self._verify_resources(resources)
+
+        self._report_hypervisor_resource_view(resources)
+
+        # Now calculate usage based on instance utilization:
+        self._update_usage_from_instances(resources, instances)
+
         self._update_usage_from_migrations(context, resources, migrations)
 
         # Detect and account for orphaned instances that may exist on the
         # hypervisor, but are not in the DB:
-        orphans = self._find_orphaned_instances()
+        orphans = self._find_orphaned_instances(usage)
         self._update_usage_from_orphans(resources, orphans)
 
         self._report_final_resource_view(resources)
 
-        self._sync_compute_node(context, resources)
-
     def _sync_compute_node(self, context, resources):
         """Create or update the compute node DB record."""
         if not self.compute_node:
@@ -297,15 +317,53 @@ class ResourceTracker(object):
         if not self.compute_node:
             # Need to create the ComputeNode record:
             resources['service_id'] = service['id']
+            pushed = jsonutils.to_primitive(resources)
             self._create(context, resources)
+            self._remember_pushed(pushed)
             LOG.info(_('Compute_service record created for %(host)s:%(node)s')
                     % {'host': self.host, 'node': self.nodename})
+            return
 
-        else:
-            # just update the record:
-            self._update(context, resources, prune_stats=True)
-            LOG.info(_('Compute_service record updated for %(host)s:%(node)s')
-                    % {'host': self.host, 'node': self.nodename})
+        # just update the record, with the values that changed:
+        values = self._get_compute_node_changes(resources)
+        if values is None:
+            LOG.debug(_('Compute_service record unchanged for '
+                        '%(host)s:%(node)s')
+                      % {'host': self.host, 'node': self.nodename})
+            return
+
+        pushed = jsonutils.to_primitive(resources)
+        self._update(context, dict(values), prune_stats=True)
+        self._remember_pushed(pushed)
+        LOG.info(_('Compute_service record updated for %(host)s:%(node)s')
+                % {'host': self.host, 'node': self.nodename})
+
+    def _get_compute_node_changes(self, resources):
+        """Return the values that changed since the resource audit last
+        wrote the compute node record, or None if there is nothing to write.
+
+        Once the record has been left alone for
+        compute_node_heartbeat_interval seconds an empty dict is returned,
+        so that only its updated_at is refreshed.
+        """
+        pushed = self._pushed_values
+        if pushed is None:
+            return resources
+
+        current = jsonutils.to_primitive(resources)
+        changes = dict((key, resources[key]) for key in current
+                       if key not in pushed or pushed[key] != current[key])
+        if changes:
+            return changes
+
+        if timeutils.is_older_than(self._pushed_at,
+                                   CONF.compute_node_heartbeat_interval):
+            return {}
+        return None
+
+    def _remember_pushed(self, pushed):
+        self._pushed_values = pushed
+        self._pushed_at = timeutils.utcnow()
 
     def _create(self, context, values):
         """Create the compute node in the DB."""
@@ -357,6 +415,8 @@ class ResourceTracker(object):
         """Persist the compute node updates to the DB."""
         if "service" in self.compute_node:
             del self.compute_node['service']
+        # The record no longer matches what the audit last wrote
+        self._pushed_values = None
         self.compute_node = self.conductor_api.compute_node_update(
             context, self.compute_node, values, prune_stats)
 
@@ -494,6 +554,7 @@ class ResourceTracker(object):
 
         # purge old stats
         self.stats.clear()
+        resources['stats'] = self.stats
 
         # set some intiial values, reserve room for host/hypervisor:
         resources['local_gb_used'] = CONF.reserved_host_disk_mb / 1024
@@ -512,7 +573,7 @@ class ResourceTracker(object):
             else:
                 self._update_usage_from_instance(resources, instance)
 
-    def _find_orphaned_instances(self):
+    def _find_orphaned_instances(self, usage=None):
         """Given the set of instances and migrations already account for
         by resource tracker, sanity check the hypervisor to determine
         if there are any "orphaned" instances left hanging around.
@@ -520,12 +581,16 @@ class ResourceTracker(object):
         Orphans could be consuming memory and should be accounted for in
         usage calculations to guard against potential out of memory
         errors.
+
+        :param usage: result of driver.get_per_instance_usage(), which is
+                      queried when not given
         """
         uuids1 = frozenset(self.tracked_instances.keys())
         uuids2 = frozenset(self.tracked_migrations.keys())
         uuids = uuids1 | uuids2
 
-        usage = self.driver.get_per_instance_usage()
+        if usage is None:
+            usage = self.driver.get_per_instance_usage()
         vuuids = frozenset(usage.keys())
 
         orphan_uuids = vuuids - uuids
@@ -584,3 +649,78 @@ class ResourceTracker(object):
         except KeyError:
             return self.conductor_api.instance_type_get(context,
                     instance_type_id)
+
+
+@utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
+def update_available_resources(context, host, driver, trackers):
+    """Audit the resources of all nodes of a host at once.
+
+    This has the same effect as calling update_available_resource on every
+    tracker, but the driver reports the resources of all nodes in one call,
+    instances and migrations are fetched once for the host and grouped by
+    node, and the compute node records are updated with a single conductor
+    call. A host managing many nodes (bare-metal, for example) would
+    otherwise make several round trips per node.
+
+    :param context: security context
+    :param host: the compute host the nodes belong to
+    :param driver: the virt driver managing the nodes
+    :param trackers: ResourceTrackers of the nodes to audit
+    """
+    conductor_api = conductor.API()
+    LOG.audit(_("Auditing locally available compute resources for "
+                "%d nodes") % len(trackers))
+    all_resources = driver.get_available_resources(
+        [rt.nodename for rt in trackers])
+
+    instances_by_node = {}
+    for instance in conductor_api.instance_get_all_by_host(
+            context, host, columns_to_join=[]):
+        instances_by_node.setdefault(instance['node'], []).append(instance)
+
+    migrations_by_node = {}
+    for migration in conductor_api.migration_get_in_progress_by_host(
+            context, host):
+        # A migration between two nodes of this host counts on both
+        nodes = set()
+        if migration['source_compute'] == host:
+            nodes.add(migration['source_node'])
+        if migration['dest_compute'] == host:
+            nodes.add(migration['dest_node'])
+        for node in nodes:
+            migrations_by_node.setdefault(node, []).append(migration)
+
+    usage = driver.get_per_instance_usage()
+
+    updates = []
+    for rt in trackers:
+        resources = all_resources.get(rt.nodename)
+        if not resources:
+            rt._disable_tracking()
+            continue
+
+        rt._audit_resources(context, resources,
+                            instances_by_node.get(rt.nodename, []),
+                            migrations_by_node.get(rt.nodename, []),
+                            usage)
+        if rt.compute_node:
+            values = rt._get_compute_node_changes(resources)
+            if values is not None:
+                rt.compute_node.pop('service', None)
+                updates.append((rt, dict(values),
+                                jsonutils.to_primitive(resources)))
+        else:
+            # First audit of this node, find or create its record
+            rt._sync_compute_node(context, resources)
+
+    if not updates:
+        return
+    compute_nodes = conductor_api.compute_node_update_bulk(
+        context,
+        [(rt.compute_node, values) for rt, values, pushed in updates],
+        prune_stats=True)
+    for (rt, values, pushed), compute_node in zip(updates, compute_nodes):
+        rt.compute_node = compute_node
+        rt._remember_pushed(pushed)
+    LOG.info(_('Compute_service records updated for %(count)d nodes of '
+               '%(host)s') % {'count': len(updates), 'host': host})
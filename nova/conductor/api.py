@@ -121,6 +121,9 @@ class LocalAPI(object):
         return self._manager.migration_get_in_progress_by_host_and_node(
             context, host, node)
 
+    def migration_get_in_progress_by_host(self, context, host):
+        return self._manager.migration_get_in_progress_by_host(context, host)
+
     def migration_create(self, context, instance, values):
         return self._manager.migration_create(context, instance, values)
 
@@ -268,6 +271,10 @@ class LocalAPI(object):
         return self._manager.compute_node_update(context, node, values,
                                                  prune_stats)
 
+    def compute_node_update_bulk(self, context, updates, prune_stats=False):
+        return self._manager.compute_node_update_bulk(context, updates,
+                                                      prune_stats)
+
     def compute_node_delete(self, context, node):
         return self._manager.compute_node_delete(context, node)
 
@@ -441,6 +448,10 @@ class API(object):
         return crpcapi.migration_get_in_progress_by_host_and_node(context,
                                                                   host, node)
 
+    def migration_get_in_progress_by_host(self, context, host):
+        return self.conductor_rpcapi.migration_get_in_progress_by_host(
+            context, host)
+
     def migration_create(self, context, instance, values):
         return self.conductor_rpcapi.migration_create(context, instance,
                                                       values)
@@ -597,6 +608,10 @@ class API(object):
         return self.conductor_rpcapi.compute_node_update(context, node,
                                                          values, prune_stats)
 
+    def compute_node_update_bulk(self, context, updates, prune_stats=False):
+        return self.conductor_rpcapi.compute_node_update_bulk(context, updates,
+                                                              prune_stats)
+
     def compute_node_delete(self, context, node):
         return self.conductor_rpcapi.compute_node_delete(context, node)
 
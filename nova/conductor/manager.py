@@ -49,7 +49,7 @@ datetime_fields = ['launched_at', 'terminated_at', 'updated_at']
 class ConductorManager(manager.Manager):
     """Mission: TBD."""
 
-    RPC_API_VERSION = '1.49'
+    RPC_API_VERSION = '1.50'
 
     def __init__(self, *args, **kwargs):
         super(ConductorManager, self).__init__(service_name='conductor',
@@ -144,6 +144,10 @@ class ConductorManager(manager.Manager):
             context, host, node)
         return jsonutils.to_primitive(migrations)
 
+    def migration_get_in_progress_by_host(self, context, host):
+        migrations = self.db.migration_get_in_progress_by_host(context, host)
+        return jsonutils.to_primitive(migrations)
+
     def migration_create(self, context, instance, values):
         values.update({'instance_uuid': instance['uuid'],
                        'source_compute': instance['host'],
@@ -366,6 +370,12 @@ class ConductorManager(manager.Manager):
                                              prune_stats)
         return jsonutils.to_primitive(result)
 
+    def compute_node_update_bulk(self, context, updates, prune_stats=False):
+        result = [self.db.compute_node_update(context, node['id'], values,
+                                              prune_stats)
+                  for node, values in updates]
+        return jsonutils.to_primitive(result)
+
     def compute_node_delete(self, context, node):
         result = self.db.compute_node_delete(context, node['id'])
         return jsonutils.to_primitive(result)
@@ -88,6 +88,8 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                  instance_get_all_by_filters
     1.48 - Added compute_unrescue
     1.49 - Added columns_to_join to instance_get_by_uuid
+    1.50 - Added migration_get_in_progress_by_host and
+                 compute_node_update_bulk
     """
 
     BASE_RPC_API_VERSION = '1.0'
@@ -137,6 +139,10 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                             host=host, node=node)
         return self.call(context, msg, version='1.31')
 
+    def migration_get_in_progress_by_host(self, context, host):
+        msg = self.make_msg('migration_get_in_progress_by_host', host=host)
+        return self.call(context, msg, version='1.50')
+
     def migration_create(self, context, instance, values):
         instance_p = jsonutils.to_primitive(instance)
         msg = self.make_msg('migration_create', instance=instance_p,
@@ -339,6 +345,12 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                             prune_stats=prune_stats)
         return self.call(context, msg, version='1.33')
 
+    def compute_node_update_bulk(self, context, updates, prune_stats=False):
+        updates_p = jsonutils.to_primitive(updates)
+        msg = self.make_msg('compute_node_update_bulk', updates=updates_p,
+                            prune_stats=prune_stats)
+        return self.call(context, msg, version='1.50')
+
     def compute_node_delete(self, context, node):
         node_p = jsonutils.to_primitive(node)
         msg = self.make_msg('compute_node_delete', node=node_p)
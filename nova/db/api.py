@@ -195,6 +195,9 @@ def compute_node_create(context, values):
 def compute_node_update(context, compute_id, values, prune_stats=False):
     """Set the given properties on a computeNode and update it.
 
+    The stats of the computeNode are left alone unless values contains a
+    'stats' dict.
+
     Raises ComputeHostNotFound if computeNode does not exist.
     """
     return IMPL.compute_node_update(context, compute_id, values, prune_stats)
@@ -418,6 +421,13 @@ def migration_get_in_progress_by_host_and_node(context, host, node):
     return IMPL.migration_get_in_progress_by_host_and_node(context, host, node)
 
 
+def migration_get_in_progress_by_host(context, host):
+    """Finds all migrations from or to any node of the given host that are
+    not yet confirmed or reverted.
+    """
+    return IMPL.migration_get_in_progress_by_host(context, host)
+
+
 ####################
 
 
@@ -443,6 +453,18 @@ def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
                                         instance_uuid, host)
 
 
+def fixed_ip_associate_pool_bulk(context, network_id, instance_uuids,
+                                 host=None):
+    """Find free ips in network and associate one to each instance.
+
+    Returns the addresses in the order of instance_uuids. Either all
+    instances get an address or NoMoreFixedIps is raised.
+
+    """
+    return IMPL.fixed_ip_associate_pool_bulk(context, network_id,
+                                             instance_uuids, host)
+
+
 def fixed_ip_create(context, values):
     """Create a fixed ip from the values dictionary."""
     return IMPL.fixed_ip_create(context, values)
@@ -696,6 +718,20 @@ def instance_update_and_get_original(context, instance_uuid, values):
     return rv
 
 
+def instance_bulk_update(context, updates):
+    """Update many instances and their info caches in one transaction.
+
+    :param updates: list of (instance_uuid, values, info_cache_values)
+                    tuples, where info_cache_values may be None
+    :returns: list of the uuids of the instances that were not updated
+              because their task or vm state was not the expected one,
+              or because of a duplicate hostname
+
+    Instances that do not exist are created.  Cells are not notified.
+    """
+    return IMPL.instance_bulk_update(context, updates)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance."""
     return IMPL.instance_add_security_group(context, instance_id,
@@ -994,10 +1030,23 @@ def get_volume_uuid_by_ec2_id(context, ec2_id):
     return IMPL.get_volume_uuid_by_ec2_id(context, ec2_id)
 
 
+def get_ec2_volume_ids_by_uuids(context, volume_ids):
+    """Get ec2 ids of a list of volume uuids as a dict keyed by uuid."""
+    return IMPL.get_ec2_volume_ids_by_uuids(context, volume_ids)
+
+
 def ec2_volume_create(context, volume_id, forced_id=None):
     return IMPL.ec2_volume_create(context, volume_id, forced_id)
 
 
+def ec2_volume_bulk_create(context, volume_ids):
+    """Create the ec2 ids of a list of volume uuids in one transaction.
+
+    :returns: dict of the ec2 ids keyed by uuid
+    """
+    return IMPL.ec2_volume_bulk_create(context, volume_ids)
+
+
 def get_snapshot_uuid_by_ec2_id(context, ec2_id):
     return IMPL.get_snapshot_uuid_by_ec2_id(context, ec2_id)
 
@@ -1006,10 +1055,23 @@ def get_ec2_snapshot_id_by_uuid(context, snapshot_id):
     return IMPL.get_ec2_snapshot_id_by_uuid(context, snapshot_id)
 
 
+def get_ec2_snapshot_ids_by_uuids(context, snapshot_ids):
+    """Get ec2 ids of a list of snapshot uuids as a dict keyed by uuid."""
+    return IMPL.get_ec2_snapshot_ids_by_uuids(context, snapshot_ids)
+
+
 def ec2_snapshot_create(context, snapshot_id, forced_id=None):
     return IMPL.ec2_snapshot_create(context, snapshot_id, forced_id)
 
 
+def ec2_snapshot_bulk_create(context, snapshot_ids):
+    """Create the ec2 ids of a list of snapshot uuids in one transaction.
+
+    :returns: dict of the ec2 ids keyed by uuid
+    """
+    return IMPL.ec2_snapshot_bulk_create(context, snapshot_ids)
+
+
 ####################
 
 
@@ -1035,6 +1097,12 @@ def block_device_mapping_get_all_by_instance(context, instance_uuid):
                                                          instance_uuid)
 
 
+def block_device_mapping_get_all_by_instance_uuids(context, instance_uuids):
+    """Get all block device mapping belonging to a list of instances."""
+    return IMPL.block_device_mapping_get_all_by_instance_uuids(
+            context, instance_uuids)
+
+
 def block_device_mapping_destroy(context, bdm_id):
     """Destroy the block device mapping."""
     return IMPL.block_device_mapping_destroy(context, bdm_id)
@@ -1487,11 +1555,24 @@ def s3_image_get_by_uuid(context, image_uuid):
     return IMPL.s3_image_get_by_uuid(context, image_uuid)
 
 
+def s3_image_get_all_by_uuids(context, image_uuids):
+    """Find the local s3 images represented by a list of uuids."""
+    return IMPL.s3_image_get_all_by_uuids(context, image_uuids)
+
+
 def s3_image_create(context, image_uuid):
     """Create local s3 image represented by provided uuid."""
     return IMPL.s3_image_create(context, image_uuid)
 
 
+def s3_image_bulk_create(context, image_uuids):
+    """Create local s3 images for a list of uuids in one transaction.
+
+    :returns: dict of the ids of the s3 images keyed by uuid
+    """
+    return IMPL.s3_image_bulk_create(context, image_uuids)
+
+
 ####################
 
 
@@ -1644,6 +1725,11 @@ def get_ec2_instance_id_by_uuid(context, instance_id):
     return IMPL.get_ec2_instance_id_by_uuid(context, instance_id)
 
 
+def get_ec2_instance_ids_by_uuids(context, instance_uuids):
+    """Get ec2 ids of a list of instance uuids as a dict keyed by uuid."""
+    return IMPL.get_ec2_instance_ids_by_uuids(context, instance_uuids)
+
+
 def get_instance_uuid_by_ec2_id(context, ec2_id):
     """Get uuid through ec2 id from instance_id_mappings table."""
     return IMPL.get_instance_uuid_by_ec2_id(context, ec2_id)
@@ -1654,6 +1740,14 @@ def ec2_instance_create(context, instance_uuid, id=None):
     return IMPL.ec2_instance_create(context, instance_uuid, id)
 
 
+def ec2_instance_bulk_create(context, instance_uuids):
+    """Create the ec2 ids of a list of instance uuids in one transaction.
+
+    :returns: dict of the ec2 ids keyed by uuid
+    """
+    return IMPL.ec2_instance_bulk_create(context, instance_uuids)
+
+
 ####################
 
 
@@ -23,6 +23,7 @@ import collections
 import copy
 import datetime
 import functools
+import random
 import sys
 import time
 import uuid
@@ -41,6 +42,7 @@ from sqlalchemy.orm import joinedload_all
 from sqlalchemy.orm import noload
 from sqlalchemy.schema import Table
 from sqlalchemy.sql.expression import asc
+from sqlalchemy.sql.expression import case
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import select
 from sqlalchemy.sql import func
@@ -66,6 +68,12 @@ db_opts = [
                help='When set, compute API will consider duplicate hostnames '
                     'invalid within the specified scope, regardless of case. '
                     'Should be empty, "project" or "global".'),
+    cfg.IntOpt('fixed_ip_claim_window',
+               default=32,
+               help='Number of free fixed ips read as candidates when '
+                    'claiming addresses from a network pool. Candidates '
+                    'are claimed in random order so that concurrent '
+                    'allocations on the same network rarely collide.'),
 ]
 
 CONF = cfg.CONF
@@ -544,11 +552,12 @@ def _update_stats(context, new_stats, compute_id, session, prune_stats=False):
 @require_admin_context
 def compute_node_update(context, compute_id, values, prune_stats=False):
     """Updates the ComputeNode record with the most recent data."""
-    stats = values.pop('stats', {})
+    stats = values.pop('stats', None)
 
     session = get_session()
     with session.begin():
-        _update_stats(context, stats, compute_id, session, prune_stats)
+        if stats is not None:
+            _update_stats(context, stats, compute_id, session, prune_stats)
         compute_ref = _compute_node_get(context, compute_id, session=session)
         # Always update this, even if there's going to be no other
         # changes in data.  This ensures that we invalidate the
@@ -1013,39 +1022,161 @@ def fixed_ip_associate(context, address, instance_uuid, network_id=None,
     return fixed_ip_ref['address']
 
 
+def _fixed_ip_pool_candidates(context, network_id, count, session):
+    """Return (id, address, network_id) tuples of free fixed ips in random
+    order.
+
+    The rows are read without locking; callers must claim them with
+    _fixed_ip_pool_claim, which only succeeds if the row is still free.
+    """
+    network_or_none = or_(models.FixedIp.network_id == network_id,
+                          models.FixedIp.network_id == None)
+    window = max(count, CONF.fixed_ip_claim_window)
+    rows = model_query(context, models.FixedIp.id, models.FixedIp.address,
+                       models.FixedIp.network_id,
+                       base_model=models.FixedIp, session=session,
+                       read_deleted="no").\
+                       filter(network_or_none).\
+                       filter_by(reserved=False).\
+                       filter_by(instance_uuid=None).\
+                       filter_by(host=None).\
+                       limit(window).\
+                       all()
+    candidates = [(row[0], row[1], row[2]) for row in rows]
+    random.shuffle(candidates)
+    return candidates
+
+
+def _fixed_ip_pool_claim(context, network_id, claims, host, session):
+    """Claim fixed ips with a single conditional UPDATE.
+
+    :param claims: list of (fixed_ip_id, instance_uuid) tuples
+    :returns: number of rows that were still free and got claimed
+    """
+    if len(claims) == 1:
+        instance_uuid = claims[0][1]
+    else:
+        instance_uuid = case([(models.FixedIp.id == fixed_ip_id, uuid)
+                              for fixed_ip_id, uuid in claims])
+    values = {'instance_uuid': instance_uuid,
+              'network_id': func.coalesce(models.FixedIp.network_id,
+                                          network_id)}
+    if host:
+        values['host'] = host
+    with session.begin():
+        return model_query(context, models.FixedIp, session=session,
+                           read_deleted="no").\
+                           filter(models.FixedIp.id.in_(
+                                  [claim[0] for claim in claims])).\
+                           filter_by(reserved=False).\
+                           filter_by(instance_uuid=None).\
+                           filter_by(host=None).\
+                           update(values, synchronize_session=False)
+
+
+def _fixed_ip_associate_pool(context, network_id, instance_uuids, host):
+    """Associate one free fixed ip per entry of instance_uuids.
+
+    Free addresses are picked at random from a window of candidates and
+    claimed optimistically, so concurrent allocations on the same network
+    neither serialize on row locks nor deadlock. Addresses lost to a
+    concurrent claim are replaced with fresh candidates. Each claim is its
+    own short transaction, so when the pool runs dry the addresses already
+    claimed by this call are released again before NoMoreFixedIps is raised.
+    """
+    session = get_session()
+    pending = list(enumerate(instance_uuids))
+    addresses = [None] * len(instance_uuids)
+    claimed_ids = []
+    # Claimed addresses of the shared pool, whose network_id the claim set
+    shared_ids = []
+    while pending:
+        candidates = _fixed_ip_pool_candidates(context, network_id,
+                                               len(pending), session)
+        if len(candidates) < len(pending):
+            if claimed_ids:
+                with session.begin():
+                    model_query(context, models.FixedIp, session=session,
+                                read_deleted="no").\
+                                filter(models.FixedIp.id.in_(claimed_ids)).\
+                                update({'instance_uuid': None,
+                                        'host': None},
+                                       synchronize_session=False)
+                    if shared_ids:
+                        model_query(context, models.FixedIp,
+                                    session=session, read_deleted="no").\
+                                    filter(models.FixedIp.id.in_(
+                                           shared_ids)).\
+                                    update({'network_id': None},
+                                           synchronize_session=False)
+            raise exception.NoMoreFixedIps()
+
+        batch = zip(pending, candidates)
+        claims = [(candidate[0], pending_entry[1])
+                  for pending_entry, candidate in batch]
+        count = _fixed_ip_pool_claim(context, network_id, claims, host,
+                                     session)
+        if count == len(claims):
+            won = set(claim[0] for claim in claims)
+        elif len(claims) == 1:
+            won = set()
+        else:
+            # Only multi-instance claims get here, and those always carry
+            # distinct instance uuids to tell the winners apart.
+            rows = model_query(context, models.FixedIp.id,
+                               models.FixedIp.instance_uuid,
+                               base_model=models.FixedIp, session=session,
+                               read_deleted="no").\
+                               filter(models.FixedIp.id.in_(
+                                      [claim[0] for claim in claims])).\
+                               all()
+            owners = dict(rows)
+            won = set(fixed_ip_id for fixed_ip_id, instance_uuid in claims
+                      if owners.get(fixed_ip_id) == instance_uuid)
+
+        still_pending = []
+        for (index, instance_uuid), candidate in batch:
+            fixed_ip_id, address, candidate_network_id = candidate
+            if fixed_ip_id in won:
+                addresses[index] = address
+                claimed_ids.append(fixed_ip_id)
+                if candidate_network_id is None:
+                    shared_ids.append(fixed_ip_id)
+            else:
+                still_pending.append((index, instance_uuid))
+        if still_pending:
+            LOG.debug(_("Lost %(lost)d fixed ip claim(s) on network "
+                        "%(network_id)s to concurrent allocations, "
+                        "retrying"),
+                      {'lost': len(still_pending), 'network_id': network_id})
+        pending = still_pending
+    return addresses
+
+
 @require_admin_context
 def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
                             host=None):
     if instance_uuid and not uuidutils.is_uuid_like(instance_uuid):
         raise exception.InvalidUUID(uuid=instance_uuid)
 
-    session = get_session()
-    with session.begin():
-        network_or_none = or_(models.FixedIp.network_id == network_id,
-                              models.FixedIp.network_id == None)
-        fixed_ip_ref = model_query(context, models.FixedIp, session=session,
-                                   read_deleted="no").\
-                               filter(network_or_none).\
-                               filter_by(reserved=False).\
-                               filter_by(instance_uuid=None).\
-                               filter_by(host=None).\
-                               with_lockmode('update').\
-                               first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not fixed_ip_ref:
-            raise exception.NoMoreFixedIps()
+    return _fixed_ip_associate_pool(context, network_id, [instance_uuid],
+                                    host)[0]
 
-        if fixed_ip_ref['network_id'] is None:
-            fixed_ip_ref['network'] = network_id
 
-        if instance_uuid:
-            fixed_ip_ref['instance_uuid'] = instance_uuid
+@require_admin_context
+def fixed_ip_associate_pool_bulk(context, network_id, instance_uuids,
+                                 host=None):
+    for instance_uuid in instance_uuids:
+        if not uuidutils.is_uuid_like(instance_uuid):
+            raise exception.InvalidUUID(uuid=instance_uuid)
+    if len(set(instance_uuids)) != len(instance_uuids):
+        raise exception.InvalidInput(
+                reason=_("Duplicate instance uuids in bulk fixed ip claim"))
+    if not instance_uuids:
+        return []
 
-        if host:
-            fixed_ip_ref['host'] = host
-        session.add(fixed_ip_ref)
-    return fixed_ip_ref['address']
+    return _fixed_ip_associate_pool(context, network_id, instance_uuids,
+                                    host)
 
 
 @require_context
@@ -2053,58 +2184,125 @@ def _instance_update(context, instance_uuid, values, copy_old_instance=False):
     with session.begin():
         instance_ref = _instance_get_by_uuid(context, instance_uuid,
                                              session=session)
-        if "expected_task_state" in values:
-            # it is not a db column so always pop out
-            expected = values.pop("expected_task_state")
-            if not isinstance(expected, (tuple, list, set)):
-                expected = (expected,)
-            actual_state = instance_ref["task_state"]
-            if actual_state not in expected:
-                raise exception.UnexpectedTaskStateError(actual=actual_state,
-                                                         expected=expected)
-        if "expected_vm_state" in values:
-            expected = values.pop("expected_vm_state")
-            if not isinstance(expected, (tuple, list, set)):
-                expected = (expected,)
-            actual_state = instance_ref["vm_state"]
-            if actual_state not in expected:
-                raise exception.UnexpectedVMStateError(actual=actual_state,
-                                                       expected=expected)
-
-        instance_hostname = instance_ref['hostname'] or ''
-        if ("hostname" in values and
-                values["hostname"].lower() != instance_hostname.lower()):
-                _validate_unique_server_name(context,
-                                             session,
-                                             values['hostname'])
-
-        if copy_old_instance:
-            old_instance_ref = copy.copy(instance_ref)
-        else:
-            old_instance_ref = None
-
-        metadata = values.get('metadata')
-        if metadata is not None:
-            _instance_metadata_update_in_place(context, instance_ref,
-                                               'metadata',
-                                               models.InstanceMetadata,
-                                               values.pop('metadata'),
-                                               session)
-
-        system_metadata = values.get('system_metadata')
-        if system_metadata is not None:
-            _instance_metadata_update_in_place(context, instance_ref,
-                                               'system_metadata',
-                                               models.InstanceSystemMetadata,
-                                               values.pop('system_metadata'),
-                                               session)
-
-        instance_ref.update(values)
-        instance_ref.save(session=session)
+        old_instance_ref = _instance_update_ref(context, session,
+                                                instance_ref, values,
+                                                copy_old_instance)
 
     return (old_instance_ref, instance_ref)
 
 
+def _instance_update_ref(context, session, instance_ref, values,
+                         copy_old_instance=False):
+    if "expected_task_state" in values:
+        # it is not a db column so always pop out
+        expected = values.pop("expected_task_state")
+        if not isinstance(expected, (tuple, list, set)):
+            expected = (expected,)
+        actual_state = instance_ref["task_state"]
+        if actual_state not in expected:
+            raise exception.UnexpectedTaskStateError(actual=actual_state,
+                                                     expected=expected)
+    if "expected_vm_state" in values:
+        expected = values.pop("expected_vm_state")
+        if not isinstance(expected, (tuple, list, set)):
+            expected = (expected,)
+        actual_state = instance_ref["vm_state"]
+        if actual_state not in expected:
+            raise exception.UnexpectedVMStateError(actual=actual_state,
+                                                   expected=expected)
+
+    instance_hostname = instance_ref['hostname'] or ''
+    if ("hostname" in values and
+            values["hostname"].lower() != instance_hostname.lower()):
+        _validate_unique_server_name(context, session, values['hostname'])
+
+    if copy_old_instance:
+        old_instance_ref = copy.copy(instance_ref)
+    else:
+        old_instance_ref = None
+
+    metadata = values.get('metadata')
+    if metadata is not None:
+        _instance_metadata_update_in_place(context, instance_ref,
+                                           'metadata',
+                                           models.InstanceMetadata,
+                                           values.pop('metadata'),
+                                           session)
+
+    system_metadata = values.get('system_metadata')
+    if system_metadata is not None:
+        _instance_metadata_update_in_place(context, instance_ref,
+                                           'system_metadata',
+                                           models.InstanceSystemMetadata,
+                                           values.pop('system_metadata'),
+                                           session)
+
+    instance_ref.update(values)
+    instance_ref.save(session=session)
+    return old_instance_ref
+
+
+@require_context
+def instance_bulk_update(context, updates):
+    """Update many instances and their info caches in one transaction.
+
+    :param updates: list of (instance_uuid, values, info_cache_values)
+                    tuples, where info_cache_values may be None
+    :returns: list of the uuids of the instances that were not updated
+              because their task or vm state was not the expected one,
+              or because of a duplicate hostname
+
+    Instances that do not exist are created.
+    """
+    session = get_session()
+    skipped = []
+    missing = []
+    with session.begin():
+        uuids = [instance_uuid for (instance_uuid, values, info_cache_values)
+                 in updates]
+        instance_refs = _build_instance_get(context, session=session).\
+                filter(models.Instance.uuid.in_(uuids)).\
+                all()
+        instance_refs = dict((instance_ref['uuid'], instance_ref)
+                             for instance_ref in instance_refs)
+
+        for instance_uuid, values, info_cache_values in updates:
+            instance_ref = instance_refs.get(instance_uuid)
+            if instance_ref is None:
+                missing.append((values, info_cache_values))
+                continue
+            try:
+                _instance_update_ref(context, session, instance_ref, values)
+            except (exception.UnexpectedTaskStateError,
+                    exception.UnexpectedVMStateError,
+                    exception.InstanceExists) as exc:
+                LOG.debug(_("Not updating instance: %s") % exc,
+                          instance_uuid=instance_uuid)
+                skipped.append(instance_uuid)
+                continue
+            if info_cache_values is None:
+                continue
+            info_cache = instance_ref['info_cache']
+            if info_cache is None:
+                info_cache = models.InstanceInfoCache()
+                info_cache['instance_uuid'] = instance_uuid
+            elif info_cache['deleted']:
+                # Can happen if we try to update a deleted instance's
+                # network information.
+                continue
+            info_cache.update(info_cache_values)
+            info_cache.save(session=session)
+
+    for values, info_cache_values in missing:
+        values.pop('expected_task_state', None)
+        values.pop('expected_vm_state', None)
+        instance_ref = instance_create(context, values)
+        if info_cache_values is not None:
+            instance_info_cache_update(context, instance_ref['uuid'],
+                                       info_cache_values)
+    return skipped
+
+
 def instance_add_security_group(context, instance_uuid, security_group_id):
     """Associate the given security group with the given instance."""
     sec_group_ref = models.SecurityGroupInstanceAssociation()
@@ -2997,6 +3195,29 @@ def reservation_expire(context):
 ###################
 
 
+def _uuid_mapping_bulk_create(model, uuids):
+    """Create rows of a uuid mapping model in one transaction.
+
+    :returns: dict of the ids of the new rows keyed by uuid
+    """
+    ids = {}
+    session = get_session()
+    with session.begin():
+        for mapping_uuid in uuids:
+            mapping_ref = model()
+            mapping_ref.update({'uuid': mapping_uuid})
+            mapping_ref.save(session=session)
+            ids[mapping_uuid] = mapping_ref['id']
+    return ids
+
+
+def _uuid_mapping_get_ids(query, model, uuids):
+    if not uuids:
+        return {}
+    rows = query.filter(model.uuid.in_(uuids)).all()
+    return dict((row['uuid'], row['id']) for row in rows)
+
+
 @require_context
 def _ec2_volume_get_query(context, session=None):
     return model_query(context, models.VolumeIdMapping,
@@ -3034,6 +3255,17 @@ def get_ec2_volume_id_by_uuid(context, volume_id, session=None):
     return result['id']
 
 
+@require_context
+def get_ec2_volume_ids_by_uuids(context, volume_ids):
+    return _uuid_mapping_get_ids(_ec2_volume_get_query(context),
+                                 models.VolumeIdMapping, volume_ids)
+
+
+@require_context
+def ec2_volume_bulk_create(context, volume_ids):
+    return _uuid_mapping_bulk_create(models.VolumeIdMapping, volume_ids)
+
+
 @require_context
 def get_volume_uuid_by_ec2_id(context, ec2_id, session=None):
     result = _ec2_volume_get_query(context, session=session).\
@@ -3071,6 +3303,17 @@ def get_ec2_snapshot_id_by_uuid(context, snapshot_id, session=None):
     return result['id']
 
 
+@require_context
+def get_ec2_snapshot_ids_by_uuids(context, snapshot_ids):
+    return _uuid_mapping_get_ids(_ec2_snapshot_get_query(context),
+                                 models.SnapshotIdMapping, snapshot_ids)
+
+
+@require_context
+def ec2_snapshot_bulk_create(context, snapshot_ids):
+    return _uuid_mapping_bulk_create(models.SnapshotIdMapping, snapshot_ids)
+
+
 @require_context
 def get_snapshot_uuid_by_ec2_id(context, ec2_id, session=None):
     result = _ec2_snapshot_get_query(context, session=session).\
@@ -3153,6 +3396,16 @@ def block_device_mapping_get_all_by_instance(context, instance_uuid):
                  all()
 
 
+@require_context
+def block_device_mapping_get_all_by_instance_uuids(context, instance_uuids):
+    if not instance_uuids:
+        return []
+    return _block_device_mapping_get_query(context).\
+                 filter(models.BlockDeviceMapping.instance_uuid.in_(
+                        instance_uuids)).\
+                 all()
+
+
 @require_context
 def block_device_mapping_destroy(context, bdm_id):
     _block_device_mapping_get_query(context).\
@@ -3607,6 +3860,17 @@ def migration_get_in_progress_by_host_and_node(context, host, node,
             all()
 
 
+@require_admin_context
+def migration_get_in_progress_by_host(context, host, session=None):
+
+    return model_query(context, models.Migration, session=session).\
+            filter(or_(models.Migration.source_compute == host,
+                       models.Migration.dest_compute == host)).\
+            filter(~models.Migration.status.in_(['confirmed', 'reverted'])).\
+            options(joinedload_all('instance.system_metadata')).\
+            all()
+
+
 ##################
 
 
@@ -4496,6 +4760,23 @@ def s3_image_get_by_uuid(context, image_uuid):
     return result
 
 
+def s3_image_get_all_by_uuids(context, image_uuids):
+    """Find the local s3 images represented by a list of uuids."""
+    if not image_uuids:
+        return []
+    return model_query(context, models.S3Image, read_deleted="yes").\
+                 filter(models.S3Image.uuid.in_(image_uuids)).\
+                 all()
+
+
+def s3_image_bulk_create(context, image_uuids):
+    """Create local s3 images for a list of uuids in one transaction."""
+    try:
+        return _uuid_mapping_bulk_create(models.S3Image, image_uuids)
+    except Exception, e:
+        raise db_exc.DBError(e)
+
+
 def s3_image_create(context, image_uuid):
     """Create local s3 image represented by provided uuid."""
     try:
@@ -4600,8 +4881,9 @@ def aggregate_host_get_by_metadata_key(context, key):
     rows = query.all()
     metadata = collections.defaultdict(set)
     for agg in rows:
+        values = [kv['value'] for kv in agg._metadata if kv['key'] == key]
         for agghost in agg._hosts:
-            metadata[agghost.host].add(agg._metadata[0]['value'])
+            metadata[agghost.host].update(values)
     return dict(metadata)
 
 
@@ -4948,6 +5230,12 @@ def ec2_instance_create(context, instance_uuid, id=None):
     return ec2_instance_ref
 
 
+@require_context
+def ec2_instance_bulk_create(context, instance_uuids):
+    return _uuid_mapping_bulk_create(models.InstanceIdMapping,
+                                     instance_uuids)
+
+
 @require_context
 def get_ec2_instance_id_by_uuid(context, instance_id, session=None):
     result = _ec2_instance_get_query(context,
@@ -4961,6 +5249,12 @@ def get_ec2_instance_id_by_uuid(context, instance_id, session=None):
     return result['id']
 
 
+@require_context
+def get_ec2_instance_ids_by_uuids(context, instance_uuids):
+    return _uuid_mapping_get_ids(_ec2_instance_get_query(context),
+                                 models.InstanceIdMapping, instance_uuids)
+
+
 @require_context
 def get_instance_uuid_by_ec2_id(context, ec2_id, session=None):
     result = _ec2_instance_get_query(context,
@@ -20,12 +20,12 @@
 
 import base64
 import binascii
+import collections
 import os
-import shutil
 import tarfile
-import tempfile
 
 import boto.s3.connection
+from Crypto.Cipher import AES
 import eventlet
 from lxml import etree
 from oslo.config import cfg
@@ -35,16 +35,11 @@ import nova.cert.rpcapi
 from nova import exception
 from nova.image import glance
 from nova.openstack.common import log as logging
-from nova.openstack.common import processutils
-from nova import utils
 
 
 LOG = logging.getLogger(__name__)
 
 s3_opts = [
-    cfg.StrOpt('image_decryption_dir',
-               default='/tmp',
-               help='parent dir for tempdir used for image decryption'),
     cfg.StrOpt('s3_host',
                default='$my_ip',
                help='hostname or ip for openstack to use when accessing '
@@ -65,12 +60,55 @@ s3_opts = [
                default=False,
                help='whether to affix the tenant id to the access key '
                     'when downloading from s3'),
+    cfg.IntOpt('s3_download_concurrency',
+               default=4,
+               help='number of parts of an image bundle downloaded from s3 '
+                    'at the same time, which is also the number of parts '
+                    'held in memory while registering it'),
     ]
 
 CONF = cfg.CONF
 CONF.register_opts(s3_opts)
 CONF.import_opt('my_ip', 'nova.netconf')
 
+# Size of the reads from the image inside a bundle while uploading it
+CHUNK_SIZE = 65536
+
+
+class _StreamError(Exception):
+    """A stage of the registration of a bundle failed."""
+
+    def __init__(self, image_state):
+        super(_StreamError, self).__init__(image_state)
+        self.image_state = image_state
+
+
+class _IterReader(object):
+    """File-like object reading the strings an iterable yields."""
+
+    def __init__(self, iterable):
+        self._iter = iter(iterable)
+        self._buffer = ''
+        self._offset = 0
+
+    def read(self, size=-1):
+        data = []
+        while size != 0:
+            if self._offset >= len(self._buffer):
+                try:
+                    self._buffer = next(self._iter)
+                except StopIteration:
+                    break
+                self._offset = 0
+                continue
+            end = len(self._buffer)
+            if size > 0:
+                end = min(end, self._offset + size)
+                size -= end - self._offset
+            data.append(self._buffer[self._offset:end])
+            self._offset = end
+        return ''.join(data)
+
 
 class S3ImageService(object):
     """Wraps an existing image service to support s3 based register."""
@@ -90,10 +128,32 @@ class S3ImageService(object):
         self.service = service or glance.get_default_image_service()
         self.service.__init__(*args, **kwargs)
 
-    def _translate_uuids_to_ids(self, context, images):
-        return [self._translate_uuid_to_id(context, img) for img in images]
+    @staticmethod
+    def _get_image_uuids(image):
+        """Return the uuids of an image and of its kernel and ramdisk."""
+        image_uuids = []
+        if 'id' in image:
+            image_uuids.append(image['id'])
+        for prop in ['kernel_id', 'ramdisk_id']:
+            try:
+                image_uuids.append(image['properties'][prop])
+            except (KeyError, ValueError):
+                pass
+        return image_uuids
 
-    def _translate_uuid_to_id(self, context, image):
+    def _translate_uuids_to_ids(self, context, images):
+        # Map the uuids of all the images in a single pass
+        image_uuids = []
+        for image in images:
+            image_uuids.extend(self._get_image_uuids(image))
+        image_ids = ec2utils.glance_ids_to_ids(context, image_uuids)
+        return [self._translate_uuid_to_id(context, img, image_ids)
+                for img in images]
+
+    def _translate_uuid_to_id(self, context, image, image_ids=None):
+        if image_ids is None:
+            image_ids = ec2utils.glance_ids_to_ids(
+                    context, self._get_image_uuids(image))
         image_copy = image.copy()
 
         try:
@@ -101,7 +161,7 @@ class S3ImageService(object):
         except KeyError:
             pass
         else:
-            image_copy['id'] = ec2utils.glance_id_to_id(context, image_uuid)
+            image_copy['id'] = image_ids[image_uuid]
 
         for prop in ['kernel_id', 'ramdisk_id']:
             try:
@@ -109,8 +169,7 @@ class S3ImageService(object):
             except (KeyError, ValueError):
                 pass
             else:
-                image_id = ec2utils.glance_id_to_id(context, image_uuid)
-                image_copy['properties'][prop] = image_id
+                image_copy['properties'][prop] = image_ids[image_uuid]
 
         try:
             image_copy['properties']['image_state'] = self.image_state_map[
@@ -189,11 +248,27 @@ class S3ImageService(object):
                                                host=CONF.s3_host)
 
     @staticmethod
-    def _download_file(bucket, filename, local_dir):
-        key = bucket.get_key(filename)
-        local_filename = os.path.join(local_dir, os.path.basename(filename))
-        key.get_contents_to_filename(local_filename)
-        return local_filename
+    def _download_parts(bucket, filenames):
+        """Yield the contents of the parts of a bundle in order.
+
+        Up to s3_download_concurrency parts are downloaded at the same
+        time, and no more are held until the caller consumed them.
+        """
+        def download(filename):
+            return bucket.get_key(filename).get_contents_as_string()
+
+        pool = eventlet.GreenPool(CONF.s3_download_concurrency)
+        pending = collections.deque()
+        try:
+            for filename in filenames:
+                if len(pending) >= CONF.s3_download_concurrency:
+                    yield pending.popleft().wait()
+                pending.append(pool.spawn(download, filename))
+            while pending:
+                yield pending.popleft().wait()
+        finally:
+            for download_thread in pending:
+                download_thread.kill()
 
     def _s3_parse_manifest(self, context, metadata, manifest):
         manifest = etree.fromstring(manifest)
@@ -284,8 +359,6 @@ class S3ImageService(object):
     def _s3_create(self, context, metadata):
         """Gets a manifest from s3 and makes an image."""
 
-        image_path = tempfile.mkdtemp(dir=CONF.image_decryption_dir)
-
         image_location = metadata['properties']['image_location']
         bucket_name = image_location.split('/')[0]
         manifest_path = image_location[len(bucket_name) + 1:]
@@ -298,10 +371,15 @@ class S3ImageService(object):
                                                               manifest)
 
         def delayed_create():
-            """This handles the fetching and decrypting of the part files."""
+            """This handles the fetching and decrypting of the part files.
+
+            The parts are downloaded, decrypted, gunzipped, untarred and
+            uploaded as a single stream, without going to disk. The image
+            state follows the stage that failed, or is 'uploading' while
+            all of them are running.
+            """
             context.update_store()
-            log_vars = {'image_location': image_location,
-                        'image_path': image_path}
+            log_vars = {'image_location': image_location}
 
             def _update_image_state(context, image_uuid, image_state):
                 metadata = {'properties': {'image_state': image_state}}
@@ -313,64 +391,54 @@ class S3ImageService(object):
                 self.service.update(context, image_uuid, metadata, image_data,
                                     purge_props=False)
 
-            _update_image_state(context, image_uuid, 'downloading')
-
-            try:
-                parts = []
-                elements = manifest.find('image').getiterator('filename')
-                for fn_element in elements:
-                    part = self._download_file(bucket,
-                                               fn_element.text,
-                                               image_path)
-                    parts.append(part)
-
-                # NOTE(vish): this may be suboptimal, should we use cat?
-                enc_filename = os.path.join(image_path, 'image.encrypted')
-                with open(enc_filename, 'w') as combined:
-                    for filename in parts:
-                        with open(filename) as part:
-                            shutil.copyfileobj(part, combined)
-
-            except Exception:
-                LOG.exception(_("Failed to download %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_download')
-                return
+            def _stage(chunks, image_state, message):
+                """Map the errors of a stage to its failed image state."""
+                try:
+                    for chunk in chunks:
+                        yield chunk
+                except _StreamError:
+                    raise
+                except Exception:
+                    LOG.exception(message, log_vars)
+                    raise _StreamError(image_state)
 
-            _update_image_state(context, image_uuid, 'decrypting')
+            _update_image_state(context, image_uuid, 'downloading')
 
             try:
                 hex_key = manifest.find('image/ec2_encrypted_key').text
                 encrypted_key = binascii.a2b_hex(hex_key)
                 hex_iv = manifest.find('image/ec2_encrypted_iv').text
                 encrypted_iv = binascii.a2b_hex(hex_iv)
-
-                dec_filename = os.path.join(image_path, 'image.tar.gz')
-                self._decrypt_image(context, enc_filename, encrypted_key,
-                                    encrypted_iv, dec_filename)
+                key, iv = self._decrypt_key(context, encrypted_key,
+                                            encrypted_iv)
             except Exception:
-                LOG.exception(_("Failed to decrypt %(image_location)s "
-                                "to %(image_path)s"), log_vars)
+                LOG.exception(_("Failed to decrypt %(image_location)s"),
+                              log_vars)
                 _update_image_state(context, image_uuid, 'failed_decrypt')
                 return
 
-            _update_image_state(context, image_uuid, 'untarring')
-
-            try:
-                unz_filename = self._untarzip_image(image_path, dec_filename)
-            except Exception:
-                LOG.exception(_("Failed to untar %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_untar')
-                return
+            filenames = [fn_element.text for fn_element in
+                         manifest.find('image').getiterator('filename')]
+            parts = _stage(self._download_parts(bucket, filenames),
+                           'failed_download',
+                           _("Failed to download %(image_location)s"))
+            decrypted = _stage(self._decrypt_parts(parts, key, iv),
+                               'failed_decrypt',
+                               _("Failed to decrypt %(image_location)s"))
+            untarred = _stage(self._untarzip_image(_IterReader(decrypted)),
+                              'failed_untar',
+                              _("Failed to untar %(image_location)s"))
 
             _update_image_state(context, image_uuid, 'uploading')
             try:
-                with open(unz_filename) as image_file:
-                    _update_image_data(context, image_uuid, image_file)
+                _update_image_data(context, image_uuid,
+                                   _IterReader(untarred))
+            except _StreamError as exc:
+                _update_image_state(context, image_uuid, exc.image_state)
+                return
             except Exception:
-                LOG.exception(_("Failed to upload %(image_location)s "
-                                "to %(image_path)s"), log_vars)
+                LOG.exception(_("Failed to upload %(image_location)s"),
+                              log_vars)
                 _update_image_state(context, image_uuid, 'failed_upload')
                 return
 
@@ -379,14 +447,12 @@ class S3ImageService(object):
             self.service.update(context, image_uuid, metadata,
                     purge_props=False)
 
-            shutil.rmtree(image_path)
-
         eventlet.spawn_n(delayed_create)
 
         return image
 
-    def _decrypt_image(self, context, encrypted_filename, encrypted_key,
-                       encrypted_iv, decrypted_filename):
+    def _decrypt_key(self, context, encrypted_key, encrypted_iv):
+        """Decrypt the AES key and initialization vector of a bundle."""
         elevated = context.elevated()
         try:
             key = self.cert_rpcapi.decrypt_text(elevated,
@@ -402,35 +468,65 @@ class S3ImageService(object):
         except Exception, exc:
             raise exception.NovaException(_('Failed to decrypt initialization '
                                     'vector: %s') % exc)
+        return binascii.a2b_hex(key), binascii.a2b_hex(iv)
 
-        try:
-            utils.execute('openssl', 'enc',
-                          '-d', '-aes-128-cbc',
-                          '-in', '%s' % (encrypted_filename,),
-                          '-K', '%s' % (key,),
-                          '-iv', '%s' % (iv,),
-                          '-out', '%s' % (decrypted_filename,))
-        except processutils.ProcessExecutionError, exc:
-            raise exception.NovaException(_('Failed to decrypt image file '
-                                    '%(image_file)s: %(err)s') %
-                                    {'image_file': encrypted_filename,
-                                     'err': exc.stdout})
+    @staticmethod
+    def _decrypt_parts(parts, key, iv):
+        """Decrypt AES-128-CBC encrypted data with PKCS#5 padding.
+
+        Like openssl enc -d -aes-128-cbc, but yielding the decrypted data
+        as the encrypted parts come in.
+        """
+        cipher = AES.new(key, AES.MODE_CBC, iv)
+        pending = ''
+        for part in parts:
+            pending += part
+            # Hold back the last block, which ends with the padding
+            size = (len(pending) - 1) // AES.block_size * AES.block_size
+            if size > 0:
+                yield cipher.decrypt(pending[:size])
+                pending = pending[size:]
+        if len(pending) != AES.block_size:
+            raise exception.NovaException(_('Failed to decrypt image file: '
+                                            'bad length'))
+        last_block = cipher.decrypt(pending)
+        padding = ord(last_block[-1])
+        if (not 0 < padding <= AES.block_size or
+                last_block[-padding:] != last_block[-1] * padding):
+            raise exception.NovaException(_('Failed to decrypt image file: '
+                                            'bad padding'))
+        yield last_block[:-padding]
 
     @staticmethod
-    def _test_for_malicious_tarball(path, filename):
-        """Raises exception if extracting tarball would escape extract path."""
-        tar_file = tarfile.open(filename, 'r|gz')
-        for n in tar_file.getnames():
-            if not os.path.abspath(os.path.join(path, n)).startswith(path):
-                tar_file.close()
-                raise exception.NovaException(_('Unsafe filenames in image'))
-        tar_file.close()
+    def _test_for_malicious_tarball(member):
+        """Raises exception if extracting member would escape its dir."""
+        path = os.path.join(os.sep, 'image')
+        target = os.path.abspath(os.path.join(path, member.name))
+        if target != path and not target.startswith(path + os.sep):
+            raise exception.NovaException(_('Unsafe filenames in image'))
 
     @staticmethod
-    def _untarzip_image(path, filename):
-        S3ImageService._test_for_malicious_tarball(path, filename)
-        tar_file = tarfile.open(filename, 'r|gz')
-        tar_file.extractall(path)
-        image_file = tar_file.getnames()[0]
-        tar_file.close()
-        return os.path.join(path, image_file)
+    def _untarzip_image(tarball):
+        """Yield the contents of the image in a gzipped tarball stream.
+
+        The image is the first file of the tarball, and all the names of
+        the tarball are checked like they were before extracting it.
+        """
+        tar_file = tarfile.open(fileobj=tarball, mode='r|gz')
+        try:
+            image = tar_file.next()
+            if image is None:
+                raise exception.NovaException(_('Empty image tarball'))
+            S3ImageService._test_for_malicious_tarball(image)
+            if not image.isfile():
+                raise exception.NovaException(_('Image is not a file'))
+            image_file = tar_file.extractfile(image)
+            while True:
+                chunk = image_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            for member in tar_file:
+                S3ImageService._test_for_malicious_tarball(member)
+        finally:
+            tar_file.close()
@@ -34,17 +34,20 @@ S3 client with this module::
 
 """
 
-import bisect
+import contextlib
 import datetime
 import hashlib
 import os
 import os.path
+import sqlite3
+import tempfile
 import urllib
 
 from oslo.config import cfg
 import routes
 import webob
 
+from nova.openstack.common import excutils
 from nova.openstack.common import fileutils
 from nova import paths
 from nova import utils
@@ -66,6 +69,17 @@ s3_opts = [
 CONF = cfg.CONF
 CONF.register_opts(s3_opts)
 
+# Objects are read and written in pieces of this size, so that a request
+# never holds a whole object in memory
+CHUNK_SIZE = 65536
+
+# Uploads are written to a temporary file next to the object, which is
+# renamed over the object once it is complete
+UPLOAD_PREFIX = '.s3upload-'
+
+# Name of the key index kept at the top of every bucket directory
+INDEX_NAME = '.s3index'
+
 
 def get_wsgi_server():
     return wsgi.Server("S3 Objectstore",
@@ -74,6 +88,130 @@ def get_wsgi_server():
                        host=CONF.s3_listen)
 
 
+def _is_reserved(file_name):
+    """Whether a file in a bucket is not an object but ours."""
+    return (file_name.startswith(UPLOAD_PREFIX) or
+            file_name.startswith(INDEX_NAME))
+
+
+def rebuild_indexes(directory, bucket_depth=0, bucket_names=None):
+    """Rebuild the key index of buckets from the objects on disk.
+
+    :param bucket_names: buckets to rebuild the index of, all by default
+    :returns: dict of bucket name to the number of objects indexed
+    """
+    if bucket_names is None:
+        bucket_names = os.listdir(directory)
+    counts = {}
+    for bucket_name in bucket_names:
+        index = BucketIndex(os.path.join(directory, bucket_name),
+                            bucket_depth)
+        counts[bucket_name] = index.rebuild()
+    return counts
+
+
+class BucketIndex(object):
+    """Sorted index of the objects of a bucket, with their size and mtime.
+
+    The index is a sqlite database in the bucket directory, kept up to date
+    by object PUT and DELETE, so that listing a bucket does not have to
+    walk and stat the whole bucket. It is rebuilt from the objects on disk
+    when it is missing, or with nova-manage objectstore rebuild_index after
+    it got out of sync, e.g. because objects were changed behind the back
+    of nova-objectstore.
+    """
+
+    def __init__(self, path, bucket_depth=0):
+        self.path = path
+        self.bucket_depth = bucket_depth
+        self.index_path = os.path.join(path, INDEX_NAME)
+
+    def _connect(self, index_path=None):
+        conn = sqlite3.connect(index_path or self.index_path, timeout=30)
+        # Keep keys as the byte strings they are on disk
+        conn.text_factory = str
+        conn.execute("CREATE TABLE IF NOT EXISTS objects ("
+                     "name TEXT PRIMARY KEY, size INTEGER, mtime REAL)")
+        return conn
+
+    def _object_name(self, path):
+        skip = len(self.path) + 1
+        for i in range(self.bucket_depth):
+            skip += 2 * (i + 1) + 1
+        return path[skip:]
+
+    def _walk(self):
+        for root, dirs, files in os.walk(self.path):
+            for file_name in files:
+                if _is_reserved(file_name):
+                    continue
+                path = os.path.join(root, file_name)
+                info = os.stat(path)
+                yield self._object_name(path), info.st_size, info.st_mtime
+
+    def rebuild(self):
+        """Recreate the index from the objects on disk.
+
+        :returns: the number of objects indexed
+        """
+        objects = list(self._walk())
+        fd, tmp_path = tempfile.mkstemp(prefix=UPLOAD_PREFIX, dir=self.path)
+        os.close(fd)
+        try:
+            with contextlib.closing(self._connect(tmp_path)) as conn:
+                with conn:
+                    conn.executemany("INSERT INTO objects VALUES (?, ?, ?)",
+                                     objects)
+            os.rename(tmp_path, self.index_path)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                utils.delete_if_exists(tmp_path)
+        return len(objects)
+
+    def add(self, path):
+        """Add or update the object stored at path."""
+        if not os.path.exists(self.index_path):
+            # Indexing a single object would hide all the others
+            self.rebuild()
+            return
+        info = os.stat(path)
+        with contextlib.closing(self._connect()) as conn:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO objects "
+                             "VALUES (?, ?, ?)",
+                             (self._object_name(path), info.st_size,
+                              info.st_mtime))
+
+    def remove(self, path):
+        """Remove the object stored at path."""
+        if not os.path.exists(self.index_path):
+            self.rebuild()
+            return
+        with contextlib.closing(self._connect()) as conn:
+            with conn:
+                conn.execute("DELETE FROM objects WHERE name = ?",
+                             (self._object_name(path),))
+
+    def list(self, prefix='', marker='', max_keys=1000):
+        """List the objects after marker whose name starts with prefix.
+
+        :returns: a list of (name, size, mtime) tuples sorted by name, and
+                  whether more objects matched than max_keys
+        """
+        if not os.path.exists(self.index_path):
+            self.rebuild()
+        prefix = utils.utf8(prefix)
+        with contextlib.closing(self._connect()) as conn:
+            rows = conn.execute("SELECT name, size, mtime FROM objects "
+                                "WHERE name > ? AND name >= ? "
+                                "ORDER BY name LIMIT ?",
+                                (utils.utf8(marker), prefix,
+                                 max_keys + 1)).fetchall()
+        # Names starting with prefix all sort right after it
+        objects = [row for row in rows if row[0].startswith(prefix)]
+        return objects[:max_keys], len(objects) > max_keys
+
+
 class S3Application(wsgi.Router):
     """Implementation of an S3-like storage server based on local files.
 
@@ -186,6 +324,8 @@ class BaseRequestHandler(object):
 
         if isinstance(value, basestring):
             parts.append(utils.xhtml_escape(value))
+        elif isinstance(value, bool):
+            parts.append(str(value).lower())
         elif isinstance(value, int) or isinstance(value, long):
             parts.append(str(value))
         elif isinstance(value, datetime.datetime):
@@ -242,38 +382,16 @@ class BucketHandler(BaseRequestHandler):
             not os.path.isdir(path)):
             self.set_404()
             return
-        object_names = []
-        for root, dirs, files in os.walk(path):
-            for file_name in files:
-                object_names.append(os.path.join(root, file_name))
-        skip = len(path) + 1
-        for i in range(self.application.bucket_depth):
-            skip += 2 * (i + 1) + 1
-        object_names = [n[skip:] for n in object_names]
-        object_names.sort()
+        index = BucketIndex(path, self.application.bucket_depth)
+        objects, truncated = index.list(prefix, marker, max_keys)
         contents = []
-
-        start_pos = 0
-        if marker:
-            start_pos = bisect.bisect_right(object_names, marker, start_pos)
-        if prefix:
-            start_pos = bisect.bisect_left(object_names, prefix, start_pos)
-
-        truncated = False
-        for object_name in object_names[start_pos:]:
-            if not object_name.startswith(prefix):
-                break
-            if len(contents) >= max_keys:
-                truncated = True
-                break
-            object_path = self._object_path(bucket_name, object_name)
+        for object_name, size, mtime in objects:
             c = {"Key": object_name}
             if not terse:
-                info = os.stat(object_path)
                 c.update({
                     "LastModified": datetime.datetime.utcfromtimestamp(
-                        info.st_mtime),
-                    "Size": info.st_size,
+                        mtime),
+                    "Size": size,
                 })
             contents.append(c)
             marker = object_name
@@ -294,6 +412,7 @@ class BucketHandler(BaseRequestHandler):
             self.set_status(403)
             return
         fileutils.ensure_tree(path)
+        BucketIndex(path, self.application.bucket_depth).rebuild()
         self.finish()
 
     def delete(self, bucket_name):
@@ -303,9 +422,12 @@ class BucketHandler(BaseRequestHandler):
             not os.path.isdir(path)):
             self.set_404()
             return
-        if len(os.listdir(path)) > 0:
+        file_names = os.listdir(path)
+        if [n for n in file_names if not _is_reserved(n)]:
             self.set_status(403)
             return
+        for file_name in file_names:
+            utils.delete_if_exists(os.path.join(path, file_name))
         os.rmdir(path)
         self.set_status(204)
         self.finish()
@@ -323,9 +445,34 @@ class ObjectHandler(BaseRequestHandler):
         self.set_header("Content-Type", "application/unknown")
         self.set_header("Last-Modified", datetime.datetime.utcfromtimestamp(
             info.st_mtime))
-        object_file = open(path, "r")
+        self.set_header("Accept-Ranges", "bytes")
+        offset, length = 0, info.st_size
+        if self.request.range is not None:
+            byte_range = self.request.range.range_for_length(info.st_size)
+            if byte_range is None:
+                self.set_header("Content-Range", "bytes */%d" % info.st_size)
+                self.set_status(416)
+                return
+            start, stop = byte_range
+            offset, length = start, stop - start
+            self.set_header("Content-Range", "bytes %d-%d/%d" %
+                            (start, stop - 1, info.st_size))
+            self.set_status(206)
+        object_file = open(path, "rb")
+        self.response.app_iter = self._iter_file(object_file, offset, length)
+        self.response.content_length = length
+
+    @staticmethod
+    def _iter_file(object_file, offset, length):
+        """Yield length bytes of object_file from offset in chunks."""
         try:
-            self.finish(object_file.read())
+            object_file.seek(offset)
+            while length > 0:
+                chunk = object_file.read(min(CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
         finally:
             object_file.close()
 
@@ -338,16 +485,30 @@ class ObjectHandler(BaseRequestHandler):
             self.set_404()
             return
         path = self._object_path(bucket, object_name)
-        if not path.startswith(bucket_dir) or os.path.isdir(path):
+        if (not path.startswith(bucket_dir) or os.path.isdir(path) or
+            _is_reserved(os.path.basename(path))):
             self.set_status(403)
             return
         directory = os.path.dirname(path)
         fileutils.ensure_tree(directory)
-        object_file = open(path, "w")
-        object_file.write(self.request.body)
-        object_file.close()
-        self.set_header('ETag',
-                        '"%s"' % hashlib.md5(self.request.body).hexdigest())
+        fd, tmp_path = tempfile.mkstemp(prefix=UPLOAD_PREFIX, dir=directory)
+        md5 = hashlib.md5()
+        try:
+            with os.fdopen(fd, "wb") as object_file:
+                body = self.request.body_file
+                while True:
+                    chunk = body.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+                    object_file.write(chunk)
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, path)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                utils.delete_if_exists(tmp_path)
+        BucketIndex(bucket_dir, self.application.bucket_depth).add(path)
+        self.set_header('ETag', '"%s"' % md5.hexdigest())
         self.finish()
 
     def delete(self, bucket, object_name):
@@ -358,5 +519,8 @@ class ObjectHandler(BaseRequestHandler):
             self.set_404()
             return
         os.unlink(path)
+        bucket_dir = os.path.abspath(os.path.join(
+            self.application.directory, bucket))
+        BucketIndex(bucket_dir, self.application.bucket_depth).remove(path)
         self.set_status(204)
         self.finish()
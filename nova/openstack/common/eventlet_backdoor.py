@@ -28,6 +28,8 @@ import eventlet.backdoor
 import greenlet
 from oslo.config import cfg
 
+from nova.openstack.common import lockutils
+
 eventlet_backdoor_opts = [
     cfg.IntOpt('backdoor_port',
                default=None,
@@ -67,6 +69,7 @@ def initialize_if_enabled():
         'fo': _find_objects,
         'pgt': _print_greenthreads,
         'pnt': _print_nativethreads,
+        'lockstats': lockutils.get_lock_stats,
     }
 
     if CONF.backdoor_port is None:
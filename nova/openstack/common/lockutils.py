@@ -132,8 +132,91 @@ else:
     import fcntl
     InterProcessLock = _PosixLock
 
+# NOTE: entries go away once no greenthread holds or waits for the
+# semaphore, so this does not grow with every lock name ever used
 _semaphores = weakref.WeakValueDictionary()
 
+# Number of lock names to keep contention statistics for
+_MAX_LOCK_STATS = 1000
+
+
+class _LockStats(object):
+    """Contention statistics of the locks taken through @synchronized,
+    by lock name.
+
+    Only the _MAX_LOCK_STATS most recently used names are kept, as
+    some lock names are used once per instance or image.  Names that
+    are held or waited for are never dropped.
+    """
+
+    def __init__(self, max_names):
+        self.max_names = max_names
+        self._stats = {}
+
+    def waiting(self, name):
+        """Count a thread waiting for a lock and return its entry."""
+        entry = self._stats.get(name)
+        if entry is None:
+            entry = self._stats[name] = {'acquisitions': 0,
+                                         'waiters': 0,
+                                         'holders': 0,
+                                         'total_wait': 0.0,
+                                         'max_wait': 0.0,
+                                         'total_hold': 0.0,
+                                         'max_hold': 0.0,
+                                         'last_used': 0.0}
+        # Count the waiter first, so eviction never drops this name
+        entry['waiters'] += 1
+        entry['last_used'] = time.time()
+        if len(self._stats) > self.max_names:
+            self._evict()
+        return entry
+
+    def acquired(self, entry, wait_time):
+        entry['waiters'] -= 1
+        entry['holders'] += 1
+        entry['acquisitions'] += 1
+        entry['total_wait'] += wait_time
+        entry['max_wait'] = max(entry['max_wait'], wait_time)
+
+    def gave_up(self, entry):
+        entry['waiters'] -= 1
+
+    def released(self, entry, hold_time):
+        entry['holders'] -= 1
+        entry['total_hold'] += hold_time
+        entry['max_hold'] = max(entry['max_hold'], hold_time)
+        entry['last_used'] = time.time()
+
+    def _evict(self):
+        # Drop a tenth of the names at once, so this sort does not run
+        # for every new name
+        idle = sorted((entry['last_used'], name)
+                      for name, entry in self._stats.iteritems()
+                      if not entry['waiters'] and not entry['holders'])
+        excess = len(self._stats) - self.max_names + self.max_names // 10
+        for _last_used, name in idle[:excess]:
+            del self._stats[name]
+
+    def get(self):
+        return dict((name, dict(entry))
+                    for name, entry in self._stats.iteritems())
+
+
+_lock_stats = _LockStats(_MAX_LOCK_STATS)
+
+
+def get_lock_stats():
+    """Return contention statistics for the recently used lock names.
+
+    For every lock name, this returns a dict with the number of
+    'acquisitions', the 'total_wait' and 'max_wait' seconds it took to
+    get the lock (the semaphore and the file lock, if external), the
+    'total_hold' and 'max_hold' seconds it was held, and the current
+    number of 'waiters' and 'holders'.
+    """
+    return _lock_stats.get()
+
 
 def synchronized(name, lock_file_prefix, external=False, lock_path=None):
     """Synchronization decorator.
@@ -174,6 +257,25 @@ def synchronized(name, lock_file_prefix, external=False, lock_path=None):
     def wrap(f):
         @functools.wraps(f)
         def inner(*args, **kwargs):
+            stats = _lock_stats.waiting(name)
+            started = time.time()
+            times = {}
+
+            def call_locked():
+                times['acquired'] = time.time()
+                _lock_stats.acquired(stats, times['acquired'] - started)
+                return f(*args, **kwargs)
+
+            try:
+                return run_with_locks(call_locked)
+            finally:
+                if 'acquired' in times:
+                    _lock_stats.released(stats,
+                                         time.time() - times['acquired'])
+                else:
+                    _lock_stats.gave_up(stats)
+
+        def run_with_locks(call_locked):
             # NOTE(soren): If we ever go natively threaded, this will be racy.
             #              See http://stackoverflow.com/questions/5390569/dyn
             #              amically-allocating-and-destroying-mutexes
@@ -229,7 +331,7 @@ def synchronized(name, lock_file_prefix, external=False, lock_path=None):
                                           {'lock': name,
                                            'path': lock_file_path,
                                            'method': f.__name__})
-                                retval = f(*args, **kwargs)
+                                retval = call_locked()
                         finally:
                             LOG.debug(_('Released file lock "%(lock)s" at '
                                         '%(path)s for method "%(method)s"...'),
@@ -243,7 +345,7 @@ def synchronized(name, lock_file_prefix, external=False, lock_path=None):
                             if cleanup_dir:
                                 shutil.rmtree(local_lock_path)
                     else:
-                        retval = f(*args, **kwargs)
+                        retval = call_locked()
 
                 finally:
                     local.strong_store.locks_held.remove(name)
@@ -14,7 +14,11 @@
 #    under the License.
 
 import datetime
+import random
 import time
+
+from eventlet import greenpool
+from eventlet import greenthread
 from oslo.config import cfg
 
 from nova.openstack.common.gettextutils import _
@@ -27,6 +31,17 @@ periodic_opts = [
                 default=True,
                 help=('Some periodic tasks can be run in a separate process. '
                       'Should we run them here?')),
+    cfg.IntOpt('periodic_task_concurrency',
+               default=0,
+               help=('Number of periodic tasks that may run at the same '
+                     'time, each in its own greenthread. 0 runs them one '
+                     'after the other.')),
+    cfg.FloatOpt('periodic_task_max_jitter',
+                 default=0.0,
+                 help=('When periodic tasks run concurrently, delay each run '
+                       'by a random number of seconds up to this value, so '
+                       'that many services do not hit the same resources at '
+                       'once.')),
 ]
 
 CONF = cfg.CONF
@@ -149,11 +164,108 @@ class _PeriodicTasksMeta(type):
                 cls._periodic_last_run[name] = task._periodic_last_run
 
 
+class PeriodicTaskStats(object):
+    """Run statistics of a single periodic task."""
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        # runs that took longer than the spacing of the task
+        self.overruns = 0
+        # runs skipped because the previous one had not finished
+        self.skipped = 0
+        self.running = False
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+
+    def to_dict(self):
+        return {'runs': self.runs,
+                'failures': self.failures,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'running': self.running,
+                'last_duration': self.last_duration,
+                'max_duration': self.max_duration,
+                'total_duration': self.total_duration}
+
+
 class PeriodicTasks(object):
     __metaclass__ = _PeriodicTasksMeta
 
+    def _get_periodic_task_stats(self, task_name):
+        try:
+            all_stats = self._periodic_task_stats
+        except AttributeError:
+            all_stats = self._periodic_task_stats = {}
+        return all_stats.setdefault(task_name, PeriodicTaskStats())
+
+    def get_periodic_task_stats(self):
+        """Return the run statistics of all periodic tasks.
+
+        :returns: dict of task name => dict with the number of 'runs',
+                  'failures', 'overruns' (runs that took longer than the
+                  spacing of the task) and 'skipped' runs (the previous
+                  run had not finished), whether the task is 'running',
+                  and its 'last_duration', 'max_duration' and
+                  'total_duration' in seconds.
+        """
+        return dict((task_name,
+                     self._get_periodic_task_stats(task_name).to_dict())
+                    for task_name, task in self._periodic_tasks)
+
+    def _get_periodic_task_pool(self):
+        try:
+            return self._periodic_task_pool
+        except AttributeError:
+            self._periodic_task_pool = greenpool.GreenPool(
+                CONF.periodic_task_concurrency)
+            return self._periodic_task_pool
+
+    def _run_periodic_task(self, context, task_name, task, raise_on_error,
+                           jitter=0):
+        full_task_name = '.'.join([self.__class__.__name__, task_name])
+        stats = self._get_periodic_task_stats(task_name)
+        stats.running = True
+        try:
+            if jitter:
+                greenthread.sleep(jitter)
+
+            LOG.debug(_("Running periodic task %(full_task_name)s"), locals())
+            start = timeutils.utcnow()
+            try:
+                task(self, context)
+            except Exception as e:
+                stats.failures += 1
+                if raise_on_error:
+                    raise
+                LOG.exception(_("Error during %(full_task_name)s: %(e)s"),
+                              locals())
+            finally:
+                duration = timeutils.delta_seconds(start, timeutils.utcnow())
+                stats.runs += 1
+                stats.last_duration = duration
+                stats.max_duration = max(stats.max_duration, duration)
+                stats.total_duration += duration
+                spacing = self._periodic_spacing[task_name]
+                if spacing is not None and duration > spacing:
+                    stats.overruns += 1
+                    LOG.warn(_("Periodic task %(full_task_name)s took "
+                               "%(duration).2f seconds, longer than its "
+                               "interval of %(spacing)s seconds"), locals())
+        finally:
+            stats.running = False
+
     def run_periodic_tasks(self, context, raise_on_error=False):
-        """Tasks to be run at a periodic interval."""
+        """Tasks to be run at a periodic interval.
+
+        With periodic_task_concurrency set, every due task is started in its
+        own greenthread and this returns without waiting for them. A task
+        whose previous run has not finished yet is skipped. Tasks always run
+        one after the other when raise_on_error is set, since their errors
+        have to reach the caller.
+        """
+        concurrent = CONF.periodic_task_concurrency > 0 and not raise_on_error
         idle_for = DEFAULT_INTERVAL
         for task_name, task in self._periodic_tasks:
             full_task_name = '.'.join([self.__class__.__name__, task_name])
@@ -172,16 +284,35 @@ class PeriodicTasks(object):
             if spacing is not None:
                 idle_for = min(idle_for, spacing)
 
-            LOG.debug(_("Running periodic task %(full_task_name)s"), locals())
+            if not concurrent:
+                self._periodic_last_run[task_name] = timeutils.utcnow()
+                self._run_periodic_task(context, task_name, task,
+                                        raise_on_error)
+                time.sleep(0)
+                continue
+
+            stats = self._get_periodic_task_stats(task_name)
+            if stats.running:
+                stats.skipped += 1
+                LOG.warn(_("Skipping periodic task %(full_task_name)s "
+                           "because its previous run has not finished"),
+                         locals())
+                self._periodic_last_run[task_name] = timeutils.utcnow()
+                continue
+
+            pool = self._get_periodic_task_pool()
+            if not pool.free():
+                # Leave the task due and try again shortly
+                idle_for = min(idle_for, 1)
+                continue
+
+            jitter = random.uniform(0, min(CONF.periodic_task_max_jitter,
+                                           spacing or DEFAULT_INTERVAL))
             self._periodic_last_run[task_name] = timeutils.utcnow()
-
-            try:
-                task(self, context)
-            except Exception as e:
-                if raise_on_error:
-                    raise
-                LOG.exception(_("Error during %(full_task_name)s: %(e)s"),
-                              locals())
-            time.sleep(0)
+            # Mark the task as running right away so that it is not
+            # started twice while waiting for its jitter
+            stats.running = True
+            pool.spawn_n(self._run_periodic_task, context, task_name, task,
+                         False, jitter)
 
         return idle_for
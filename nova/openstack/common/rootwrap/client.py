@@ -0,0 +1,114 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Client side of the root wrapper daemon."""
+
+import socket
+import subprocess
+import threading
+
+from nova.openstack.common.rootwrap import daemon
+
+
+class DaemonNotRunning(Exception):
+    """The rootwrap daemon could not be started or reached."""
+    pass
+
+
+class Client(object):
+    """Send commands to a rootwrap daemon, starting it on first use.
+
+    :param daemon_cmd: command line starting the daemon, for example
+                       ['sudo', 'nova-rootwrap-daemon',
+                        '/etc/nova/rootwrap.conf']
+    """
+
+    def __init__(self, daemon_cmd):
+        self._daemon_cmd = daemon_cmd
+        self._process = None
+        self._socket_path = None
+        self._lock = threading.Lock()
+
+    def _start_daemon(self):
+        process = subprocess.Popen(self._daemon_cmd,
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   close_fds=True)
+        socket_path = process.stdout.readline().strip()
+        if not socket_path:
+            process.wait()
+            raise DaemonNotRunning("%s exited with %s" %
+                                   (' '.join(self._daemon_cmd),
+                                    process.returncode))
+        self._process = process
+        self._socket_path = socket_path
+
+    def _ensure_daemon(self, restart=False):
+        with self._lock:
+            running = (self._process is not None and
+                       self._process.poll() is None)
+            if restart and running:
+                self.stop()
+                running = False
+            if not running:
+                self._start_daemon()
+            return self._socket_path
+
+    def _connect(self, socket_path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def _send(self, sock, request):
+        try:
+            sock.sendall(request)
+            sock.shutdown(socket.SHUT_WR)
+            return daemon.recv_all(sock)
+        finally:
+            sock.close()
+
+    def execute(self, userargs, stdin=None):
+        """Run userargs through the daemon.
+
+        Only failing to connect is retried, with a new daemon.  Once the
+        request may have reached the daemon, errors are raised, as the
+        command must not run twice.
+
+        :returns: (returncode, stdout, stderr)
+        """
+        request = daemon.encode_request(userargs, stdin)
+        try:
+            sock = self._connect(self._ensure_daemon())
+        except socket.error:
+            # The daemon went away; start a new one and try once more.
+            sock = self._connect(self._ensure_daemon(restart=True))
+        data = self._send(sock, request)
+        if not data:
+            raise DaemonNotRunning("Empty response from rootwrap daemon")
+        return daemon.decode_response(data)
+
+    def stop(self):
+        """Stop the daemon by closing its stdin."""
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait()
+            self._process = None
+            self._socket_path = None
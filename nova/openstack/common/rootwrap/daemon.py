@@ -0,0 +1,241 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long-lived root wrapper reachable over a UNIX socket
+
+   Loading the filter definitions and starting a Python interpreter for
+   every privileged command is the dominant cost of running it through
+   nova-rootwrap. In daemon mode the filters are loaded once and commands
+   are received over a UNIX socket that only the user who started the
+   daemon may connect to. Every command is checked with the same
+   match_filter logic as nova-rootwrap and runs in its own thread, so
+   several commands can be in flight at once.
+
+   Requests and responses are single JSON documents; each connection
+   carries exactly one command. Command input and output are base64
+   encoded since they may be binary.
+"""
+
+import base64
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+from nova.openstack.common.rootwrap import wrapper
+
+
+RC_UNAUTHORIZED = 99
+RC_NOEXECFOUND = 96
+RC_BADREQUEST = 95
+
+# From <sys/socket.h>; only Linux provides peer credentials this way
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+
+def _subprocess_setup():
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def recv_all(sock):
+    """Read from sock until the peer shuts down its sending side."""
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return ''.join(chunks)
+        chunks.append(chunk)
+
+
+def encode_request(userargs, stdin=None):
+    return json.dumps({'cmd': list(userargs),
+                       'stdin': base64.b64encode(stdin or '')})
+
+
+def decode_response(data):
+    response = json.loads(data)
+    return (response['returncode'],
+            base64.b64decode(response['stdout']),
+            base64.b64decode(response['stderr']))
+
+
+def _response(returncode, stdout='', stderr=''):
+    return json.dumps({'returncode': returncode,
+                       'stdout': base64.b64encode(stdout),
+                       'stderr': base64.b64encode(stderr)})
+
+
+class RootwrapServer(object):
+    """Serve filtered commands on a UNIX socket.
+
+    :param config: RootwrapConfig to use
+    :param filters: filters as returned by wrapper.load_filters
+    :param allowed_uid: only peers running as this uid may send commands
+    """
+
+    def __init__(self, config, filters, allowed_uid):
+        self.config = config
+        self.filters = filters
+        self.allowed_uid = allowed_uid
+        self.sock = None
+        self.socket_path = None
+        self._tmpdir = None
+        self._stopped = False
+
+    def bind(self, allowed_gid=None):
+        """Create the listening socket in a fresh private directory."""
+        self._tmpdir = tempfile.mkdtemp(prefix='rootwrap-')
+        self.socket_path = os.path.join(self._tmpdir, 'rootwrap.sock')
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.socket_path)
+        if allowed_gid is not None and os.geteuid() == 0:
+            os.chown(self._tmpdir, self.allowed_uid, allowed_gid)
+            os.chown(self.socket_path, self.allowed_uid, allowed_gid)
+        os.chmod(self._tmpdir, 0o700)
+        os.chmod(self.socket_path, 0o600)
+        self.sock.listen(128)
+        return self.socket_path
+
+    def serve_forever(self):
+        while not self._stopped:
+            try:
+                conn, _addr = self.sock.accept()
+            except socket.error:
+                if self._stopped:
+                    break
+                raise
+            thread = threading.Thread(target=self._handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """Stop accepting new commands."""
+        if self._stopped or self.sock is None:
+            return
+        self._stopped = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+    def cleanup(self):
+        """Stop the server and remove its socket."""
+        self.stop()
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+
+    def _peer_uid(self, conn):
+        creds = conn.getsockopt(socket.SOL_SOCKET, SO_PEERCRED,
+                                struct.calcsize('3i'))
+        return struct.unpack('3i', creds)[1]
+
+    def _handle(self, conn):
+        try:
+            peer_uid = self._peer_uid(conn)
+            if peer_uid != self.allowed_uid:
+                logging.error("Rejected rootwrap connection from uid %s" %
+                              peer_uid)
+                return
+            try:
+                request = json.loads(recv_all(conn))
+                userargs = [str(arg) for arg in request['cmd']]
+                stdin = base64.b64decode(request.get('stdin') or '')
+            except (ValueError, KeyError, TypeError):
+                conn.sendall(_response(RC_BADREQUEST,
+                                       stderr='Malformed request'))
+                return
+            conn.sendall(self.run_command(userargs, stdin))
+        except Exception:
+            logging.exception("Unexpected error in rootwrap daemon")
+        finally:
+            conn.close()
+
+    def run_command(self, userargs, stdin=''):
+        """Check userargs against the filters and run the command.
+
+        :returns: JSON encoded response
+        """
+        if not userargs:
+            return _response(RC_BADREQUEST, stderr='No command specified')
+        config = self.config
+        try:
+            filtermatch = wrapper.match_filter(self.filters, userargs,
+                                               exec_dirs=config.exec_dirs)
+        except wrapper.FilterMatchNotExecutable as exc:
+            msg = ("Executable not found: %s (filter match = %s)"
+                   % (exc.match.exec_path, exc.match.name))
+            if config.use_syslog:
+                logging.error(msg)
+            return _response(RC_NOEXECFOUND, stderr=msg)
+        except wrapper.NoFilterMatched:
+            msg = ("Unauthorized command: %s (no filter matched)"
+                   % ' '.join(userargs))
+            if config.use_syslog:
+                logging.error(msg)
+            return _response(RC_UNAUTHORIZED, stderr=msg)
+
+        command = filtermatch.get_command(userargs,
+                                          exec_dirs=config.exec_dirs)
+        if config.use_syslog:
+            logging.info("(uid %s) Executing %s (filter match = %s)" % (
+                self.allowed_uid, command, filtermatch.name))
+        obj = subprocess.Popen(command,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               close_fds=True,
+                               preexec_fn=_subprocess_setup,
+                               env=filtermatch.get_environment(userargs))
+        stdout, stderr = obj.communicate(stdin)
+        return _response(obj.returncode, stdout, stderr)
+
+
+def _watch_parent(server):
+    # The client keeps our stdin open for as long as it runs; EOF means
+    # it went away and nobody may talk to us anymore.
+    while sys.stdin.read(1):
+        pass
+    server.stop()
+
+
+def daemon_start(config, filters):
+    """Serve commands until the process that started us exits.
+
+    The socket path is written to stdout once the daemon accepts commands.
+    """
+    allowed_uid = int(os.environ.get('SUDO_UID', os.getuid()))
+    allowed_gid = int(os.environ.get('SUDO_GID', os.getgid()))
+    server = RootwrapServer(config, filters, allowed_uid)
+    server.bind(allowed_gid)
+    try:
+        watcher = threading.Thread(target=_watch_parent, args=(server,))
+        watcher.daemon = True
+        watcher.start()
+        sys.stdout.write(server.socket_path + '\n')
+        sys.stdout.flush()
+        server.serve_forever()
+    finally:
+        server.cleanup()
@@ -1201,6 +1201,74 @@ class CloudTestCase(test.TestCase):
         result = self.cloud.describe_instances(self.context)
         self.assertEqual(len(result['reservationSet']), 2)
 
+    def test_describe_instances_bulk_lookups(self):
+        # Instances are formatted without any lookup per instance
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        kernel_uuid = 'cedef40a-ed67-4d10-800e-17455edce176'
+        ramdisk_uuid = 'cedef40a-ed67-4d10-800e-17455edce177'
+        sys_meta = flavors.save_instance_type_info(
+            {}, flavors.get_instance_type(1))
+        instances = []
+        for host in ('host1', 'host2', 'host2'):
+            instances.append(db.instance_create(self.context,
+                    {'reservation_id': 'a',
+                     'image_ref': image_uuid,
+                     'kernel_id': kernel_uuid,
+                     'ramdisk_id': ramdisk_uuid,
+                     'instance_type_id': 1,
+                     'host': host,
+                     'vm_state': 'active',
+                     'metadata': {'name': host},
+                     'system_metadata': sys_meta}))
+        agg = db.aggregate_create(self.context,
+                {'name': 'agg1'}, {'availability_zone': 'zone1'})
+        db.aggregate_host_add(self.context, agg['id'], 'host1')
+        bdm_lookups = []
+        real_bdm_get = db.block_device_mapping_get_all_by_instance_uuids
+
+        def fake_bdm_get(context, instance_uuids):
+            bdm_lookups.append(sorted(instance_uuids))
+            return real_bdm_get(context, instance_uuids)
+
+        def not_bulk(*args, **kwargs):
+            self.fail('Instances looked up one by one')
+
+        self.stubs.Set(db, 'block_device_mapping_get_all_by_instance_uuids',
+                       fake_bdm_get)
+
+        self.stubs.Set(db, 'get_ec2_instance_id_by_uuid', not_bulk)
+        self.stubs.Set(db, 's3_image_get_by_uuid', not_bulk)
+        self.stubs.Set(db, 'block_device_mapping_get_all_by_instance',
+                       not_bulk)
+        self.stubs.Set(db, 'aggregate_metadata_get_by_host', not_bulk)
+        self.stubs.Set(self.cloud.compute_api, 'get_instance_metadata',
+                       not_bulk)
+
+        result = self.cloud.describe_instances(self.context)
+        self.assertEqual(1, len(result['reservationSet']))
+        result = result['reservationSet'][0]['instancesSet']
+        self.assertEqual(3, len(result))
+        self.assertEqual(3, len(set(i['instanceId'] for i in result)))
+        self.assertEqual(['zone1', 'nova', 'nova'],
+                         [i['placement']['availabilityZone'] for i in result])
+        self.assertEqual([[{'key': 'name', 'value': host}]
+                          for host in ('host1', 'host2', 'host2')],
+                         [i['tagSet'] for i in result])
+        self.assertEqual([sorted(instance['uuid'] for instance in instances)],
+                         bdm_lookups)
+        for i in result:
+            self.assertEqual('ami-', i['imageId'][:4])
+            self.assertEqual('aki-', i['kernelId'][:4])
+            self.assertEqual('ari-', i['ramdiskId'][:4])
+
+        self.stubs.UnsetAll()
+        for instance, i in zip(instances, result):
+            self.assertEqual(ec2utils.id_to_ec2_inst_id(instance['uuid']),
+                             i['instanceId'])
+            self.assertEqual(ec2utils.glance_id_to_ec2_id(
+                                self.context, kernel_uuid, 'aki'),
+                             i['kernelId'])
+
     def test_describe_images(self):
         describe_images = self.cloud.describe_images
 
@@ -16,6 +16,7 @@
 Fakes For Cells tests.
 """
 
+import eventlet
 from oslo.config import cfg
 
 from nova.cells import driver
@@ -43,6 +44,10 @@ FAKE_CELL_LAYOUT = [{'child-cell1': []},
 # For each cell, a CellStubInfo will be created with this info.
 CELL_NAME_TO_STUB_INFO = {}
 
+# Seconds messages sent to a cell take to arrive, see set_cell_latency()
+CELL_NAME_TO_LATENCY = {}
+DELAYED_MESSAGES = []
+
 
 class FakeDBApi(object):
     """Cells uses a different DB in each cell.  This means in order to
@@ -80,7 +85,12 @@ class FakeCellState(cells_state.CellState):
         message = message_runner.message_from_json(json_message)
         # Restore this so we can use mox and verify same context
         message.ctxt = orig_ctxt
-        message.process()
+        latency = CELL_NAME_TO_LATENCY.get(self.name)
+        if latency is None:
+            message.process()
+        else:
+            DELAYED_MESSAGES.append(
+                    eventlet.spawn_after(latency, message.process))
 
 
 class FakeCellStateManager(cells_state.CellStateManager):
@@ -156,12 +166,28 @@ def _build_cell_stub_infos(test_case):
 
 def init(test_case):
     global CELL_NAME_TO_STUB_INFO
+    global CELL_NAME_TO_LATENCY
     test_case.flags(driver='nova.tests.cells.fakes.FakeCellsDriver',
             group='cells')
     CELL_NAME_TO_STUB_INFO = {}
+    CELL_NAME_TO_LATENCY = {}
+    test_case.addCleanup(_kill_delayed_messages)
     _build_cell_stub_infos(test_case)
 
 
+def _kill_delayed_messages():
+    while DELAYED_MESSAGES:
+        DELAYED_MESSAGES.pop().kill()
+
+
+def set_cell_latency(cell_name, seconds):
+    """Deliver messages sent to a cell in a greenthread, after some
+    seconds, instead of processing them right away.  A latency of 0
+    still makes the sender go on without waiting for the cell.
+    """
+    CELL_NAME_TO_LATENCY[cell_name] = seconds
+
+
 def _get_cell_stub_info(cell_name):
     return CELL_NAME_TO_STUB_INFO[cell_name]
 
@@ -23,6 +23,7 @@ from oslo.config import cfg
 from nova.cells import messaging
 from nova.cells import utils as cells_utils
 from nova import context
+from nova import exception
 from nova.openstack.common import rpc
 from nova.openstack.common import timeutils
 from nova import test
@@ -195,7 +196,7 @@ class CellsManagerClassTestCase(test.TestCase):
         def utcnow():
             return stalled_time
 
-        call_info = {'get_instances': 0, 'sync_instances': []}
+        call_info = {'get_instances': 0, 'sync_instances': [], 'queries': 0}
 
         instances = ['instance1', 'instance2', 'instance3']
 
@@ -207,19 +208,22 @@ class CellsManagerClassTestCase(test.TestCase):
             call_info['get_instances'] += 1
             return iter(instances)
 
-        def instance_get_by_uuid(context, uuid):
-            return instances[int(uuid[-1]) - 1]
+        def instance_get_all_by_filters(context, filters, sort_key,
+                                        sort_dir):
+            self.assertEqual('yes', context.read_deleted)
+            call_info['queries'] += 1
+            return list(filters['uuid'])
 
-        def sync_instance(context, instance):
+        def sync_instances_at_top(context, instances):
             self.assertEqual(context, fake_context)
-            call_info['sync_instances'].append(instance)
+            call_info['sync_instances'].extend(instances)
 
         self.stubs.Set(cells_utils, 'get_instances_to_sync',
                 get_instances_to_sync)
-        self.stubs.Set(self.cells_manager.db, 'instance_get_by_uuid',
-                instance_get_by_uuid)
-        self.stubs.Set(self.cells_manager, '_sync_instance',
-                sync_instance)
+        self.stubs.Set(self.cells_manager.db, 'instance_get_all_by_filters',
+                instance_get_all_by_filters)
+        self.stubs.Set(self.msg_runner, 'sync_instances_at_top',
+                sync_instances_at_top)
         self.stubs.Set(timeutils, 'utcnow', utcnow)
 
         self.cells_manager._heal_instances(fake_context)
@@ -227,9 +231,10 @@ class CellsManagerClassTestCase(test.TestCase):
         self.assertEqual(call_info['project_id'], None)
         self.assertEqual(call_info['updated_since'], updated_since)
         self.assertEqual(call_info['get_instances'], 1)
-        # Only first 2
+        # Only first 2, fetched with a single query
         self.assertEqual(call_info['sync_instances'],
                 instances[:2])
+        self.assertEqual(call_info['queries'], 1)
 
         call_info['sync_instances'] = []
         self.cells_manager._heal_instances(fake_context)
@@ -240,6 +245,7 @@ class CellsManagerClassTestCase(test.TestCase):
         # Now the last 1 and the first 1
         self.assertEqual(call_info['sync_instances'],
                 [instances[-1], instances[0]])
+        self.assertEqual(call_info['queries'], 2)
 
     def test_sync_instances(self):
         self.mox.StubOutWithMock(self.msg_runner,
@@ -277,6 +283,47 @@ class CellsManagerClassTestCase(test.TestCase):
                                                       filters='fake-filters')
         self.assertEqual(expected_response, response)
 
+    def _stub_service_get_all_timeout(self, ok_cells):
+        responses = []
+        expected_services = []
+        for cell_name in ok_cells:
+            responses.append(messaging.Response(
+                    cell_name, [copy.deepcopy(FAKE_SERVICES[0])], False))
+            expected_service = copy.deepcopy(FAKE_SERVICES[0])
+            cells_utils.add_cell_to_service(expected_service, cell_name)
+            expected_services.append(expected_service)
+        responses.append(messaging.Response('path!to!cell2',
+                                            exception.CellTimeout(), True))
+
+        self.mox.StubOutWithMock(self.msg_runner,
+                                 'service_get_all')
+        self.msg_runner.service_get_all(self.ctxt,
+                                        'fake-filters').AndReturn(responses)
+        self.mox.ReplayAll()
+        return expected_services
+
+    def test_service_get_all_raises_for_timed_out_cells(self):
+        self._stub_service_get_all_timeout([self.our_cell, 'path!to!cell1'])
+        exc = self.assertRaises(exception.CellTimeout,
+                                self.cells_manager.service_get_all,
+                                self.ctxt, filters='fake-filters')
+        self.assertTrue('path!to!cell2' in str(exc))
+
+    def test_service_get_all_partial_returns_timed_out_cells(self):
+        expected_services = self._stub_service_get_all_timeout(
+                [self.our_cell, 'path!to!cell1'])
+        response = self.cells_manager.service_get_all(self.ctxt,
+                                                      filters='fake-filters',
+                                                      partial=True)
+        self.assertEqual({'results': expected_services,
+                          'timed_out_cells': ['path!to!cell2']}, response)
+
+    def test_service_get_all_partial_raises_without_child_results(self):
+        self._stub_service_get_all_timeout([self.our_cell])
+        self.assertRaises(exception.CellTimeout,
+                          self.cells_manager.service_get_all,
+                          self.ctxt, filters='fake-filters', partial=True)
+
     def test_service_get_by_compute_host(self):
         self.mox.StubOutWithMock(self.msg_runner,
                                  'service_get_by_compute_host')
@@ -434,6 +481,21 @@ class CellsManagerClassTestCase(test.TestCase):
         response = self.cells_manager.compute_node_stats(self.ctxt)
         self.assertEqual(expected_resp, response)
 
+    def test_compute_node_stats_partial(self):
+        responses = [messaging.Response('cell1', {'key1': 1}, False),
+                     messaging.Response('cell2', {'key1': 2}, False),
+                     messaging.Response('cell3', exception.CellTimeout(),
+                                        True)]
+
+        self.mox.StubOutWithMock(self.msg_runner,
+                                 'compute_node_stats')
+        self.msg_runner.compute_node_stats(self.ctxt).AndReturn(responses)
+        self.mox.ReplayAll()
+        response = self.cells_manager.compute_node_stats(self.ctxt,
+                                                         partial=True)
+        self.assertEqual({'results': {'key1': 3},
+                          'timed_out_cells': ['cell3']}, response)
+
     def test_compute_node_get(self):
         fake_cell = 'fake-cell'
         fake_response = messaging.Response(fake_cell,
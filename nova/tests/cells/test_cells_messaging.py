@@ -15,6 +15,8 @@
 Tests For Cells Messaging module
 """
 
+import time
+
 from oslo.config import cfg
 
 from nova.cells import messaging
@@ -506,6 +508,74 @@ class CellsMessageClassesTestCase(test.TestCase):
             self.assertEqual('response-%s' % response.cell_name,
                     response.value_or_raise())
 
+    def _process_with_latency(self, slow_cell):
+        self.flags(broadcast_call_timeout=0.5, group='cells')
+
+        def our_fake_method(message, **kwargs):
+            return 'response-%s' % message.routing_path
+
+        fakes.stub_bcast_methods(self, 'our_fake_method', our_fake_method)
+        # Deliver every message in the background, so that the cells
+        # are waited for in parallel, and hold up the slow one
+        for cell_name in fakes.CELL_NAME_TO_STUB_INFO:
+            fakes.set_cell_latency(cell_name, 0)
+        fakes.set_cell_latency(slow_cell, 10)
+
+        bcast_message = messaging._BroadcastMessage(self.msg_runner,
+                                                    self.ctxt,
+                                                    'our_fake_method',
+                                                    {}, 'down',
+                                                    run_locally=True,
+                                                    need_response=True)
+        started = time.time()
+        responses = bcast_message.process()
+        self.assertTrue(time.time() - started < 2)
+        return dict((response.cell_name, response)
+                    for response in responses)
+
+    def test_broadcast_routing_with_response_partial(self):
+        responses = self._process_with_latency('grandchild-cell2')
+        self.assertEqual(8, len(responses))
+        slow_path = 'api-cell!child-cell3!grandchild-cell2'
+        self.assertTrue(responses[slow_path].failure)
+        self.assertRaises(exception.CellTimeout,
+                          responses.pop(slow_path).value_or_raise)
+        for cell_name, response in responses.items():
+            self.assertEqual('response-%s' % cell_name,
+                             response.value_or_raise())
+
+    def test_broadcast_routing_with_response_slow_child(self):
+        responses = self._process_with_latency('child-cell3')
+        # Nothing is heard from the grandchildren of child-cell3
+        self.assertEqual(6, len(responses))
+        self.assertRaises(exception.CellTimeout,
+                          responses.pop('api-cell!child-cell3').value_or_raise)
+        for cell_name, response in responses.items():
+            self.assertEqual('response-%s' % cell_name,
+                             response.value_or_raise())
+
+    def test_broadcast_response_timeout_shrinks_per_hop(self):
+        self.flags(broadcast_call_timeout=10, group='cells')
+        timeouts = {}
+
+        def our_fake_method(message, **kwargs):
+            timeouts[message.routing_path] = message.response_timeout
+
+        fakes.stub_bcast_methods(self, 'our_fake_method', our_fake_method)
+        bcast_message = messaging._BroadcastMessage(self.msg_runner,
+                                                    self.ctxt,
+                                                    'our_fake_method',
+                                                    {}, 'down',
+                                                    run_locally=True,
+                                                    need_response=True)
+        bcast_message.process()
+        # Each hop has already handed a smaller share of its own time
+        # to the next hops when processing the message locally
+        self.assertAlmostEqual(8, timeouts['api-cell'])
+        self.assertAlmostEqual(6.4, timeouts['api-cell!child-cell1'])
+        grandchild_path = 'api-cell!child-cell2!grandchild-cell1'
+        self.assertAlmostEqual(5.12, timeouts[grandchild_path])
+
     def test_broadcast_routing_with_all_erroring(self):
         method = 'our_fake_method'
         method_kwargs = dict(arg1=1, arg2=2)
@@ -1090,6 +1160,60 @@ class CellsBroadcastMethodsTestCase(test.TestCase):
 
         self.src_msg_runner.instance_update_at_top(self.ctxt, fake_instance)
 
+    def test_instances_update_at_top(self):
+        fake_instances = [{'id': 1,
+                           'uuid': 'fake_uuid1',
+                           'name': 'fake',
+                           'info_cache': {'id': 1, 'other': 'moo'},
+                           'system_metadata': [{'key': 'key1',
+                                                'value': 'value1'}],
+                           'vm_state': vm_states.BUILDING},
+                          {'id': 2,
+                           'uuid': 'fake_uuid2',
+                           'metadata': 'fake'}]
+        expected_cell_name = 'api-cell!child-cell2!grandchild-cell1'
+        expected_updates = [
+                ('fake_uuid1',
+                 {'uuid': 'fake_uuid1',
+                  'cell_name': expected_cell_name,
+                  'system_metadata': {'key1': 'value1'},
+                  'vm_state': vm_states.BUILDING,
+                  'expected_vm_state': [vm_states.BUILDING, None]},
+                 {'other': 'moo'}),
+                ('fake_uuid2',
+                 {'uuid': 'fake_uuid2',
+                  'cell_name': expected_cell_name},
+                 None)]
+
+        # To show these should not be called in src/mid-level cell
+        self.mox.StubOutWithMock(self.src_db_inst, 'instance_bulk_update')
+        self.mox.StubOutWithMock(self.mid_db_inst, 'instance_bulk_update')
+
+        self.mox.StubOutWithMock(self.tgt_db_inst, 'instance_bulk_update')
+        self.tgt_db_inst.instance_bulk_update(
+                self.ctxt, expected_updates).AndReturn(['fake_uuid1'])
+        self.mox.ReplayAll()
+
+        self.src_msg_runner.instances_update_at_top(self.ctxt,
+                                                    fake_instances)
+
+    def test_instances_update_at_top_batches(self):
+        self.flags(instance_update_batch_size=2, group='cells')
+        batches = []
+
+        def fake_bulk_update(context, updates):
+            batches.append([update[0] for update in updates])
+            return []
+
+        self.stubs.Set(self.tgt_db_inst, 'instance_bulk_update',
+                       fake_bulk_update)
+        fake_instances = [{'uuid': 'fake_uuid%d' % i} for i in range(5)]
+        self.src_msg_runner.instances_update_at_top(self.ctxt,
+                                                    fake_instances)
+        self.assertEqual([['fake_uuid0', 'fake_uuid1'],
+                          ['fake_uuid2', 'fake_uuid3'],
+                          ['fake_uuid4']], batches)
+
     def test_instance_destroy_at_top(self):
         fake_instance = {'uuid': 'fake_uuid'}
 
@@ -1195,7 +1319,7 @@ class CellsBroadcastMethodsTestCase(test.TestCase):
         fake_instances = [instance1, instance2]
 
         self.mox.StubOutWithMock(self.tgt_msg_runner,
-                                 'instance_update_at_top')
+                                 'instances_update_at_top')
         self.mox.StubOutWithMock(self.tgt_msg_runner,
                                  'instance_destroy_at_top')
 
@@ -1217,8 +1341,8 @@ class CellsBroadcastMethodsTestCase(test.TestCase):
                 updated_since=updated_since_parsed,
                 project_id=project_id,
                 deleted=deleted).AndReturn(fake_instances)
-        self.tgt_msg_runner.instance_update_at_top(self.ctxt, instance1)
         self.tgt_msg_runner.instance_destroy_at_top(self.ctxt, instance2)
+        self.tgt_msg_runner.instances_update_at_top(self.ctxt, [instance1])
 
         self.mox.ReplayAll()
 
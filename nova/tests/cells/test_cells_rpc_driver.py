@@ -16,6 +16,7 @@
 Tests For Cells RPC Communication Driver
 """
 
+import eventlet
 from oslo.config import cfg
 
 from nova.cells import messaging
@@ -217,3 +218,140 @@ class CellsRPCDriverTestCase(test.TestCase):
         dispatcher.process_message(self.ctxt, message.to_json())
         self.assertEqual(message.to_json(), call_info['json_message'])
         self.assertTrue(call_info['process_called'])
+
+    def test_process_compressed_message(self):
+        msg_runner = fakes.get_message_runner('api-cell')
+        dispatcher = rpc_driver.InterCellRPCDispatcher(msg_runner)
+        message = messaging._BroadcastMessage(msg_runner,
+                self.ctxt, 'fake', 'fake', 'down', fanout=True)
+
+        call_info = {}
+
+        def _fake_process_message(_ctxt, json_message):
+            call_info['json_message'] = json_message
+
+        self.stubs.Set(dispatcher, 'process_message', _fake_process_message)
+
+        dispatcher.process_compressed_message(self.ctxt,
+                rpc_driver.compress_message(message.to_json()))
+        self.assertEqual(message.to_json(), call_info['json_message'])
+
+    def test_send_message_to_cell_compressed(self):
+        self.flags(rpc_driver_compress_threshold=10, group='cells')
+        msg_runner = fakes.get_message_runner('api-cell')
+        cell_state = fakes.get_cell_state('api-cell', 'child-cell2')
+        message = messaging._TargetedMessage(msg_runner,
+                self.ctxt, 'fake', 'fake', 'down', cell_state, fanout=False)
+
+        call_info = {}
+
+        def _fake_cast_to_server(ctxt, server_params, rpc_message, **kwargs):
+            call_info['rpc_message'] = rpc_message
+            call_info['cast_kwargs'] = kwargs
+
+        self.stubs.Set(self.driver.intercell_rpcapi, 'cast_to_server',
+                       _fake_cast_to_server)
+
+        self.driver.send_message_to_cell(cell_state, message)
+        rpc_message = call_info['rpc_message']
+        self.assertEqual('process_compressed_message', rpc_message['method'])
+        self.assertEqual(message.to_json(), rpc_driver.decompress_message(
+                rpc_message['args']['message']))
+        self.assertEqual({'topic': 'cells.intercell.targeted',
+                          'version': '1.1'}, call_info['cast_kwargs'])
+        self.assertEqual(1, self.driver.get_stats()['compressed'])
+
+
+class CellsRPCDriverCoalesceTestCase(test.TestCase):
+    """Test case for coalescing instance updates to parent cells."""
+
+    def setUp(self):
+        super(CellsRPCDriverCoalesceTestCase, self).setUp()
+        fakes.init(self)
+        self.flags(rpc_driver_coalesce_interval=60, group='cells')
+        self.ctxt = context.RequestContext('fake', 'fake')
+        self.driver = rpc_driver.CellsRPCDriver()
+        self.addCleanup(self.driver.flush)
+        self.msg_runner = fakes.get_message_runner('child-cell2')
+        self.cell_state = fakes.get_cell_state('child-cell2', 'api-cell')
+        self.sent = []
+
+        def _fake_send_message_to_cell(cell_state, message):
+            self.assertEqual(self.cell_state, cell_state)
+            self.sent.append((message.method_name,
+                              message.method_kwargs,
+                              message.routing_path))
+
+        self.stubs.Set(self.driver.intercell_rpcapi, 'send_message_to_cell',
+                       _fake_send_message_to_cell)
+
+    def _send_update(self, instance, routing_path=None):
+        message = messaging._BroadcastMessage(self.msg_runner, self.ctxt,
+                'instance_update_at_top', dict(instance=instance), 'up',
+                run_locally=False, routing_path=routing_path)
+        self.driver.send_message_to_cell(self.cell_state, message)
+
+    def test_updates_coalesced(self):
+        self._send_update({'uuid': 'uuid1', 'vm_state': 'active',
+                           'task_state': 'rebooting'})
+        self._send_update({'uuid': 'uuid2', 'vm_state': 'active'})
+        self._send_update({'uuid': 'uuid1', 'task_state': None})
+        self.assertEqual([], self.sent)
+        stats = self.driver.get_stats()
+        self.assertEqual(2, stats['queue_depth'])
+        self.assertEqual(3, stats['updates_queued'])
+        self.assertEqual(1, stats['updates_coalesced'])
+        self.assertAlmostEqual(1 / 3.0, stats['coalescing_ratio'])
+
+        self.driver.flush()
+        self.assertEqual(1, len(self.sent))
+        method_name, method_kwargs, routing_path = self.sent[0]
+        self.assertEqual('instances_update_at_top', method_name)
+        self.assertEqual('child-cell2', routing_path)
+        instances = sorted(method_kwargs['instances'],
+                           key=lambda x: x['uuid'])
+        self.assertEqual([{'uuid': 'uuid1', 'vm_state': 'active',
+                           'task_state': None},
+                          {'uuid': 'uuid2', 'vm_state': 'active'}],
+                         instances)
+        stats = self.driver.get_stats()
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertEqual(2, stats['updates_sent'])
+        self.assertEqual(1, stats['messages_sent'])
+
+    def test_flush_batches_per_routing_path(self):
+        self.flags(instance_update_batch_size=2, group='cells')
+        for i in xrange(3):
+            self._send_update({'uuid': 'uuid%d' % i})
+        self._send_update({'uuid': 'uuid0'},
+                          routing_path='grandchild-cell1')
+        self.driver.flush()
+        sizes = sorted((routing_path, len(method_kwargs['instances']))
+                       for _name, method_kwargs, routing_path in self.sent)
+        self.assertEqual([('child-cell2', 1), ('child-cell2', 2),
+                          ('grandchild-cell1!child-cell2', 1)], sizes)
+
+    def test_other_message_sends_queue_first(self):
+        self._send_update({'uuid': 'uuid1'})
+        message = messaging._BroadcastMessage(self.msg_runner, self.ctxt,
+                'instance_destroy_at_top', dict(instance={'uuid': 'uuid1'}),
+                'up', run_locally=False)
+        self.driver.send_message_to_cell(self.cell_state, message)
+        self.assertEqual(['instances_update_at_top',
+                          'instance_destroy_at_top'],
+                         [method_name for method_name, _kw, _path
+                          in self.sent])
+
+    def test_coalescing_disabled(self):
+        self.flags(rpc_driver_coalesce_interval=0, group='cells')
+        self._send_update({'uuid': 'uuid1'})
+        self.assertEqual([('instance_update_at_top',
+                           {'instance': {'uuid': 'uuid1'}}, 'child-cell2')],
+                         self.sent)
+
+    def test_queue_sent_after_interval(self):
+        self.flags(rpc_driver_coalesce_interval=0.01, group='cells')
+        self._send_update({'uuid': 'uuid1'})
+        self.assertEqual([], self.sent)
+        eventlet.sleep(0.1)
+        self.assertEqual(1, len(self.sent))
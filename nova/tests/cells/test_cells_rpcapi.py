@@ -238,6 +238,16 @@ class CellsAPITestCase(test.TestCase):
                            version='1.2')
         self.assertEqual(result, 'fake_response')
 
+    def test_service_get_all_partial(self):
+        call_info = self._stub_rpc_method('call', 'fake_response')
+        result = self.cells_rpcapi.service_get_all(self.fake_context,
+                filters=None, partial=True)
+
+        expected_args = {'filters': None, 'partial': True}
+        self._check_result(call_info, 'service_get_all', expected_args,
+                           version='1.8')
+        self.assertEqual(result, 'fake_response')
+
     def test_service_get_by_compute_host(self):
         call_info = self._stub_rpc_method('call', 'fake_response')
         result = self.cells_rpcapi.service_get_by_compute_host(
@@ -312,6 +322,15 @@ class CellsAPITestCase(test.TestCase):
                            expected_args, version='1.4')
         self.assertEqual(result, 'fake_response')
 
+    def test_compute_node_stats_partial(self):
+        call_info = self._stub_rpc_method('call', 'fake_response')
+        result = self.cells_rpcapi.compute_node_stats(self.fake_context,
+                                                      partial=True)
+        expected_args = {'partial': True}
+        self._check_result(call_info, 'compute_node_stats',
+                           expected_args, version='1.8')
+        self.assertEqual(result, 'fake_response')
+
     def test_compute_node_get(self):
         call_info = self._stub_rpc_method('call', 'fake_response')
         result = self.cells_rpcapi.compute_node_get(self.fake_context,
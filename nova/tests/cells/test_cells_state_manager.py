@@ -34,7 +34,7 @@ FAKE_ITYPES = [
 ]
 
 
-def _fake_compute_node_get_all(context):
+def _fake_compute_node_get_all(context, computes=FAKE_COMPUTES):
     def _node(host, total_mem, total_disk, free_mem, free_disk):
         service = {'host': host, 'disabled': False}
         return {'service': service,
@@ -43,16 +43,16 @@ def _fake_compute_node_get_all(context):
                 'free_ram_mb': free_mem,
                 'free_disk_gb': free_disk}
 
-    return [_node(*fake) for fake in FAKE_COMPUTES]
+    return [_node(*fake) for fake in computes]
 
 
-def _fake_instance_type_all(context):
+def _fake_instance_type_all(context, itypes=FAKE_ITYPES):
     def _type(mem, root, eph):
         return {'root_gb': root,
                 'ephemeral_gb': eph,
                 'memory_mb': mem}
 
-    return [_type(*fake) for fake in FAKE_ITYPES]
+    return [_type(*fake) for fake in itypes]
 
 
 class TestCellsStateManager(test.TestCase):
@@ -120,6 +120,39 @@ class TestCellsStateManager(test.TestCase):
         units = 2  # 2 on host 3
         self.assertEqual(units, cap['disk_free']['units_by_mb'][str(sz)])
 
+    def test_capacity_same_size_flavors(self):
+        self.stubs.Set(db, 'instance_type_get_all',
+                       lambda context: _fake_instance_type_all(
+                               context, FAKE_ITYPES + [(50, 20, 5)]))
+        cap = self._capacity(0.0)
+
+        # Units add up over the flavors of a size
+        units = 2 * (sum(compute[3] for compute in FAKE_COMPUTES) / 50)
+        self.assertEqual(units, cap['ram_free']['units_by_mb']['50'])
+        self.assertEqual(10, cap['disk_free']['units_by_mb'][str(25 * 1024)])
+
+    def test_capacity_update_changed_hosts(self):
+        self.flags(reserve_percent=50.0, group='cells')
+        mgr = state.CellStateManager()
+        host_units = dict(mgr._host_units)
+
+        computes = [
+            ('host2', 1024, 100, -1, -1),
+            ('host3', 1024, 100, 512, 50),
+            ('host4', 1024, 100, 300, 30),
+            ('host5', 2048, 200, 2048, 200),
+        ]
+        self.stubs.Set(db, 'compute_node_get_all',
+                       lambda context: _fake_compute_node_get_all(
+                               context, computes))
+        mgr._update_our_capacity(None)
+        computed = sorted(host for host, cached in mgr._host_units.items()
+                          if cached is not host_units.get(host))
+        # host1 went away and host4 did not change
+        self.assertEqual(['host3', 'host5'], computed)
+        self.assertEqual(self._capacity(50.0),
+                         mgr.get_my_state().capacities)
+
     def _capacity(self, reserve_percent):
         self.flags(reserve_percent=reserve_percent, group='cells')
 
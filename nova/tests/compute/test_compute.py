@@ -3816,6 +3816,77 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(len(instances), 1)
         self.assertEqual(instances[0]['task_state'], None)
 
+    def test_sync_power_states_only_rereads_out_of_sync(self):
+        running = self._create_fake_instance(
+            {'host': self.compute.host, 'power_state': power_state.RUNNING})
+        stopped = self._create_fake_instance(
+            {'host': self.compute.host, 'power_state': power_state.RUNNING})
+        vm_power_states = {running['uuid']: power_state.RUNNING,
+                           stopped['uuid']: power_state.SHUTDOWN}
+        self.stubs.Set(self.compute.driver, 'get_power_states',
+                       lambda instances: vm_power_states)
+        self.stubs.Set(self.compute.driver, 'get_num_instances', lambda: 2)
+
+        def fail_get_info(instance):
+            self.fail('get_info should not be called')
+
+        self.stubs.Set(self.compute.driver, 'get_info', fail_get_info)
+
+        reread = []
+        orig_get_all = self.compute.conductor_api.instance_get_all_by_filters
+
+        def fake_get_all_by_filters(context, filters, *args, **kwargs):
+            reread.append(filters['uuid'])
+            return orig_get_all(context, filters, *args, **kwargs)
+
+        self.stubs.Set(self.compute.conductor_api,
+                       'instance_get_all_by_filters', fake_get_all_by_filters)
+        synced = []
+
+        def fake_sync(context, db_instance, vm_power_state, current=None):
+            synced.append((db_instance['uuid'], vm_power_state,
+                           current['uuid']))
+
+        self.stubs.Set(self.compute, '_sync_instance_power_state', fake_sync)
+
+        self.compute._sync_power_states(self.context)
+        self.assertEqual([[stopped['uuid']]], reread)
+        self.assertEqual([(stopped['uuid'], power_state.SHUTDOWN,
+                           stopped['uuid'])], synced)
+
+    def test_sync_power_states_falls_back_to_get_info(self):
+        instance = self._create_fake_instance(
+            {'host': self.compute.host, 'power_state': power_state.RUNNING})
+
+        def fake_get_power_states(instances):
+            raise NotImplementedError()
+
+        def fake_get_info(db_instance):
+            raise exception.InstanceNotFound(instance_id=db_instance['uuid'])
+
+        self.stubs.Set(self.compute.driver, 'get_power_states',
+                       fake_get_power_states)
+        self.stubs.Set(self.compute.driver, 'get_info', fake_get_info)
+
+        self.compute._sync_power_states(self.context)
+        instance = db.instance_get_by_uuid(self.context, instance['uuid'])
+        self.assertEqual(power_state.NOSTATE, instance['power_state'])
+
+    def test_power_state_needs_sync(self):
+        needs_sync = compute_manager.ComputeManager._power_state_needs_sync
+        self.assertFalse(needs_sync(vm_states.ACTIVE, power_state.RUNNING,
+                                    power_state.RUNNING))
+        self.assertTrue(needs_sync(vm_states.ACTIVE, power_state.RUNNING,
+                                   power_state.SHUTDOWN))
+        self.assertTrue(needs_sync(vm_states.ACTIVE, power_state.SHUTDOWN,
+                                   power_state.SHUTDOWN))
+        self.assertFalse(needs_sync(vm_states.STOPPED, power_state.SHUTDOWN,
+                                    power_state.SHUTDOWN))
+        self.assertTrue(needs_sync(vm_states.STOPPED, power_state.RUNNING,
+                                   power_state.RUNNING))
+        self.assertFalse(needs_sync(vm_states.PAUSED, power_state.PAUSED,
+                                    power_state.PAUSED))
+
     def test_add_instance_fault(self):
         instance = self._create_fake_instance()
         exc_info = None
@@ -6829,6 +6900,22 @@ class ComputeAPITestCase(BaseTestCase):
 
         db.instance_destroy(_context, instance['uuid'])
 
+    def test_get_instances_metadata(self):
+        _context = context.get_admin_context()
+        instance1 = self._create_fake_instance({'metadata': {'key1': 'v1'}})
+        instance2 = self._create_fake_instance({'metadata': {'key2': 'v2',
+                                                             'key3': 'v3'}})
+        instance3 = self._create_fake_instance()
+        self._create_fake_instance({'metadata': {'key4': 'v4'}})
+
+        metadata = self.compute_api.get_instances_metadata(
+                _context, [instance1, instance2, instance3])
+        self.assertEqual({instance1['uuid']: {'key1': 'v1'},
+                          instance2['uuid']: {'key2': 'v2', 'key3': 'v3'},
+                          instance3['uuid']: {}}, metadata)
+        self.assertEqual({},
+                         self.compute_api.get_instances_metadata(_context, []))
+
     def test_disallow_metadata_changes_during_building(self):
         def fake_change_instance_metadata(inst, ctxt, diff, instance=None,
                                           instance_uuid=None):
@@ -376,6 +376,7 @@ class BaseTrackerTestCase(BaseTestCase):
     def _fake_compute_node_update(self, ctx, compute_node_id, values,
             prune_stats=False):
         self.updated = True
+        self.updated_values = values.copy()
         values['stats'] = [{"key": "num_instances", "value": "1"}]
 
         self.compute.update(values)
@@ -459,6 +460,33 @@ class TrackerTestCase(BaseTrackerTestCase):
         self.assertFalse(self.tracker.disabled)
         self.assertEqual(0, self.tracker.compute_node['current_workload'])
 
+    def test_unchanged_compute_node_not_written(self):
+        self.updated = False
+        self.tracker.update_available_resource(self.context)
+        self.assertFalse(self.updated)
+
+    def test_only_changed_values_written(self):
+        self.tracker.driver.local_gb = 10
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual(['free_disk_gb', 'local_gb'],
+                         sorted(self.updated_values.keys()))
+
+    def test_changed_stats_written(self):
+        self._fake_instance(host=self.host, vm_state=vm_states.ACTIVE)
+        self.tracker.update_available_resource(self.context)
+        self.assertTrue('stats' in self.updated_values)
+        self.assertEqual(1, self.updated_values['stats']['num_instances'])
+
+    def test_heartbeat_written_when_unchanged(self):
+        self.flags(compute_node_heartbeat_interval=300)
+        timeutils.set_time_override(timeutils.utcnow())
+        self.addCleanup(timeutils.clear_time_override)
+        timeutils.advance_time_seconds(301)
+        self.updated = False
+        self.tracker.update_available_resource(self.context)
+        self.assertTrue(self.updated)
+        self.assertEqual({}, self.updated_values)
+
 
 class InstanceClaimTestCase(BaseTrackerTestCase):
 
@@ -911,3 +939,110 @@ class OrphanTestCase(BaseTrackerTestCase):
         orphans = self.tracker._find_orphaned_instances()
 
         self.assertEqual(2, len(orphans))
+
+
+class BulkUpdateTestCase(BaseTestCase):
+    def setUp(self):
+        super(BulkUpdateTestCase, self).setUp()
+        self.driver = self._driver()
+        self.trackers = [resource_tracker.ResourceTracker(self.host,
+                                                          self.driver, node)
+                         for node in ('node1', 'node2')]
+        self._migrations = []
+        self.compute_nodes = {}
+        self.calls = []
+
+        def fail(*args, **kwargs):
+            self.fail('per-node query should not be used')
+
+        self.stubs.Set(db, 'instance_get_all_by_host_and_node', fail)
+        self.stubs.Set(db, 'migration_get_in_progress_by_host_and_node',
+                       fail)
+        self.stubs.Set(db, 'instance_get_all_by_host',
+                       self._fake_instance_get_all_by_host)
+        self.stubs.Set(db, 'migration_get_in_progress_by_host',
+                       self._fake_migration_get_in_progress_by_host)
+        self.stubs.Set(db, 'service_get_by_compute_host',
+                       self._fake_service_get_by_compute_host)
+        self.stubs.Set(db, 'compute_node_update',
+                       self._fake_compute_node_update)
+
+    def _fake_instance_get_all_by_host(self, context, host,
+                                       columns_to_join=None):
+        self.calls.append('instance_get_all_by_host')
+        return [i for i in self._instances.values() if i['host'] == host]
+
+    def _fake_migration_get_in_progress_by_host(self, context, host):
+        self.calls.append('migration_get_in_progress_by_host')
+        for migration in self._migrations:
+            migration['instance'] = self._instances[
+                migration['instance_uuid']]
+        return self._migrations
+
+    def _fake_service_get_by_compute_host(self, context, host):
+        self.calls.append('service_get_by_compute_host')
+        for i, node in enumerate(('node1', 'node2')):
+            self.compute_nodes[node] = self._create_compute_node(
+                {'id': i + 1, 'hypervisor_hostname': node})
+        service = self._create_service(host)
+        service['compute_node'] = self.compute_nodes.values()
+        return service
+
+    def _fake_compute_node_update(self, context, compute_node_id, values,
+                                  prune_stats=False):
+        self.calls.append('compute_node_update')
+        for compute_node in self.compute_nodes.values():
+            if compute_node['id'] == compute_node_id:
+                compute_node.update(values)
+                return compute_node
+
+    def _update(self):
+        resource_tracker.update_available_resources(
+            self.context, self.host, self.driver, self.trackers)
+
+    def test_usage_grouped_by_node(self):
+        self._fake_instance(host=self.host, node='node1',
+                            vm_state=vm_states.ACTIVE)
+        resizing = self._fake_instance(host='otherhost', node='othernode')
+        self._migrations.append({'id': 1,
+                                 'status': 'migrating',
+                                 'instance_uuid': resizing['uuid'],
+                                 'source_compute': 'otherhost',
+                                 'source_node': 'othernode',
+                                 'dest_compute': self.host,
+                                 'dest_node': 'node2',
+                                 'old_instance_type_id': 1,
+                                 'new_instance_type_id': 1,
+                                 'updated_at': timeutils.utcnow()})
+        self._update()
+
+        node1, node2 = self.trackers
+        self.assertEqual(2, node1.compute_node['memory_mb_used'])
+        self.assertEqual(FAKE_VIRT_MEMORY_MB,
+                         node2.compute_node['memory_mb_used'])
+
+    def test_queries_once_per_host(self):
+        self._update()
+        self.calls = []
+        self._update()
+        # Nothing changed, so the compute nodes are not written either
+        self.assertEqual(['instance_get_all_by_host',
+                          'migration_get_in_progress_by_host'], self.calls)
+
+    def test_only_changed_nodes_written(self):
+        self._update()
+        self._fake_instance(host=self.host, node='node2',
+                            vm_state=vm_states.ACTIVE)
+        self.calls = []
+        self._update()
+        self.assertEqual(['instance_get_all_by_host',
+                          'migration_get_in_progress_by_host',
+                          'compute_node_update'], self.calls)
+        self.assertEqual(2, self.trackers[1].compute_node['memory_mb_used'])
+
+    def test_unsupported_node_disabled(self):
+        self.stubs.Set(self.driver, 'get_available_resources',
+                       lambda nodenames: {'node1': {}})
+        self._update()
+        self.assertTrue(self.trackers[0].disabled)
+        self.assertTrue(self.trackers[1].disabled)
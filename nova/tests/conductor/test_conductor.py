@@ -146,6 +146,15 @@ class _BaseTestCase(object):
             self.context, 'fake-host', 'fake-node')
         self.assertEqual(result, 'fake-result')
 
+    def test_migration_get_in_progress_by_host(self):
+        self.mox.StubOutWithMock(db, 'migration_get_in_progress_by_host')
+        db.migration_get_in_progress_by_host(
+            self.context, 'fake-host').AndReturn('fake-result')
+        self.mox.ReplayAll()
+        result = self.conductor.migration_get_in_progress_by_host(
+            self.context, 'fake-host')
+        self.assertEqual(result, 'fake-result')
+
     def test_migration_create(self):
         inst = {'uuid': 'fake-uuid',
                 'host': 'fake-host',
@@ -401,6 +410,20 @@ class _BaseTestCase(object):
                                                     'fake-values', False)
         self.assertEqual(result, 'fake-result')
 
+    def test_compute_node_update_bulk(self):
+        node1 = {'id': 'fake-id1'}
+        node2 = {'id': 'fake-id2'}
+        self.mox.StubOutWithMock(db, 'compute_node_update')
+        db.compute_node_update(self.context, node1['id'], 'fake-values1',
+                               True).AndReturn('fake-result1')
+        db.compute_node_update(self.context, node2['id'], 'fake-values2',
+                               True).AndReturn('fake-result2')
+        self.mox.ReplayAll()
+        result = self.conductor.compute_node_update_bulk(
+            self.context, [(node1, 'fake-values1'), (node2, 'fake-values2')],
+            True)
+        self.assertEqual(result, ['fake-result1', 'fake-result2'])
+
     def test_compute_node_delete(self):
         node = {'id': 'fake-id'}
         self.mox.StubOutWithMock(db, 'compute_node_delete')
@@ -15,12 +15,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
 import binascii
 import eventlet
-import mox
 import os
-import tempfile
+import StringIO
+import tarfile
 
+from Crypto.Cipher import AES
 import fixtures
 
 from nova.api.ec2 import ec2utils
@@ -198,50 +200,149 @@ class TestS3ImageService(test.TestCase):
              'no_device': True}]
         self.assertEqual(block_device_mapping, expected_bdm)
 
-    def test_s3_create_is_public(self):
+    def _make_bundle(self, data, key, iv, part_size=1000):
+        tarball = StringIO.StringIO()
+        tar_file = tarfile.open(fileobj=tarball, mode='w:gz')
+        info = tarfile.TarInfo('my.img')
+        info.size = len(data)
+        tar_file.addfile(info, StringIO.StringIO(data))
+        tar_file.close()
+        tarball = tarball.getvalue()
+        padding = AES.block_size - len(tarball) % AES.block_size
+        tarball += chr(padding) * padding
+        encrypted = AES.new(key, AES.MODE_CBC, iv).encrypt(tarball)
+        return [encrypted[i:i + part_size]
+                for i in xrange(0, len(encrypted), part_size)]
+
+    def _stub_bundle(self, parts):
+        key = '0123456789abcdef'
+        iv = 'fedcba9876543210'
+        if not isinstance(parts, list):
+            parts = self._make_bundle(parts, key, iv)
+        filenames = ''.join('<part index="%d"><filename>part.%d</filename>'
+                            '</part>' % (i, i) for i in range(len(parts)))
+        manifest = ('<manifest><image>'
+                    '<ec2_encrypted_key>aa</ec2_encrypted_key>'
+                    '<ec2_encrypted_iv>bb</ec2_encrypted_iv>'
+                    '<parts count="%d">%s</parts>'
+                    '</image></manifest>' % (len(parts), filenames))
+        contents = {'my.img.manifest.xml': manifest}
+        for i, part in enumerate(parts):
+            contents['part.%d' % i] = part
+        self.downloads = []
+
+        class FakeKey(object):
+            def __init__(key_self, name):
+                key_self.name = name
+
+            def get_contents_as_string(key_self):
+                self.downloads.append(key_self.name)
+                return contents[key_self.name]
+
+        class FakeBucket(object):
+            def get_key(bucket_self, name):
+                return FakeKey(name)
+
+        class FakeConnection(object):
+            def get_bucket(conn_self, name):
+                return FakeBucket()
+
+        def fake_decrypt_text(context, project_id, text):
+            if base64.b64decode(text) == '\xaa':
+                return binascii.b2a_hex(key)
+            return binascii.b2a_hex(iv)
+
+        self.stubs.Set(self.image_service, '_conn',
+                       lambda context: FakeConnection())
+        self.stubs.Set(self.image_service.cert_rpcapi, 'decrypt_text',
+                       fake_decrypt_text)
+        self.stubs.Set(eventlet, 'spawn_n', lambda func: func())
+
+        self.uploaded = None
+        real_update = self.image_service.service.update
+
+        def fake_update(context, image_id, metadata, data=None,
+                        purge_props=True):
+            if data is not None:
+                self.uploaded = data.read()
+            return real_update(context, image_id, metadata,
+                               purge_props=purge_props)
+
+        self.stubs.Set(self.image_service.service, 'update', fake_update)
+
+    def _create_image(self):
         metadata = {'properties': {
                     'image_location': 'mybucket/my.img.manifest.xml'},
                     'name': 'mybucket/my.img'}
-        handle, tempf = tempfile.mkstemp(dir='/tmp')
-
-        ignore = mox.IgnoreArg()
-        mockobj = self.mox.CreateMockAnything()
-        self.stubs.Set(self.image_service, '_conn', mockobj)
-        mockobj(ignore).AndReturn(mockobj)
-        self.stubs.Set(mockobj, 'get_bucket', mockobj)
-        mockobj(ignore).AndReturn(mockobj)
-        self.stubs.Set(mockobj, 'get_key', mockobj)
-        mockobj(ignore).AndReturn(mockobj)
-        self.stubs.Set(mockobj, 'get_contents_as_string', mockobj)
-        mockobj().AndReturn(file_manifest_xml)
-        self.stubs.Set(self.image_service, '_download_file', mockobj)
-        mockobj(ignore, ignore, ignore).AndReturn(tempf)
-        self.stubs.Set(binascii, 'a2b_hex', mockobj)
-        mockobj(ignore).AndReturn('foo')
-        mockobj(ignore).AndReturn('foo')
-        self.stubs.Set(self.image_service, '_decrypt_image', mockobj)
-        mockobj(ignore, ignore, ignore, ignore, ignore).AndReturn(mockobj)
-        self.stubs.Set(self.image_service, '_untarzip_image', mockobj)
-        mockobj(ignore, ignore).AndReturn(tempf)
-        self.mox.ReplayAll()
-
         img = self.image_service._s3_create(self.context, metadata)
-        eventlet.sleep()
         translated = self.image_service._translate_id_to_uuid(self.context,
                                                               img)
-        uuid = translated['id']
-        image_service = fake.FakeImageService()
-        updated_image = image_service.update(self.context, uuid,
-                        {'is_public': True}, purge_props=False)
+        return translated['id']
+
+    def test_s3_create_is_public(self):
+        data = os.urandom(10000)
+        self._stub_bundle(data)
+        uuid = self._create_image()
+
+        self.assertEqual(data, self.uploaded)
+        self.assertEqual(['my.img.manifest.xml'] +
+                         ['part.%d' % i for i in range(11)],
+                         self.downloads)
+        updated_image = fake.FakeImageService().update(
+                self.context, uuid, {'is_public': True},
+                purge_props=False)
         self.assertTrue(updated_image['is_public'])
         self.assertEqual(updated_image['status'], 'active')
         self.assertEqual(updated_image['properties']['image_state'],
                           'available')
 
+    def test_s3_create_failed_decrypt(self):
+        self._stub_bundle(['x' * 1000])
+        image = fake.FakeImageService().show(self.context,
+                                             self._create_image())
+        self.assertEqual('failed_decrypt',
+                         image['properties']['image_state'])
+
+    def test_s3_create_failed_untar(self):
+        key = '0123456789abcdef'
+        iv = 'fedcba9876543210'
+        encrypted = AES.new(key, AES.MODE_CBC, iv).encrypt(
+                'not a tarball' + '\x03' * 3)
+        self._stub_bundle([encrypted])
+        image = fake.FakeImageService().show(self.context,
+                                             self._create_image())
+        self.assertEqual('failed_untar', image['properties']['image_state'])
+
+    def test_download_parts_in_order(self):
+        self.flags(s3_download_concurrency=2)
+        self._stub_bundle(['a', 'b', 'c', 'd', 'e'])
+        bucket = self.image_service._conn(self.context).get_bucket('bucket')
+        parts = self.image_service._download_parts(
+                bucket, ['part.%d' % i for i in range(5)])
+        self.assertEqual('a', next(parts))
+        # No more parts are held than are downloaded at the same time
+        self.assertEqual(['part.0', 'part.1'], self.downloads)
+        self.assertEqual(['b', 'c', 'd', 'e'], list(parts))
+
+    def test_decrypt_parts(self):
+        key = '0123456789abcdef'
+        iv = 'fedcba9876543210'
+        for size in (0, 1, 15, 16, 17, 100):
+            data = os.urandom(size)
+            padding = AES.block_size - size % AES.block_size
+            encrypted = AES.new(key, AES.MODE_CBC, iv).encrypt(
+                    data + chr(padding) * padding)
+            parts = [encrypted[:7], encrypted[7:30], encrypted[30:]]
+            self.assertEqual(data, ''.join(
+                    self.image_service._decrypt_parts(parts, key, iv)))
+
+        encrypted = AES.new(key, AES.MODE_CBC, iv).encrypt('\x00' * 16)
+        self.assertRaises(exception.NovaException, list,
+                          self.image_service._decrypt_parts([encrypted],
+                                                            key, iv))
+
     def test_s3_malicious_tarballs(self):
-        self.assertRaises(exception.NovaException,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'abs.tar.gz'))
-        self.assertRaises(exception.NovaException,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'rel.tar.gz'))
+        for name in ('abs.tar.gz', 'rel.tar.gz'):
+            with open(os.path.join(os.path.dirname(__file__), name)) as f:
+                self.assertRaises(exception.NovaException, list,
+                                  self.image_service._untarzip_image(f))
@@ -39,6 +39,7 @@ from nova.api.ec2 import apirequest
 from nova.api.ec2 import ec2utils
 from nova import block_device
 from nova import context
+from nova import db
 from nova import exception
 from nova.openstack.common import timeutils
 from nova import test
@@ -128,6 +129,66 @@ class XmlConversionTestCase(test.TestCase):
 
 
 class Ec2utilsTestCase(test.TestCase):
+    def setUp(self):
+        super(Ec2utilsTestCase, self).setUp()
+        ec2utils.reset_cache()
+        self.addCleanup(ec2utils.reset_cache)
+
+    def test_id_cache_bounded(self):
+        self.flags(ec2_id_cache_size=2)
+        cache = ec2utils._get_cache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        # b is the least recently used now
+        cache.set('c', 3)
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual({'entries': 2, 'size': 2, 'hits': 3, 'misses': 1,
+                          'hit_rate': 0.75}, ec2utils.get_cache_stats())
+
+    def test_ids_to_ec2_vol_ids(self):
+        ctxt = context.get_admin_context()
+        existing = db.ec2_volume_create(ctxt, 'd5e7f7b5-0a2b-4c3f-9e2a-'
+                                              '000000000001')['id']
+        uuids = ['d5e7f7b5-0a2b-4c3f-9e2a-00000000000%d' % i
+                 for i in range(1, 4)]
+        created = []
+        real_bulk_create = db.ec2_volume_bulk_create
+
+        def fake_bulk_create(context, volume_ids):
+            created.append(sorted(volume_ids))
+            return real_bulk_create(context, volume_ids)
+
+        self.stubs.Set(db, 'ec2_volume_bulk_create', fake_bulk_create)
+        ec2_ids = ec2utils.ids_to_ec2_vol_ids(uuids + [27])
+        self.assertEqual([uuids[1:]], created)
+        self.assertEqual('vol-%08x' % existing, ec2_ids[uuids[0]])
+        self.assertEqual('vol-0000001b', ec2_ids[27])
+        self.assertEqual(3, len(set(ec2_ids[uuid] for uuid in uuids)))
+
+        # Now all cached, and the same as when mapped one by one
+        def fail(*args, **kwargs):
+            self.fail('Mapping not cached')
+
+        self.stubs.Set(db, 'get_ec2_volume_ids_by_uuids', fail)
+        self.stubs.Set(db, 'get_ec2_volume_id_by_uuid', fail)
+        self.assertEqual(ec2_ids, ec2utils.ids_to_ec2_vol_ids(uuids + [27]))
+        for uuid in uuids:
+            self.assertEqual(ec2_ids[uuid], ec2utils.id_to_ec2_vol_id(uuid))
+
+    def test_glance_ids_to_ids(self):
+        ctxt = context.get_admin_context()
+        existing = db.s3_image_create(ctxt, 'image1')['id']
+        ids = ec2utils.glance_ids_to_ids(ctxt, ['image1', 'image2', None])
+        self.assertEqual(existing, ids['image1'])
+        self.assertEqual(None, ids[None])
+        self.assertEqual('image2',
+                         ec2utils.id_to_glance_id(ctxt, ids['image2']))
+        self.assertEqual(ids['image2'],
+                         ec2utils.glance_id_to_id(ctxt, 'image2'))
+
     def test_ec2_id_to_id(self):
         self.assertEqual(ec2utils.ec2_id_to_id('i-0000001e'), 30)
         self.assertEqual(ec2utils.ec2_id_to_id('ami-1d'), 29)
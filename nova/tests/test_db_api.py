@@ -538,6 +538,45 @@ class DbApiTestCase(DbTestCase):
         self.assertEquals("building", old_ref["vm_state"])
         self.assertEquals("needscoffee", new_ref["vm_state"])
 
+    def test_instance_bulk_update(self):
+        ctxt = context.get_admin_context()
+        instance1 = db.instance_create(ctxt, {'vm_state': 'active'})
+        instance2 = db.instance_create(ctxt, {'vm_state': 'building'})
+        instance3 = db.instance_create(ctxt, {'vm_state': 'active'})
+        db.instance_info_cache_delete(ctxt, instance3['uuid'])
+        new_uuid = str(stdlib_uuid.uuid4())
+
+        updates = [
+            (instance1['uuid'],
+             {'vm_state': 'building', 'expected_vm_state': ['building', None]},
+             None),
+            (instance2['uuid'],
+             {'vm_state': 'active', 'system_metadata': {'key': 'value'}},
+             {'network_info': '[1]'}),
+            (instance3['uuid'], {'host': 'host3'}, {'network_info': '[3]'}),
+            (new_uuid, {'uuid': new_uuid, 'host': 'new_host'},
+             {'network_info': '[4]'})]
+        skipped = db.instance_bulk_update(ctxt, updates)
+
+        # Out of order update to building is refused
+        self.assertEqual([instance1['uuid']], skipped)
+        self.assertEqual('active',
+                db.instance_get_by_uuid(ctxt, instance1['uuid'])['vm_state'])
+        instance2 = db.instance_get_by_uuid(ctxt, instance2['uuid'])
+        self.assertEqual('active', instance2['vm_state'])
+        self.assertEqual({'key': 'value'},
+                         utils.metadata_to_dict(instance2['system_metadata']))
+        self.assertEqual('[1]', instance2['info_cache']['network_info'])
+        # The deleted info cache is left alone
+        self.assertEqual('host3',
+                db.instance_get_by_uuid(ctxt, instance3['uuid'])['host'])
+        self.assertEqual(None,
+                db.instance_info_cache_get(ctxt, instance3['uuid']))
+        # Missing instances are created
+        new_instance = db.instance_get_by_uuid(ctxt, new_uuid)
+        self.assertEqual('new_host', new_instance['host'])
+        self.assertEqual('[4]', new_instance['info_cache']['network_info'])
+
     def _test_instance_update_updates_metadata(self, metadata_type):
         ctxt = context.get_admin_context()
 
@@ -1111,6 +1150,48 @@ class DbApiTestCase(DbTestCase):
         ec2_id = db.get_ec2_snapshot_id_by_uuid(self.context, 'fake-uuid')
         self.assertEqual(ref['id'], ec2_id)
 
+    def test_get_ec2_instance_ids_by_uuids(self):
+        ref1 = db.ec2_instance_create(self.context, 'fake-uuid1')
+        ref2 = db.ec2_instance_create(self.context, 'fake-uuid2')
+        db.ec2_instance_create(self.context, 'fake-uuid3')
+        ec2_ids = db.get_ec2_instance_ids_by_uuids(
+                self.context, ['fake-uuid1', 'fake-uuid2', 'fake-uuid4'])
+        self.assertEqual({'fake-uuid1': ref1['id'],
+                          'fake-uuid2': ref2['id']}, ec2_ids)
+        self.assertEqual({}, db.get_ec2_instance_ids_by_uuids(self.context,
+                                                              []))
+
+    def test_s3_image_get_all_by_uuids(self):
+        ref1 = db.s3_image_create(self.context, 'fake-uuid1')
+        ref2 = db.s3_image_create(self.context, 'fake-uuid2')
+        db.s3_image_create(self.context, 'fake-uuid3')
+        s3_images = db.s3_image_get_all_by_uuids(
+                self.context, ['fake-uuid1', 'fake-uuid2', 'fake-uuid4'])
+        self.assertEqual([(ref1['id'], 'fake-uuid1'),
+                          (ref2['id'], 'fake-uuid2')],
+                         sorted((s3_image['id'], s3_image['uuid'])
+                                for s3_image in s3_images))
+        self.assertEqual([], db.s3_image_get_all_by_uuids(self.context, []))
+
+    def test_uuid_mapping_bulk_create(self):
+        for bulk_create, get_ids in (
+                (db.ec2_instance_bulk_create,
+                 db.get_ec2_instance_ids_by_uuids),
+                (db.ec2_volume_bulk_create, db.get_ec2_volume_ids_by_uuids),
+                (db.ec2_snapshot_bulk_create,
+                 db.get_ec2_snapshot_ids_by_uuids)):
+            ids = bulk_create(self.context, ['fake-uuid1', 'fake-uuid2'])
+            self.assertEqual(2, len(set(ids.values())))
+            self.assertEqual(ids, get_ids(self.context,
+                                          ['fake-uuid1', 'fake-uuid2']))
+
+    def test_s3_image_bulk_create(self):
+        ids = db.s3_image_bulk_create(self.context, ['fake-uuid1',
+                                                     'fake-uuid2'])
+        for uuid in ('fake-uuid1', 'fake-uuid2'):
+            self.assertEqual(uuid, db.s3_image_get(self.context,
+                                                   ids[uuid])['uuid'])
+
     def test_bw_usage_calls(self):
         ctxt = context.get_admin_context()
         now = timeutils.utcnow()
@@ -1408,6 +1489,14 @@ class AggregateDBApiTestCase(test.TestCase):
         self.assertEqual(r1, {'foo.openstack.org': set(['value'])})
         self.assertFalse('fake_key1' in r1)
 
+    def test_aggregate_host_get_by_metadata_key_other_keys(self):
+        ctxt = context.get_admin_context()
+        _create_aggregate_with_hosts(context=ctxt, hosts=['foo.openstack.org'],
+                metadata={'a_key': 'other', 'good': 'value',
+                          'z_key': 'other'})
+        r1 = db.aggregate_host_get_by_metadata_key(ctxt, key='good')
+        self.assertEqual(r1, {'foo.openstack.org': set(['value'])})
+
     def test_aggregate_get_by_host_not_found(self):
         ctxt = context.get_admin_context()
         _create_aggregate_with_hosts(context=ctxt)
@@ -1730,6 +1819,14 @@ class CapacityTestCase(test.TestCase):
         self.assertEqual(num_instance_stat['key'], stat['key'])
         self.assertEqual(1, int(stat['value']))
 
+    def test_compute_node_update_without_stats(self):
+        item = self._create_helper('host1')
+        db.compute_node_update(self.ctxt, item['id'], {'vcpus': 4},
+                               prune_stats=True)
+        item = db.compute_node_get_all(self.ctxt)[0]
+        self.assertEqual(4, item['vcpus'])
+        self.assertEqual(4, len(item['stats']))
+
 
 class MigrationTestCase(test.TestCase):
 
@@ -1794,6 +1891,12 @@ class MigrationTestCase(test.TestCase):
         self.assertEqual(3, len(migrations))
         self._assert_in_progress(migrations)
 
+    def test_in_progress_host2_all_nodes(self):
+        migrations = db.migration_get_in_progress_by_host(self.ctxt, 'host2')
+        # 2 as dest, 2 as source
+        self.assertEqual(4, len(migrations))
+        self._assert_in_progress(migrations)
+
     def test_instance_join(self):
         migrations = db.migration_get_in_progress_by_host_and_node(self.ctxt,
                 'host2', 'b')
@@ -2644,6 +2747,113 @@ class FixedIPTestCase(BaseInstanceTypeTestCase):
         fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
         self.assertEqual(fixed_ip['instance_uuid'], instance_uuid)
 
+    def test_fixed_ip_associate_pool_sets_network_and_host(self):
+        network = db.network_create_safe(self.ctxt, {})
+
+        address = self.create_fixed_ip()
+        result = db.fixed_ip_associate_pool(self.ctxt, network['id'],
+                                            host='fake_host')
+        self.assertEqual(result, address)
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+        self.assertEqual(fixed_ip['host'], 'fake_host')
+        self.assertEqual(fixed_ip['network_id'], network['id'])
+        self.assertEqual(fixed_ip['instance_uuid'], None)
+
+    def test_fixed_ip_associate_pool_retries_lost_claim(self):
+        instance_uuid = self._create_instance()
+        other_uuid = self._create_instance()
+        network = db.network_create_safe(self.ctxt, {})
+        taken = self.create_fixed_ip(network_id=network['id'],
+                                     address='192.168.0.1')
+        free = self.create_fixed_ip(network_id=network['id'],
+                                    address='192.168.0.2')
+
+        orig_candidates = sqlalchemy_api._fixed_ip_pool_candidates
+        calls = []
+
+        def fake_candidates(context, network_id, count, session):
+            # The first read hands out a row a concurrent request claims
+            # before we get to it.
+            calls.append(network_id)
+            if len(calls) == 1:
+                db.fixed_ip_update(self.ctxt, taken,
+                                   {'instance_uuid': other_uuid})
+                return [(db.fixed_ip_get_by_address(self.ctxt, taken)['id'],
+                         taken, network['id'])]
+            return orig_candidates(context, network_id, count, session)
+
+        self.stubs.Set(sqlalchemy_api, '_fixed_ip_pool_candidates',
+                       fake_candidates)
+        result = db.fixed_ip_associate_pool(self.ctxt, network['id'],
+                                            instance_uuid)
+        self.assertEqual(result, free)
+        self.assertEqual(len(calls), 2)
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, taken)
+        self.assertEqual(fixed_ip['instance_uuid'], other_uuid)
+
+    def test_fixed_ip_associate_pool_bulk(self):
+        instance_uuids = [self._create_instance() for i in xrange(3)]
+        network = db.network_create_safe(self.ctxt, {})
+        for i in xrange(4):
+            self.create_fixed_ip(network_id=network['id'],
+                                 address='192.168.0.%d' % i)
+
+        addresses = db.fixed_ip_associate_pool_bulk(self.ctxt, network['id'],
+                                                    instance_uuids)
+        self.assertEqual(len(set(addresses)), 3)
+        for instance_uuid, address in zip(instance_uuids, addresses):
+            fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+            self.assertEqual(fixed_ip['instance_uuid'], instance_uuid)
+
+    def test_fixed_ip_associate_pool_bulk_not_enough_ips(self):
+        instance_uuids = [self._create_instance() for i in xrange(3)]
+        network = db.network_create_safe(self.ctxt, {})
+        addresses = [self.create_fixed_ip(network_id=network['id'],
+                                          address='192.168.0.%d' % i)
+                     for i in xrange(2)]
+
+        self.assertRaises(exception.NoMoreFixedIps,
+                          db.fixed_ip_associate_pool_bulk,
+                          self.ctxt, network['id'], instance_uuids)
+        for address in addresses:
+            fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+            self.assertEqual(fixed_ip['instance_uuid'], None)
+
+    def test_fixed_ip_associate_pool_bulk_releases_shared_ips(self):
+        instance_uuids = [self._create_instance() for i in xrange(3)]
+        other_uuid = self._create_instance()
+        network = db.network_create_safe(self.ctxt, {})
+        shared = self.create_fixed_ip(address='192.168.0.1')
+        own = self.create_fixed_ip(network_id=network['id'],
+                                   address='192.168.0.2')
+        taken = self.create_fixed_ip(network_id=network['id'],
+                                     address='192.168.0.3')
+
+        orig_claim = sqlalchemy_api._fixed_ip_pool_claim
+
+        def fake_claim(context, network_id, claims, host, session):
+            # A concurrent request claims one of the addresses first, so
+            # the pool runs dry on the retry.
+            db.fixed_ip_update(self.ctxt, taken,
+                               {'instance_uuid': other_uuid})
+            return orig_claim(context, network_id, claims, host, session)
+
+        self.stubs.Set(sqlalchemy_api, '_fixed_ip_pool_claim', fake_claim)
+        self.assertRaises(exception.NoMoreFixedIps,
+                          db.fixed_ip_associate_pool_bulk,
+                          self.ctxt, network['id'], instance_uuids)
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, shared)
+        self.assertEqual(None, fixed_ip['instance_uuid'])
+        self.assertEqual(None, fixed_ip['network_id'])
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, own)
+        self.assertEqual(None, fixed_ip['instance_uuid'])
+        self.assertEqual(network['id'], fixed_ip['network_id'])
+
+    def test_fixed_ip_associate_pool_bulk_invalid_uuid(self):
+        self.assertRaises(exception.InvalidUUID,
+                          db.fixed_ip_associate_pool_bulk,
+                          self.ctxt, None, [self._create_instance(), '123'])
+
     def test_fixed_ip_create(self):
         instance_uuid = self._create_instance()
         network_id = db.network_create_safe(self.ctxt, {})['id']
@@ -3690,6 +3900,21 @@ class BlockDeviceMappingTestCase(test.TestCase):
         bmd = db.block_device_mapping_get_all_by_instance(self.ctxt, uuid2)
         self.assertEqual(len(bmd), 2)
 
+    def test_block_device_mapping_get_all_by_instance_uuids(self):
+        uuid1 = self.instance['uuid']
+        uuid2 = db.instance_create(self.ctxt, {})['uuid']
+        uuid3 = db.instance_create(self.ctxt, {})['uuid']
+        self._create_bdm({'instance_uuid': uuid1, 'device_name': 'first'})
+        self._create_bdm({'instance_uuid': uuid2, 'device_name': 'second'})
+        self._create_bdm({'instance_uuid': uuid3, 'device_name': 'third'})
+
+        bdms = db.block_device_mapping_get_all_by_instance_uuids(
+                self.ctxt, [uuid1, uuid3])
+        self.assertEqual(['first', 'third'],
+                         sorted(bdm['device_name'] for bdm in bdms))
+        self.assertEqual([], db.block_device_mapping_get_all_by_instance_uuids(
+                self.ctxt, []))
+
     def test_block_device_mapping_destroy(self):
         bdm = self._create_bdm({})
         db.block_device_mapping_destroy(self.ctxt, bdm['id'])
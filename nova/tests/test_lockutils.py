@@ -0,0 +1,157 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import shutil
+import tempfile
+
+import eventlet
+from eventlet import event
+
+from nova.openstack.common import lockutils
+from nova import test
+
+
+class LockStatsTestCase(test.TestCase):
+    def setUp(self):
+        super(LockStatsTestCase, self).setUp()
+        self.stats = lockutils._LockStats(10)
+        self.stubs.Set(lockutils, '_lock_stats', self.stats)
+
+    def _use(self, name, wait_time=0.0, hold_time=0.0):
+        entry = self.stats.waiting(name)
+        self.stats.acquired(entry, wait_time)
+        self.stats.released(entry, hold_time)
+
+    def test_acquisitions(self):
+        @lockutils.synchronized('foo', 'test-')
+        def foo():
+            pass
+
+        for i in xrange(3):
+            foo()
+
+        stats = lockutils.get_lock_stats()['foo']
+        self.assertEqual(3, stats['acquisitions'])
+        self.assertEqual(0, stats['waiters'])
+        self.assertEqual(0, stats['holders'])
+
+    def test_holders_while_held(self):
+        @lockutils.synchronized('foo', 'test-')
+        def foo():
+            return lockutils.get_lock_stats()['foo']
+
+        stats = foo()
+        self.assertEqual(1, stats['holders'])
+        self.assertEqual(0, stats['waiters'])
+        self.assertEqual(0, lockutils.get_lock_stats()['foo']['holders'])
+
+    def test_wait_and_hold_times(self):
+        self._use('foo', wait_time=2.0, hold_time=3.0)
+        self._use('foo', wait_time=1.0, hold_time=5.0)
+
+        stats = self.stats.get()['foo']
+        self.assertEqual(2, stats['acquisitions'])
+        self.assertEqual(3.0, stats['total_wait'])
+        self.assertEqual(2.0, stats['max_wait'])
+        self.assertEqual(8.0, stats['total_hold'])
+        self.assertEqual(5.0, stats['max_hold'])
+
+    def test_waiters_while_contended(self):
+        holding = event.Event()
+        release = event.Event()
+
+        @lockutils.synchronized('foo', 'test-')
+        def foo(hold):
+            if hold:
+                holding.send()
+                release.wait()
+
+        holder = eventlet.spawn(foo, True)
+        holding.wait()
+        waiter = eventlet.spawn(foo, False)
+        eventlet.sleep(0)
+
+        stats = lockutils.get_lock_stats()['foo']
+        self.assertEqual(1, stats['holders'])
+        self.assertEqual(1, stats['waiters'])
+
+        release.send()
+        holder.wait()
+        waiter.wait()
+
+        stats = lockutils.get_lock_stats()['foo']
+        self.assertEqual(2, stats['acquisitions'])
+        self.assertEqual(0, stats['holders'])
+        self.assertEqual(0, stats['waiters'])
+
+    def test_eviction_keeps_busy_names(self):
+        held = self.stats.waiting('held')
+        self.stats.acquired(held, 0.0)
+        self.stats.waiting('waited')
+        for i in xrange(20):
+            self._use('idle%d' % i)
+
+        names = self.stats.get()
+        self.assertTrue(len(names) <= 10)
+        self.assertTrue('held' in names)
+        self.assertTrue('waited' in names)
+        self.assertTrue('idle19' in names)
+        self.assertFalse('idle0' in names)
+
+    def test_eviction_keeps_new_name(self):
+        for i in xrange(10):
+            self._use('idle%d' % i)
+
+        entry = self.stats.waiting('new')
+
+        names = self.stats.get()
+        self.assertTrue(len(names) <= 10)
+        self.assertEqual(1, names['new']['waiters'])
+        self.stats.acquired(entry, 0.0)
+        self.assertEqual(1, self.stats.get()['new']['holders'])
+
+    def test_gave_up(self):
+        def fake_lock(path):
+            raise IOError('fake lock failure')
+
+        self.stubs.Set(lockutils, 'InterProcessLock', fake_lock)
+        lock_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_path)
+
+        @lockutils.synchronized('foo', 'test-', external=True,
+                                lock_path=lock_path)
+        def foo():
+            self.fail('lock should not have been acquired')
+
+        self.flags(disable_process_locking=False)
+        self.assertRaises(IOError, foo)
+
+        stats = lockutils.get_lock_stats()['foo']
+        self.assertEqual(0, stats['acquisitions'])
+        self.assertEqual(0, stats['waiters'])
+        self.assertEqual(0, stats['holders'])
+
+    def test_released_on_exception(self):
+        @lockutils.synchronized('foo', 'test-')
+        def foo():
+            raise ValueError()
+
+        self.assertRaises(ValueError, foo)
+
+        stats = lockutils.get_lock_stats()['foo']
+        self.assertEqual(1, stats['acquisitions'])
+        self.assertEqual(0, stats['holders'])
+        self.assertEqual(0, stats['waiters'])
@@ -18,7 +18,11 @@
 Unit Tests for nova.manager
 """
 
+import eventlet
+
 from nova import manager
+from nova.openstack.common import periodic_task
+from nova.openstack.common import timeutils
 from nova import test
 
 
@@ -33,3 +37,94 @@ class ManagerTestCase(test.TestCase):
 
         self.assertEqual(len(dispatch.callbacks), 3)
         self.assertTrue(api in dispatch.callbacks)
+
+
+class FakeManager(manager.Manager):
+    def __init__(self):
+        super(FakeManager, self).__init__()
+        self.ran = []
+        self.slow_event = eventlet.event.Event()
+
+    @periodic_task.periodic_task
+    def _fast_task(self, context):
+        self.ran.append('fast')
+
+    @periodic_task.periodic_task
+    def _slow_task(self, context):
+        self.ran.append('slow')
+        self.slow_event.wait()
+
+    @periodic_task.periodic_task(spacing=600, run_immediately=True)
+    def _failing_task(self, context):
+        # Pretend to take longer than the spacing
+        timeutils.advance_time_seconds(601)
+        raise test.TestingException()
+
+
+class PeriodicTaskTestCase(test.TestCase):
+    def setUp(self):
+        super(PeriodicTaskTestCase, self).setUp()
+        self.flags(periodic_task_concurrency=3)
+        timeutils.set_time_override(timeutils.utcnow())
+        self.addCleanup(timeutils.clear_time_override)
+        # The time of the last run is kept on the class
+        self.stubs.Set(FakeManager, '_periodic_last_run',
+                       dict(FakeManager._periodic_last_run))
+        self.manager = FakeManager()
+
+    def _stats(self, task_name):
+        return self.manager.get_periodic_task_stats()[task_name]
+
+    def test_serial_run_records_stats(self):
+        self.flags(periodic_task_concurrency=0)
+        self.manager.slow_event.send()
+        self.manager.periodic_tasks(None)
+        self.assertEqual(['fast', 'slow'], self.manager.ran)
+        stats = self._stats('_failing_task')
+        self.assertEqual(1, stats['runs'])
+        self.assertEqual(1, stats['failures'])
+        self.assertFalse(stats['running'])
+        self.assertEqual(1, self._stats('_fast_task')['runs'])
+
+    def test_raise_on_error_runs_serially(self):
+        self.manager.slow_event.send()
+        self.assertRaises(test.TestingException,
+                          self.manager.periodic_tasks, None,
+                          raise_on_error=True)
+
+    def test_concurrent_run_skips_unfinished_task(self):
+        self.manager.periodic_tasks(None)
+        eventlet.sleep(0)
+        # The slow task is still running, the fast one was done quickly
+        self.assertTrue(self._stats('_slow_task')['running'])
+        self.assertEqual(1, self._stats('_fast_task')['runs'])
+
+        self.manager.periodic_tasks(None)
+        eventlet.sleep(0)
+        self.assertEqual(1, self._stats('_slow_task')['skipped'])
+        self.assertEqual(['fast', 'slow', 'fast'], self.manager.ran)
+
+        self.manager.slow_event.send()
+        eventlet.sleep(0)
+        stats = self._stats('_slow_task')
+        self.assertFalse(stats['running'])
+        self.assertEqual(1, stats['runs'])
+
+    def test_concurrency_limit(self):
+        self.flags(periodic_task_concurrency=1)
+        self.manager.periodic_tasks(None)
+        eventlet.sleep(0)
+        started = [task_name for task_name, stats
+                   in self.manager.get_periodic_task_stats().items()
+                   if stats['runs'] or stats['running']]
+        self.assertEqual(1, len(started))
+        self.manager.slow_event.send()
+
+    def test_overrun_counted(self):
+        self.flags(periodic_task_concurrency=0)
+        self.manager.slow_event.send()
+        self.manager.periodic_tasks(None)
+        stats = self._stats('_failing_task')
+        self.assertEqual(1, stats['overruns'])
+        self.assertEqual(601, stats['last_duration'])
+        self.assertEqual(0, self._stats('_fast_task')['overruns'])
@@ -21,6 +21,7 @@ Unittets for S3 objectstore clone.
 """
 
 import boto
+import hashlib
 import os
 import shutil
 import tempfile
@@ -128,6 +129,83 @@ class S3APITestCase(test.TestCase):
 
         self._ensure_no_buckets(bucket.get_all_keys())
 
+    def test_get_key_range(self):
+        bucket = self.conn.create_bucket('testbucket')
+        key = bucket.new_key('somekey')
+        key.set_contents_from_string('0123456789')
+
+        key = bucket.get_key('somekey')
+        self.assertEqual('2345', key.get_contents_as_string(
+                headers={'Range': 'bytes=2-5'}))
+        self.assertEqual('789', key.get_contents_as_string(
+                headers={'Range': 'bytes=-3'}))
+        self.assertEqual('89', key.get_contents_as_string(
+                headers={'Range': 'bytes=8-'}))
+        self.assertRaises(boto_exception.S3ResponseError,
+                          key.get_contents_as_string,
+                          headers={'Range': 'bytes=20-'})
+
+    def test_put_large_key(self):
+        self.stubs.Set(s3server, 'CHUNK_SIZE', 1024)
+        contents = os.urandom(10000)
+        bucket = self.conn.create_bucket('testbucket')
+        key = bucket.new_key('somekey')
+        key.set_contents_from_string(contents)
+
+        self.assertEqual('"%s"' % hashlib.md5(contents).hexdigest(),
+                         key.etag)
+        key = bucket.get_key('somekey')
+        self.assertEqual(contents, key.get_contents_as_string())
+        # The upload was renamed into place
+        self.assertEqual(['somekey', s3server.INDEX_NAME],
+                         sorted(os.listdir(os.path.join(CONF.buckets_path,
+                                                        'testbucket')),
+                                reverse=True))
+
+    def test_list_keys_skips_uploads(self):
+        bucket = self.conn.create_bucket('testbucket')
+        bucket.new_key('somekey').set_contents_from_string('somekey')
+        open(os.path.join(CONF.buckets_path, 'testbucket',
+                          s3server.UPLOAD_PREFIX + 'xyz'), 'w').close()
+        self.assertEqual(['somekey'],
+                         [k.name for k in bucket.get_all_keys()])
+
+    def test_list_keys_prefix_marker(self):
+        bucket = self.conn.create_bucket('testbucket')
+        for name in ('a1', 'a2', 'a3', 'b1', 'c'):
+            bucket.new_key(name).set_contents_from_string(name)
+
+        self.assertEqual(['a2', 'a3'],
+                         [k.name for k in bucket.get_all_keys(prefix='a',
+                                                              marker='a1')])
+        keys = bucket.get_all_keys(max_keys=2)
+        self.assertEqual(['a1', 'a2'], [k.name for k in keys])
+        self.assertTrue(keys.is_truncated)
+        keys = bucket.get_all_keys(prefix='b')
+        self.assertEqual(['b1'], [k.name for k in keys])
+        self.assertEqual(2, keys[0].size)
+        self.assertFalse(keys.is_truncated)
+
+        bucket.delete_key('a2')
+        self.assertEqual(['a1', 'a3'],
+                         [k.name for k in bucket.get_all_keys(prefix='a')])
+
+    def test_put_reserved_key(self):
+        bucket = self.conn.create_bucket('testbucket')
+        key = bucket.new_key(s3server.INDEX_NAME)
+        self.assertRaises(boto_exception.S3ResponseError,
+                          key.set_contents_from_string, 'somekey')
+
+    def test_delete_bucket_with_index(self):
+        bucket = self.conn.create_bucket('testbucket')
+        key = bucket.new_key('somekey')
+        key.set_contents_from_string('somekey')
+        self.assertRaises(boto_exception.S3ResponseError,
+                          self.conn.delete_bucket, 'testbucket')
+        key.delete()
+        self.conn.delete_bucket('testbucket')
+        self._ensure_no_buckets(self.conn.get_all_buckets())
+
     def test_unknown_bucket(self):
         bucket_name = 'falalala'
         self.assertRaises(boto_exception.S3ResponseError,
@@ -138,3 +216,70 @@ class S3APITestCase(test.TestCase):
         """Tear down test server."""
         self.server.stop()
         super(S3APITestCase, self).tearDown()
+
+
+class BucketIndexTestCase(test.TestCase):
+    """Test the key index of buckets."""
+
+    def setUp(self):
+        super(BucketIndexTestCase, self).setUp()
+        self.path = tempfile.mkdtemp(prefix='test_oss-')
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _write(self, name, contents):
+        path = os.path.join(self.path, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_rebuild(self):
+        self._write('b', 'bb')
+        self._write('a/c', 'c')
+        self._write(s3server.UPLOAD_PREFIX + 'x', 'upload')
+        index = s3server.BucketIndex(self.path)
+
+        self.assertEqual(2, index.rebuild())
+        objects, truncated = index.list()
+        self.assertEqual([('a/c', 1), ('b', 2)],
+                         [(name, size) for name, size, mtime in objects])
+        self.assertFalse(truncated)
+
+    def test_missing_index_is_rebuilt(self):
+        self._write('a', 'a')
+        index = s3server.BucketIndex(self.path)
+        # Adding an object to a missing index indexes all of them
+        index.add(self._write('b', 'b'))
+        self.assertEqual(['a', 'b'],
+                         [name for name, size, mtime in index.list()[0]])
+
+    def test_add_and_remove(self):
+        index = s3server.BucketIndex(self.path)
+        index.rebuild()
+        path = self._write('a', 'a')
+        index.add(path)
+        self._write('a', 'aaa')
+        index.add(path)
+        self.assertEqual([('a', 3)],
+                         [(name, size) for name, size, mtime
+                          in index.list()[0]])
+        os.unlink(path)
+        index.remove(path)
+        self.assertEqual(([], False), index.list())
+
+    def test_bucket_depth(self):
+        index = s3server.BucketIndex(self.path, bucket_depth=2)
+        self._write('ab/abcd/key', 'key')
+        index.rebuild()
+        self.assertEqual(['key'],
+                         [name for name, size, mtime in index.list()[0]])
+
+    def test_rebuild_indexes(self):
+        bucket = os.path.join(self.path, 'bucket')
+        os.mkdir(bucket)
+        open(os.path.join(bucket, 'key'), 'w').close()
+        self.assertEqual({'bucket': 1},
+                         s3server.rebuild_indexes(self.path))
+        self.assertTrue(os.path.exists(os.path.join(bucket,
+                                                    s3server.INDEX_NAME)))
@@ -15,15 +15,20 @@
 #    under the License.
 
 import __builtin__
+import ConfigParser
 import datetime
+import errno
 import functools
 import hashlib
 import importlib
 import os
 import os.path
+import shutil
+import socket
 import StringIO
 import tempfile
 
+import eventlet
 import mox
 import netaddr
 from oslo.config import cfg
@@ -31,6 +36,9 @@ from oslo.config import cfg
 import nova
 from nova import exception
 from nova.openstack.common import processutils
+from nova.openstack.common.rootwrap import client as rootwrap_client
+from nova.openstack.common.rootwrap import daemon as rootwrap_daemon
+from nova.openstack.common.rootwrap import wrapper as rootwrap_wrapper
 from nova.openstack.common import timeutils
 from nova import test
 from nova import utils
@@ -841,3 +849,131 @@ class StringLengthTestCase(test.TestCase):
         self.assertRaises(exception.InvalidInput,
                           utils.check_string_length,
                           'a' * 256, 'name', max_length=255)
+
+
+class RootwrapDaemonTestCase(test.TestCase):
+    def setUp(self):
+        super(RootwrapDaemonTestCase, self).setUp()
+        filters_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, filters_dir)
+        with open(os.path.join(filters_dir, 'test.filters'), 'w') as f:
+            f.write('[Filters]\n'
+                    'echo: CommandFilter, /bin/echo, root\n'
+                    'cat: CommandFilter, /bin/cat, root\n')
+        rawconfig = ConfigParser.RawConfigParser()
+        rawconfig.set('DEFAULT', 'filters_path', filters_dir)
+        rawconfig.set('DEFAULT', 'exec_dirs', '/bin')
+        config = rootwrap_wrapper.RootwrapConfig(rawconfig)
+        filters = rootwrap_wrapper.load_filters(config.filters_path)
+
+        self.server = rootwrap_daemon.RootwrapServer(config, filters,
+                                                     os.getuid())
+        socket_path = self.server.bind()
+        thread = eventlet.spawn(self.server.serve_forever)
+        self.addCleanup(thread.kill)
+        self.addCleanup(self.server.cleanup)
+
+        self.client = rootwrap_client.Client(['nova-rootwrap-daemon'])
+        self.stubs.Set(self.client, '_ensure_daemon',
+                       lambda restart=False: socket_path)
+
+    def test_execute(self):
+        self.assertEqual(self.client.execute(['echo', 'hello']),
+                         (0, 'hello\n', ''))
+
+    def test_execute_with_stdin(self):
+        self.assertEqual(self.client.execute(['cat'], '\x00binary\xff'),
+                         (0, '\x00binary\xff', ''))
+
+    def test_unauthorized_command(self):
+        returncode, out, err = self.client.execute(['ls', '/'])
+        self.assertEqual(returncode, rootwrap_daemon.RC_UNAUTHORIZED)
+        self.assertTrue('Unauthorized command' in err)
+
+    def test_execute_restarts_daemon_on_connect_error(self):
+        socket_path = self.client._ensure_daemon()
+        restarts = []
+
+        def fake_ensure_daemon(restart=False):
+            restarts.append(restart)
+            if restart:
+                return socket_path
+            return socket_path + '.gone'
+
+        self.stubs.Set(self.client, '_ensure_daemon', fake_ensure_daemon)
+        self.assertEqual(self.client.execute(['echo', 'hello']),
+                         (0, 'hello\n', ''))
+        self.assertEqual(restarts, [False, True])
+
+    def test_execute_not_retried_once_sent(self):
+        restarts = []
+        orig_ensure_daemon = self.client._ensure_daemon
+
+        def fake_ensure_daemon(restart=False):
+            restarts.append(restart)
+            return orig_ensure_daemon()
+
+        def fake_recv_all(sock):
+            raise socket.error(errno.ECONNRESET, 'reset')
+
+        self.stubs.Set(self.client, '_ensure_daemon', fake_ensure_daemon)
+        self.stubs.Set(rootwrap_daemon, 'recv_all', fake_recv_all)
+        self.assertRaises(socket.error, self.client.execute,
+                          ['echo', 'hello'])
+        self.assertEqual(restarts, [False])
+
+    def test_utils_execute_uses_daemon(self):
+        self.flags(use_rootwrap_daemon=True)
+        self.stubs.Set(utils, '_get_rootwrap_client', lambda: self.client)
+        self.stubs.Set(os, 'geteuid', lambda: 1000)
+
+        def fake_execute(*cmd, **kwargs):
+            self.fail('nova-rootwrap must not be started')
+        self.stubs.Set(processutils, 'execute', fake_execute)
+
+        self.assertEqual(utils.execute('echo', 'foo', run_as_root=True),
+                         ('foo\n', ''))
+        self.assertRaises(processutils.ProcessExecutionError,
+                          utils.execute, 'ls', run_as_root=True)
+        out, err = utils.trycmd('ls', run_as_root=True)
+        self.assertEqual(out, '')
+        self.assertTrue('Unauthorized command' in err)
+
+
+class RootwrapDaemonExecuteTestCase(test.TestCase):
+    def setUp(self):
+        super(RootwrapDaemonExecuteTestCase, self).setUp()
+        self.flags(use_rootwrap_daemon=True)
+        self.stubs.Set(os, 'geteuid', lambda: 1000)
+        self.results = []
+        self.calls = []
+
+        class FakeClient(object):
+            def execute(client, cmd, stdin=None):
+                self.calls.append((cmd, stdin))
+                return self.results.pop(0)
+        self.stubs.Set(utils, '_get_rootwrap_client', FakeClient)
+
+    def test_check_exit_code(self):
+        self.results = [(2, 'out', 'err'), (2, 'out', 'err')]
+        self.assertEqual(utils.execute('true', run_as_root=True,
+                                       check_exit_code=[0, 2]),
+                         ('out', 'err'))
+        self.assertEqual(utils.execute('true', run_as_root=True,
+                                       check_exit_code=False),
+                         ('out', 'err'))
+
+    def test_attempts(self):
+        self.results = [(1, '', 'err'), (0, 'ok', '')]
+        self.assertEqual(utils.execute('true', 1, run_as_root=True,
+                                       process_input='in', attempts=2,
+                                       delay_on_retry=False),
+                         ('ok', ''))
+        self.assertEqual(self.calls, [(['true', '1'], 'in')] * 2)
+
+    def test_not_used_without_run_as_root(self):
+        def fake_execute(*cmd, **kwargs):
+            return 'out', 'err'
+        self.stubs.Set(processutils, 'execute', fake_execute)
+        self.assertEqual(utils.execute('true'), ('out', 'err'))
+        self.assertEqual(self.calls, [])
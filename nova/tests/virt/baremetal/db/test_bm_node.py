@@ -69,6 +69,16 @@ class BareMetalNodesTestCase(base.BMDBTestCase):
               db.bm_node_get,
               self.context, -1)
 
+    def test_get_by_ids(self):
+        self._create_nodes()
+
+        r = db.bm_node_get_by_ids(self.context,
+                                  [self.ids[1], str(self.ids[3]), -1])
+        self.assertEquals(sorted(n['pm_address'] for n in r), ['1', '3'])
+
+        r = db.bm_node_get_by_ids(self.context, [])
+        self.assertEquals(r, [])
+
     def test_get_by_service_host(self):
         self._create_nodes()
 
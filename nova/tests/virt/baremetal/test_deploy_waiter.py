@@ -0,0 +1,105 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for waiting on baremetal deployments."""
+
+import eventlet
+
+from nova.tests.virt.baremetal.db import base as bm_db_base
+from nova.tests.virt.baremetal.db import utils as bm_db_utils
+from nova.virt.baremetal import baremetal_states
+from nova.virt.baremetal import db
+from nova.virt.baremetal import deploy_waiter
+
+
+class DeployWaiterTestCase(bm_db_base.BMDBTestCase):
+
+    def setUp(self):
+        super(DeployWaiterTestCase, self).setUp()
+        self.flags(deploy_poll_interval=60, group='baremetal')
+        self.waiter = deploy_waiter.DeployWaiter(host='test_host')
+        self.addCleanup(self.waiter.stop_consumer)
+        self.queries = []
+        real_get_by_ids = db.bm_node_get_by_ids
+
+        def fake_get_by_ids(context, bm_node_ids):
+            self.queries.append(sorted(bm_node_ids))
+            return real_get_by_ids(context, bm_node_ids)
+
+        self.stubs.Set(db, 'bm_node_get_by_ids', fake_get_by_ids)
+
+    def _create_node(self, instance_uuid,
+                     task_state=baremetal_states.DEPLOYING):
+        node = bm_db_utils.new_bm_node(service_host='test_host',
+                                       instance_uuid=instance_uuid,
+                                       task_state=task_state)
+        return db.bm_node_create(self.context, node)['id']
+
+    def _set_state(self, node_id, task_state):
+        db.bm_node_update(self.context, node_id, {'task_state': task_state})
+
+    def test_already_deployed(self):
+        node_id = self._create_node('uuid1', baremetal_states.DEPLOYDONE)
+        self.assertEqual(None, self.waiter.wait(node_id, 'uuid1'))
+        self.assertEqual([[node_id]], self.queries)
+
+    def test_deploy_failed(self):
+        node_id = self._create_node('uuid1', baremetal_states.DEPLOYFAIL)
+        error = self.waiter.wait(node_id, 'uuid1')
+        self.assertEqual('PXE deploy failed for instance uuid1',
+                         error % 'uuid1')
+
+    def test_other_instance(self):
+        node_id = self._create_node('uuid2')
+        self.assertNotEqual(None, self.waiter.wait(node_id, 'uuid1'))
+
+    def test_node_deleted(self):
+        self.assertNotEqual(None, self.waiter.wait(1234, 'uuid1'))
+
+    def test_timeout(self):
+        node_id = self._create_node('uuid1')
+        error = self.waiter.wait(node_id, 'uuid1', timeout=0.1)
+        self.assertEqual('Timeout reached while waiting for PXE deploy of '
+                         'instance uuid1', error % 'uuid1')
+
+    def test_result_wakes_shared_poller(self):
+        node1 = self._create_node('uuid1')
+        node2 = self._create_node('uuid2')
+        waits = [eventlet.spawn(self.waiter.wait, node1, 'uuid1'),
+                 eventlet.spawn(self.waiter.wait, node2, 'uuid2')]
+        # Let the poller go through its first checks and go to sleep
+        eventlet.sleep(0.1)
+        del self.queries[:]
+
+        self._set_state(node1, baremetal_states.DEPLOYDONE)
+        self._set_state(node2, baremetal_states.DEPLOYDONE)
+        # The poll interval is a minute, so only the cast can get the
+        # waiters going in time.
+        deploy_waiter.DeployRPCAPI().deploy_done(
+                self.context, 'test_host', node1, baremetal_states.DEPLOYDONE)
+        with eventlet.Timeout(5):
+            self.assertEqual([None, None], [w.wait() for w in waits])
+
+        # A single query checked all the nodes being waited for
+        self.assertEqual([[node1, node2]], self.queries)
+
+    def test_poll_error_reaches_waiters(self):
+        def fake_get_by_ids(context, bm_node_ids):
+            raise IOError()
+
+        self.stubs.Set(db, 'bm_node_get_by_ids', fake_get_by_ids)
+        self.assertRaises(IOError, self.waiter.wait, 1, 'uuid1')
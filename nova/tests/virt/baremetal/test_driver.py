@@ -278,6 +278,24 @@ class BareMetalDriverWithDBTestCase(bm_db_base.BMDBTestCase):
         resources = self.driver.get_available_resource(node['node']['uuid'])
         self.assertEqual(resources['memory_mb_used'], 0)
 
+    def test_get_available_resources_bulk(self):
+        node1 = self._create_node()
+        node2 = db.bm_node_create(self.context, bm_db_utils.new_bm_node(
+                            id=124,
+                            service_host='test_host',
+                            cpus=2,
+                            memory_mb=2048))
+        self.driver.spawn(**node1['spawn_params'])
+
+        self.mox.StubOutWithMock(db, 'bm_node_get_by_node_uuid')
+        self.mox.ReplayAll()
+        resources = self.driver.get_available_resources(
+            [node1['node']['uuid'], node2['uuid'], 'missing'])
+        self.assertEqual(resources[node1['node']['uuid']]['memory_mb_used'],
+                         node1['node_info']['memory_mb'])
+        self.assertEqual(resources[node2['uuid']]['memory_mb_used'], 0)
+        self.assertEqual(resources['missing'], {})
+
     def test_get_available_nodes(self):
         self.assertEqual(0, len(self.driver.get_available_nodes()))
 
@@ -344,6 +362,17 @@ class BareMetalDriverWithDBTestCase(bm_db_base.BMDBTestCase):
         res = self.driver.get_info(node['instance'])
         self.assertEqual(res['state'], power_state.RUNNING)
 
+    def test_get_power_states(self):
+        node = self._create_node()
+        db.bm_node_associate_and_update(self.context, node['node']['uuid'],
+                {'instance_uuid': node['instance']['uuid'],
+                 'instance_name': node['instance']['hostname'],
+                 'task_state': baremetal_states.ACTIVE})
+        other = {'uuid': 'other-uuid'}
+        res = self.driver.get_power_states([node['instance'], other])
+        self.assertEqual({node['instance']['uuid']: power_state.RUNNING},
+                         res)
+
     def test_get_info_with_defunct_pm(self):
         # test fix for bug 1178378
         node = self._create_node()
@@ -0,0 +1,124 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the baremetal image cache."""
+
+import os
+import shutil
+
+from nova import test
+from nova import utils
+from nova.virt.baremetal import image_cache
+from nova.virt.libvirt import utils as libvirt_utils
+
+
+class ImageCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ImageCacheTestCase, self).setUp()
+        self.fetched = []
+        self.copied = []
+
+        def fake_fetch_image(context, target, image_id, user_id, project_id):
+            self.fetched.append(image_id)
+            with open(target, 'w') as f:
+                f.write('image %s' % image_id)
+
+        def fake_execute(*cmd, **kwargs):
+            self.assertEqual(('cp', '--reflink=auto'), cmd[:2])
+            self.copied.append(cmd[2:])
+            shutil.copy(cmd[2], cmd[3])
+
+        self.stubs.Set(libvirt_utils, 'fetch_image', fake_fetch_image)
+        self.stubs.Set(utils, 'execute', fake_execute)
+
+    def _make_master(self, cache, image_id, size_mb, mtime):
+        path = cache.get_master_path(image_id)
+        with open(path, 'w') as f:
+            f.truncate(size_mb * 1024 * 1024)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_master_path(self):
+        self.flags(instances_path='/fake/instances', base_dir_name='_base')
+        cache = image_cache.ImageCache()
+        self.assertEqual('/fake/instances/_base/'
+                         '356a192b7913b04c54574d18c28d46e6395428ab',
+                         cache.get_master_path('1'))
+
+    def test_fetch_once_per_image(self):
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            cache = image_cache.ImageCache()
+            for name in ('a', 'b', 'c'):
+                os.mkdir(os.path.join(tmpdir, name))
+                cache.cache_image(None, os.path.join(tmpdir, name, 'disk'),
+                                  'image1', 'user', 'project')
+
+            self.assertEqual(['image1'], self.fetched)
+            self.assertEqual(3, len(self.copied))
+            master = cache.get_master_path('image1')
+            for name in ('a', 'b', 'c'):
+                target = os.path.join(tmpdir, name, 'disk')
+                self.assertEqual((master, target), self.copied.pop(0))
+                self.assertEqual('image image1', open(target).read())
+            stats = cache.get_stats()
+            self.assertEqual(2, stats['hits'])
+            self.assertEqual(1, stats['fetches'])
+            self.assertEqual(1, stats['entries'])
+
+    def test_existing_target_is_kept(self):
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            target = os.path.join(tmpdir, 'disk')
+            open(target, 'w').close()
+            image_cache.ImageCache().cache_image(None, target, 'image1',
+                                                 'user', 'project')
+            self.assertEqual([], self.fetched)
+            self.assertEqual([], self.copied)
+
+    def test_evict_least_recently_used(self):
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            cache = image_cache.ImageCache(base_dir=tmpdir, max_size_mb=2)
+            oldest = self._make_master(cache, 'image1', 1, 1000)
+            self._make_master(cache, 'image2', 1, 3000)
+            self._make_master(cache, 'image3', 1, 2000)
+            # Files that are not masters are left alone
+            other = os.path.join(tmpdir, 'other')
+            open(other, 'w').close()
+
+            self.assertEqual([oldest], cache.evict())
+            self.assertFalse(os.path.exists(oldest))
+            self.assertTrue(os.path.exists(other))
+            self.assertEqual([], cache.evict())
+
+    def test_evict_keeps_master_in_use(self):
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            cache = image_cache.ImageCache(base_dir=tmpdir, max_size_mb=1)
+            oldest = self._make_master(cache, 'image1', 1, 1000)
+            newer = self._make_master(cache, 'image2', 1, 2000)
+
+            self.assertEqual([newer], cache.evict(keep=oldest))
+
+    def test_evict_unlimited(self):
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            cache = image_cache.ImageCache(base_dir=tmpdir, max_size_mb=0)
+            self._make_master(cache, 'image1', 1, 1000)
+            self.assertEqual([], cache.evict())
@@ -23,6 +23,7 @@ import os
 import stat
 import tempfile
 
+import fixtures
 from oslo.config import cfg
 
 from nova import test
@@ -232,3 +233,73 @@ class BareMetalIPMITestCase(test.TestCase):
         pid = ipmi._get_console_pid(self.ipmi.node_id)
         self.mox.VerifyAll()
         self.assertTrue(pid is None)
+
+
+_FAKE_IPMITOOL = """#!/bin/sh
+# ipmitool -I lanplus -H <address> -U <user> -f <password file> <command>
+echo "$@" >> "$(dirname "$0")/calls"
+[ "$(cat "$8")" = "fake-password" ] || exit 2
+case "$4" in
+    on-*) echo "Chassis Power is on" ;;
+    off-*) echo "Chassis Power is off" ;;
+    *) echo "Unknown" ;;
+esac
+"""
+
+
+class IPMIPowerStatesTestCase(test.TestCase):
+    """Polls the power states through a fake ipmitool executable."""
+
+    def setUp(self):
+        super(IPMIPowerStatesTestCase, self).setUp()
+        self.bindir = self.useFixture(fixtures.TempDir()).path
+        ipmitool = os.path.join(self.bindir, 'ipmitool')
+        with open(ipmitool, 'w') as f:
+            f.write(_FAKE_IPMITOOL)
+        os.chmod(ipmitool, 0700)
+        self.useFixture(fixtures.EnvironmentVariable(
+                'PATH', '%s:%s' % (self.bindir, os.environ['PATH'])))
+        self.stubs.Set(ipmi, '_POWER_STATES', ipmi.PowerStateCache())
+
+        self.nodes = []
+        for node_id, address in enumerate(['on-1', 'off-2', 'broken-3']):
+            node = bm_db_utils.new_bm_node(id=node_id + 1,
+                                           pm_address=address,
+                                           pm_user='fake-user',
+                                           pm_password='fake-password')
+            self.nodes.append((node, None))
+
+    def _get_calls(self):
+        with open(os.path.join(self.bindir, 'calls')) as f:
+            return f.read().splitlines()
+
+    def test_get_power_states(self):
+        states = ipmi.IPMI.get_power_states(self.nodes)
+        self.assertEqual({1: True, 2: False, 3: None}, states)
+        calls = self._get_calls()
+        self.assertEqual(3, len(calls))
+        self.assertTrue(calls[0].endswith(' power status'))
+
+    def test_get_power_states_cached(self):
+        ipmi.IPMI.get_power_states(self.nodes[:1])
+        states = ipmi.IPMI.get_power_states(self.nodes)
+        self.assertEqual({1: True, 2: False, 3: None}, states)
+        # The state of the first node was reused
+        self.assertEqual(3, len(self._get_calls()))
+
+    def test_get_power_states_expired(self):
+        self.flags(ipmi_power_state_ttl=-1, group='baremetal')
+        ipmi.IPMI.get_power_states(self.nodes)
+        ipmi.IPMI.get_power_states(self.nodes)
+        self.assertEqual(6, len(self._get_calls()))
+
+    def test_power_change_invalidates(self):
+        self.flags(ipmi_power_retry=0, group='baremetal')
+        node = self.nodes[1][0]
+        ipmi.IPMI.get_power_states([(node, None)])
+        pm = ipmi.IPMI(node)
+        pm._power_on()
+        # 'off-2' never turns on: status, power on, status
+        self.assertEqual(baremetal_states.ERROR, pm.state)
+        self.assertEqual(False, ipmi._POWER_STATES.get(node['id'], 10))
+        self.assertEqual(4, len(self._get_calls()))
@@ -17,16 +17,22 @@
 #    under the License.
 
 import os
+import StringIO
 import tempfile
 import time
 
 import mox
 
 from nova.cmd import baremetal_deploy_helper as bmdh
+from nova import exception
+from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import rpc
 from nova import test
+from nova import utils
 from nova.tests.virt.baremetal.db import base as bm_db_base
 from nova.virt.baremetal import db as bm_db
+from nova.virt import images
 
 bmdh.LOG = logging.getLogger('nova.virt.baremetal.deploy_helper')
 
@@ -126,6 +132,207 @@ class WorkerTestCase(bm_db_base.BMDBTestCase):
         self.mox.VerifyAll()
 
 
+class DeployTrackerTestCase(test.TestCase):
+    def test_get_status(self):
+        tracker = bmdh.DeployTracker()
+        tracker.start('1', {'address': '10.0.0.1'})
+        tracker.start('2', {'address': '10.0.0.2'})
+        tracker.finish('2', False)
+        tracker.add_phase_time('write_image', 3.0)
+        tracker.add_phase_time('write_image', 1.0)
+
+        status = tracker.get_status()
+        self.assertEqual(['1'], [r['node_id'] for r in status['in_flight']])
+        self.assertEqual('10.0.0.1', status['in_flight'][0]['address'])
+        self.assertEqual(0, status['completed'])
+        self.assertEqual(1, status['failed'])
+        self.assertEqual({'count': 2, 'total': 4.0, 'max': 3.0, 'avg': 2.0},
+                         status['phase_timings']['write_image'])
+
+
+class DeployPoolTestCase(test.TestCase):
+    def setUp(self):
+        super(DeployPoolTestCase, self).setUp()
+        self.commands = []
+
+        def fake_execute(*cmd, **kwargs):
+            self.commands.append(cmd)
+            if cmd[0] == 'blkid':
+                return ('12345678-1234-1234-1234-1234567890abcdef\n', '')
+            return ('', '')
+
+        def noop(*args, **kwargs):
+            pass
+
+        self.sleep = time.sleep
+        self.stubs.Set(utils, 'execute', fake_execute)
+        self.stubs.Set(time, 'sleep', noop)
+        self.stubs.Set(bmdh, 'notify', noop)
+        self.stubs.Set(bmdh, 'switch_pxe_config', noop)
+        self.stubs.Set(bmdh, 'get_image_mb', lambda path, fmt: 1)
+        self.stubs.Set(bmdh, 'is_block_device', lambda dev: True)
+        self.stubs.Set(bm_db, 'bm_node_update', noop)
+        self.stubs.Set(bmdh, 'announce_deploy_state', noop)
+
+        self.tracker = bmdh.DeployTracker()
+        self.pool = bmdh.DeployPool(size=2, tracker=self.tracker)
+
+        fd, self.image_path = tempfile.mkstemp()
+        os.write(fd, 'x' * 100)
+        os.close(fd)
+
+    def tearDown(self):
+        self.pool.stop(timeout=1)
+        os.unlink(self.image_path)
+        super(DeployPoolTestCase, self).tearDown()
+
+    def _params(self, address):
+        return {'address': address,
+                'port': 3260,
+                'iqn': 'iqn.xyz',
+                'lun': 1,
+                'image_path': self.image_path,
+                'pxe_config_path': '/tmp/abc/pxeconfig',
+                'root_mb': 128,
+                'swap_mb': 64}
+
+    def _wait_done(self, count):
+        for i in xrange(50):
+            if self.tracker.completed + self.tracker.failed >= count:
+                return
+            self.sleep(0.1)
+        self.fail('deployments did not finish')
+
+    def test_deploys_with_fake_execute(self):
+        self.pool.ensure_workers()
+        for worker in self.pool.workers:
+            worker.queue_timeout = 0.1
+        self.assertEqual(2, len(self.pool.workers))
+
+        self.pool.put('1', self._params('10.0.0.1'))
+        self.pool.put('2', self._params('10.0.0.2'))
+        self._wait_done(2)
+
+        self.assertEqual(2, self.tracker.completed)
+        dd = [cmd for cmd in self.commands if cmd[0] == 'dd']
+        self.assertEqual(2, len(dd))
+
+        status = self.pool.get_status()
+        self.assertEqual(0, status['queue_depth'])
+        self.assertEqual(2, status['workers'])
+        self.assertEqual([], status['in_flight'])
+        for phase in ('discovery', 'login_iscsi', 'make_partitions',
+                      'write_image', 'mkswap', 'logout_iscsi', 'notify'):
+            self.assertEqual(2, status['phase_timings'][phase]['count'])
+
+    def test_status_endpoint(self):
+        self.tracker.start('7', {'address': '10.0.0.7'})
+        app = bmdh.BareMetalDeploy(pool=self.pool)
+        responses = []
+
+        def start_response(status, headers):
+            responses.append(status)
+
+        environ = {'REQUEST_METHOD': 'GET',
+                   'wsgi.input': StringIO.StringIO()}
+        status = jsonutils.loads(app(environ, start_response))
+        self.assertEqual(['200 OK'], responses)
+        self.assertEqual(0, status['queue_depth'])
+        self.assertEqual(2, status['workers'])
+        self.assertEqual('7', status['in_flight'][0]['node_id'])
+        self.assertEqual('queued', status['in_flight'][0]['phase'])
+
+
+class WriteImageTestCase(test.TestCase):
+    def setUp(self):
+        super(WriteImageTestCase, self).setUp()
+        self.commands = []
+
+        self.qemu_img_info = ''
+
+        def fake_execute(*cmd, **kwargs):
+            self.commands.append(cmd)
+            if 'info' in cmd:
+                return (self.qemu_img_info, '')
+            return ('', '')
+
+        self.stubs.Set(utils, 'execute', fake_execute)
+        self.stubs.Set(bmdh, 'BLOCK_SIZE', 4)
+        self.stubs.Set(bmdh, 'MERGE_GAP_BLOCKS', 1)
+        (fd, self.fname) = tempfile.mkstemp()
+        # blocks: data, zeros, zeros, data, zeros, data, short tail
+        os.write(fd, 'aaaa' + '\0' * 8 + 'bbbb' + '\0' * 4 + 'cccc' + 'd')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.fname)
+        super(WriteImageTestCase, self).tearDown()
+
+    def test_get_data_blocks_skips_zeros(self):
+        self.assertEqual([(0, 1), (3, 4)],
+                         bmdh.get_data_blocks(self.fname, skip_zeros=True))
+
+    def test_get_data_blocks_keeps_zeros(self):
+        self.assertEqual([(0, 7)],
+                         bmdh.get_data_blocks(self.fname, skip_zeros=False))
+
+    def test_get_data_blocks_skips_holes(self):
+        self.stubs.Set(bmdh, 'get_data_ranges',
+                       lambda path: [(0, 4), (12, 16), (24, 29)])
+        self.assertEqual([(0, 1), (3, 1), (6, 2)],
+                         bmdh.get_data_blocks(self.fname, skip_zeros=False))
+
+    def test_write_image_raw(self):
+        self.flags(deploy_skip_zeros=True, group='baremetal')
+        written = bmdh.write_image(self.fname, '/dev/fake')
+        self.assertEqual(4 + 13, written)
+        self.assertEqual([('dd', 'if=%s' % self.fname, 'of=/dev/fake',
+                           'bs=4', 'skip=0', 'seek=0', 'count=1',
+                           'oflag=direct', 'conv=notrunc'),
+                          ('dd', 'if=%s' % self.fname, 'of=/dev/fake',
+                           'bs=4', 'skip=3', 'seek=3', 'count=4',
+                           'oflag=direct', 'conv=notrunc')],
+                         [cmd for cmd in self.commands if cmd[0] == 'dd'])
+
+    def test_write_image_raw_whole(self):
+        written = bmdh.write_image(self.fname, '/dev/fake')
+        self.assertEqual(25, written)
+        self.assertEqual([('dd', 'if=%s' % self.fname, 'of=/dev/fake',
+                           'bs=4', 'skip=0', 'seek=0', 'count=7',
+                           'oflag=direct', 'conv=notrunc')],
+                         [cmd for cmd in self.commands if cmd[0] == 'dd'])
+
+    def test_write_image_raw_not_probed(self):
+        self.stubs.Set(images, 'qemu_img_info', self.fail)
+        bmdh.write_image(self.fname, '/dev/fake', 'raw')
+        self.assertNotIn('qemu-img', [cmd[0] for cmd in self.commands])
+
+    def test_write_image_qcow2(self):
+        self.qemu_img_info = 'file format: qcow2\nvirtual size: 20M'
+        written = bmdh.write_image(self.fname, '/dev/fake', 'qcow2')
+        self.assertEqual(None, written)
+        self.assertEqual([('env', 'LC_ALL=C', 'LANG=C', 'qemu-img', 'info',
+                           '-f', 'qcow2', self.fname),
+                          ('qemu-img', 'convert', '-f', 'qcow2', '-O', 'raw',
+                           self.fname, '/dev/fake')], self.commands)
+
+    def test_write_image_refuses_backing_file(self):
+        self.qemu_img_info = ('file format: qcow2\nvirtual size: 20M\n'
+                              'backing file: /etc/shadow')
+        self.assertRaises(exception.ImageUnacceptable,
+                          bmdh.write_image, self.fname, '/dev/fake', 'qcow2')
+        self.assertNotIn('convert', [cmd[1] for cmd in self.commands])
+
+    def test_get_image_mb_raw(self):
+        self.assertEqual(1, bmdh.get_image_mb(self.fname, 'raw'))
+        self.assertEqual([], self.commands)
+
+    def test_get_image_mb_qcow2(self):
+        self.qemu_img_info = ('file format: qcow2\n'
+                              'virtual size: 20M (20971520 bytes)')
+        self.assertEqual(20, bmdh.get_image_mb(self.fname, 'qcow2'))
+
+
 class PhysicalWorkTestCase(test.TestCase):
     def setUp(self):
         super(PhysicalWorkTestCase, self).setUp()
@@ -158,21 +365,21 @@ class PhysicalWorkTestCase(test.TestCase):
         self.mox.StubOutWithMock(bmdh, 'logout_iscsi')
         self.mox.StubOutWithMock(bmdh, 'make_partitions')
         self.mox.StubOutWithMock(bmdh, 'is_block_device')
-        self.mox.StubOutWithMock(bmdh, 'dd')
+        self.mox.StubOutWithMock(bmdh, 'write_image')
         self.mox.StubOutWithMock(bmdh, 'mkswap')
         self.mox.StubOutWithMock(bmdh, 'block_uuid')
         self.mox.StubOutWithMock(bmdh, 'switch_pxe_config')
         self.mox.StubOutWithMock(bmdh, 'notify')
 
         bmdh.get_dev(address, port, iqn, lun).AndReturn(dev)
-        bmdh.get_image_mb(image_path).AndReturn(1)  # < root_mb
+        bmdh.get_image_mb(image_path, 'raw').AndReturn(1)  # < root_mb
         bmdh.discovery(address, port)
         bmdh.login_iscsi(address, port, iqn)
         bmdh.is_block_device(dev).AndReturn(True)
         bmdh.make_partitions(dev, root_mb, swap_mb)
         bmdh.is_block_device(root_part).AndReturn(True)
         bmdh.is_block_device(swap_part).AndReturn(True)
-        bmdh.dd(image_path, root_part)
+        bmdh.write_image(image_path, root_part, 'raw')
         bmdh.mkswap(swap_part)
         bmdh.block_uuid(root_part).AndReturn(root_uuid)
         bmdh.logout_iscsi(address, port, iqn)
@@ -209,10 +416,10 @@ class PhysicalWorkTestCase(test.TestCase):
             pass
 
         bmdh.get_dev(address, port, iqn, lun).AndReturn(dev)
-        bmdh.get_image_mb(image_path).AndReturn(1)  # < root_mb
+        bmdh.get_image_mb(image_path, 'raw').AndReturn(1)  # < root_mb
         bmdh.discovery(address, port)
         bmdh.login_iscsi(address, port, iqn)
-        bmdh.work_on_disk(dev, root_mb, swap_mb, image_path).\
+        bmdh.work_on_disk(dev, root_mb, swap_mb, image_path, 'raw').\
                 AndRaise(TestException)
         bmdh.logout_iscsi(address, port, iqn)
         self.mox.ReplayAll()
@@ -243,6 +450,31 @@ class SwitchPxeConfigTestCase(test.TestCase):
 
 
 class OtherFunctionTestCase(test.TestCase):
+    def test_announce_deploy_state(self):
+        casts = []
+
+        def fake_cast(context, topic, msg):
+            casts.append((topic, msg))
+
+        self.stubs.Set(bm_db, 'bm_node_get',
+                       lambda context, node_id: {'service_host': 'host1'})
+        self.stubs.Set(rpc, 'cast', fake_cast)
+        bmdh.announce_deploy_state(None, 5, 'deploy complete')
+        self.assertEqual([('baremetal_deploy.host1',
+                           {'method': 'deploy_done',
+                            'args': {'node_id': 5,
+                                     'task_state': 'deploy complete'},
+                            'namespace': None,
+                            'version': '1.0'})], casts)
+
+    def test_announce_deploy_state_failure(self):
+        def fake_bm_node_get(context, node_id):
+            raise Exception('test')
+
+        self.stubs.Set(bm_db, 'bm_node_get', fake_bm_node_get)
+        # Errors are only logged
+        bmdh.announce_deploy_state(None, 5, 'deploy complete')
+
     def test_get_dev(self):
         expected = '/dev/disk/by-path/ip-1.2.3.4:5678-iscsi-iqn.fake-lun-9'
         actual = bmdh.get_dev('1.2.3.4', 5678, 'iqn.fake', 9)
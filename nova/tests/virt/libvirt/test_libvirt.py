@@ -3169,9 +3169,25 @@ class LibvirtConnTestCase(test.TestCase):
         # Ensure destroy calls managedSaveRemove for saved instance.
         conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
 
-        def list_instances():
-            return ['fake1', 'fake2']
-        self.stubs.Set(conn, 'list_instances', list_instances)
+        class FakeDomain(object):
+            def __init__(self, dom_id, name):
+                self._id = dom_id
+                self._name = name
+
+            def ID(self):
+                return self._id
+
+            def name(self):
+                return self._name
+
+        snapshot = libvirt_driver.DomainSnapshot([
+            libvirt_driver.DomainStats(FakeDomain(0, 'Domain-0'),
+                                       [1, 0, 0, 1, 0], '<domain/>'),
+            libvirt_driver.DomainStats(FakeDomain(1, 'fake1'),
+                                       [1, 0, 0, 1, 0], '<fake1/>'),
+            libvirt_driver.DomainStats(FakeDomain(-1, 'fake2'),
+                                       [5, 0, 0, 1, 0], '<fake2/>')])
+        self.stubs.Set(conn, 'get_domain_snapshot', lambda: snapshot)
 
         fake_disks = {'fake1': [{'type': 'qcow2', 'path': '/somepath/disk1',
                                  'virt_disk_size': '10737418240',
@@ -3184,7 +3200,8 @@ class LibvirtConnTestCase(test.TestCase):
                                  'disk_size': '10737418240',
                                  'over_committed_disk_size': '0'}]}
 
-        def get_info(instance_name):
+        def get_info(instance_name, xml=None):
+            self.assertEqual(xml, '<%s/>' % instance_name)
             return jsonutils.dumps(fake_disks.get(instance_name))
         self.stubs.Set(conn, 'get_instance_disk_info', get_info)
 
@@ -3626,35 +3643,119 @@ class LibvirtConnTestCase(test.TestCase):
                   }
         self.assertEqual(actual, expect)
 
-    def test_failing_vcpu_count(self):
-        """Domain can fail to return the vcpu description in case it's
-        just starting up or shutting down. Make sure None is handled
-        gracefully.
+    def test_vcpu_used_skips_vanished_domain(self):
+        """A domain can go away between being listed and being queried.
+        Make sure it is skipped gracefully.
         """
 
         class DiagFakeDomain(object):
-            def __init__(self, vcpus):
+            def __init__(self, dom_id, vcpus):
+                self._id = dom_id
                 self._vcpus = vcpus
 
-            def vcpus(self):
+            def ID(self):
+                return self._id
+
+            def name(self):
+                return 'instance-%d' % self._id
+
+            def info(self):
                 if self._vcpus is None:
-                    return None
-                else:
-                    return ([1] * self._vcpus, [True] * self._vcpus)
+                    raise libvirt.libvirtError('Domain not found')
+                return [1, 2048, 2048, self._vcpus, 0]
+
+            def XMLDesc(self, flags):
+                return '<domain/>'
 
         driver = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), True)
         conn = driver._conn
         self.mox.StubOutWithMock(driver, 'list_instance_ids')
         conn.lookupByID = self.mox.CreateMockAnything()
+        conn.listAllDomains = self.mox.CreateMockAnything()
+        conn.listDefinedDomains = lambda: []
+        self.mox.StubOutWithMock(libvirt.libvirtError, 'get_error_code')
 
+        conn.listAllDomains(0).AndRaise(AttributeError())
         driver.list_instance_ids().AndReturn([1, 2])
-        conn.lookupByID(1).AndReturn(DiagFakeDomain(None))
-        conn.lookupByID(2).AndReturn(DiagFakeDomain(5))
+        conn.lookupByID(1).AndReturn(DiagFakeDomain(1, None))
+        conn.lookupByID(2).AndReturn(DiagFakeDomain(2, 5))
+        libvirt.libvirtError.get_error_code().AndReturn(
+            libvirt.VIR_ERR_NO_DOMAIN)
 
         self.mox.ReplayAll()
 
         self.assertEqual(5, driver.get_vcpu_used())
 
+    def test_domain_snapshot_single_pass(self):
+        xml = """<domain type='kvm'><devices>
+                   <disk type='file'><target dev='vda'/></disk>
+                   <interface type='bridge'><target dev='vnet0'/></interface>
+                 </devices></domain>"""
+
+        class FakeDomain(object):
+            def __init__(self, dom_id, vcpus):
+                self._id = dom_id
+                self._vcpus = vcpus
+
+            def ID(self):
+                return self._id
+
+            def name(self):
+                return 'instance-%d' % self._id
+
+            def info(self):
+                return [1, 2048, 2048, self._vcpus, 0]
+
+            def XMLDesc(self, flags):
+                return xml
+
+        driver = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), True)
+        conn = driver._conn
+        # Domains must not be looked up one by one
+        conn.lookupByID = self.mox.CreateMockAnything()
+        conn.lookupByName = self.mox.CreateMockAnything()
+        conn.listAllDomains = self.mox.CreateMockAnything()
+        conn.listAllDomains(0).AndReturn([FakeDomain(1, 2),
+                                          FakeDomain(-1, 4)])
+        self.mox.ReplayAll()
+
+        snapshot = driver.get_domain_snapshot()
+        self.assertEqual(len(snapshot.domains), 2)
+        self.assertEqual(len(snapshot.active_domains()), 1)
+        dom = snapshot.get('instance-1')
+        self.assertEqual(dom.io_devices, {'volumes': ['vda'],
+                                          'ifaces': ['vnet0']})
+        self.assertEqual(driver.get_vcpu_used(snapshot), 2)
+
+    def test_get_power_states(self):
+        class FakeDomain(object):
+            def __init__(self, name, state):
+                self._name = name
+                self._state = state
+
+            def name(self):
+                return self._name
+
+            def info(self):
+                return [self._state, 2048, 2048, 1, 0]
+
+        driver = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), True)
+        conn = driver._conn
+        conn.lookupByName = self.mox.CreateMockAnything()
+        conn.listAllDomains = self.mox.CreateMockAnything()
+        conn.listAllDomains(0).AndReturn([
+            FakeDomain('instance-1', libvirt_driver.VIR_DOMAIN_RUNNING),
+            FakeDomain('instance-2', libvirt_driver.VIR_DOMAIN_SHUTOFF),
+            FakeDomain('unmanaged', libvirt_driver.VIR_DOMAIN_RUNNING)])
+        self.mox.ReplayAll()
+
+        instances = [{'uuid': 'uuid-1', 'name': 'instance-1'},
+                     {'uuid': 'uuid-2', 'name': 'instance-2'},
+                     {'uuid': 'uuid-3', 'name': 'instance-3'}]
+        self.assertEqual(driver.get_power_states(instances),
+                         {'uuid-1': power_state.RUNNING,
+                          'uuid-2': power_state.SHUTDOWN})
+
     def test_get_instance_capabilities(self):
         conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), True)
 
@@ -3837,7 +3938,10 @@ class HostStateTestCase(test.TestCase):
         def get_vcpu_total(self):
             return 1
 
-        def get_vcpu_used(self):
+        def get_domain_snapshot(self):
+            return libvirt_driver.DomainSnapshot([])
+
+        def get_vcpu_used(self, snapshot=None):
             return 0
 
         def get_cpu_info(self):
@@ -3849,7 +3953,7 @@ class HostStateTestCase(test.TestCase):
         def get_memory_mb_total(self):
             return 497
 
-        def get_memory_mb_used(self):
+        def get_memory_mb_used(self, snapshot=None):
             return 88
 
         def get_hypervisor_type(self):
@@ -12,8 +12,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
 
 from nova import test
+from nova import utils
 from nova.virt import images
 
 
@@ -22,3 +24,69 @@ class QemuTestCase(test.TestCase):
         image_info = images.qemu_img_info("/path/that/does/not/exist")
         self.assertTrue(image_info)
         self.assertTrue(str(image_info))
+
+
+class QemuImgInfoCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(QemuImgInfoCacheTestCase, self).setUp()
+        self.cache = images.QemuImgInfoCache()
+        self.calls = []
+
+        def fake_execute(*cmd, **kwargs):
+            self.calls.append(cmd)
+            return ('image: %s\nfile format: qcow2\n'
+                    'virtual size: 1.0G (1073741824 bytes)\n'
+                    'backing file: /base/abc' % cmd[-1], '')
+
+        self.stubs.Set(utils, 'execute', fake_execute)
+
+    def test_cache_hit_skips_subprocess(self):
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk')
+            with open(path, 'w') as f:
+                f.write('x')
+            first = self.cache.get(path)
+            second = self.cache.get(path)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(first is second)
+        self.assertEqual(second.virtual_size, 1073741824)
+        self.assertEqual(second.backing_file, '/base/abc')
+        self.assertEqual(self.cache.get_stats(),
+                         {'hits': 1, 'subprocesses': 1, 'entries': 1})
+
+    def test_modified_file_is_inspected_again(self):
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk')
+            with open(path, 'w') as f:
+                f.write('x')
+            self.cache.get(path)
+            with open(path, 'a') as f:
+                f.write('more data')
+            self.cache.get(path)
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.cache.get_stats()['hits'], 0)
+
+    def test_cache_size_is_bounded(self):
+        self.flags(qemu_img_info_cache_size=2)
+        with utils.tempdir() as tmpdir:
+            paths = [os.path.join(tmpdir, 'disk%d' % i) for i in xrange(3)]
+            for path in paths:
+                open(path, 'w').close()
+                self.cache.get(path)
+            self.assertEqual(self.cache.get_stats()['entries'], 2)
+            # The least recently used entry was evicted
+            self.cache.get(paths[0])
+            self.assertEqual(len(self.calls), 4)
+
+    def test_cache_disabled(self):
+        self.flags(qemu_img_info_cache_size=0)
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk')
+            open(path, 'w').close()
+            self.cache.get(path)
+            self.cache.get(path)
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.cache.get_stats()['entries'], 0)
@@ -16,6 +16,8 @@
 #    under the License.
 
 import contextlib
+import decimal
+import tempfile
 
 import fixtures
 import mox
@@ -787,3 +789,136 @@ class VDIOtherConfigTestCase(stubs.XenAPITestBase):
                     'nova_instance_uuid': 'aaaa-bbbb-cccc-dddd'}
 
         self.assertEqual(expected, other_config)
+
+
+RRD_UPDATES_XML = """<xport>
+  <meta>
+    <start>1000</start>
+    <step>5</step>
+    <end>1015</end>
+    <rows>3</rows>
+    <columns>4</columns>
+    <legend>
+      <entry>AVERAGE:vm:uuid1:cpu0</entry>
+      <entry>AVERAGE:vm:uuid1:memory</entry>
+      <entry>AVERAGE:vm:uuid1:vif_0_tx</entry>
+      <entry>AVERAGE:vm:uuid2:cpu0</entry>
+    </legend>
+  </meta>
+  <data>
+    <row><t>1015</t><v>NaN</v><v>Infinity</v><v>NaN</v><v>NaN</v></row>
+    <row><t>1010</t><v>0.3</v><v>2048</v><v>300</v><v>NaN</v></row>
+    <row><t>1005</t><v>0.1</v><v>1024</v><v>1.0E+02</v><v>NaN</v></row>
+  </data>
+</xport>"""
+
+
+class ParseRRDUpdateTestCase(test.TestCase):
+
+    def _test_parse(self, until, vif_0_tx):
+        expected = {'uuid1': {'cpu0': decimal.Decimal('0.2000'),
+                              'memory': decimal.Decimal('1536.0000'),
+                              'vif_0_tx': decimal.Decimal(vif_0_tx)},
+                    'uuid2': {'cpu0': decimal.Decimal('0.0000')}}
+        result = vm_utils._parse_rrd_update(RRD_UPDATES_XML, 1000, until)
+        self.assertEqual(expected, result)
+        self.assertEqual(str(expected), str(result))
+
+    def test_parse(self):
+        self._test_parse(None, '2250.0000')
+
+    def test_parse_until(self):
+        self._test_parse(1010, '1500.0000')
+
+    def test_parse_without_numpy(self):
+        self.stubs.Set(vm_utils, 'numpy', None)
+        self._test_parse(None, '2250.0000')
+
+    def test_parse_until_without_numpy(self):
+        self.stubs.Set(vm_utils, 'numpy', None)
+        self._test_parse(1010, '1500.0000')
+
+    def test_parse_no_rows(self):
+        xml = RRD_UPDATES_XML.split('<row>')[0] + '</data></xport>'
+        for numpy in (vm_utils.numpy, None):
+            self.stubs.Set(vm_utils, 'numpy', numpy)
+            result = vm_utils._parse_rrd_update(xml, 1000)
+            self.assertEqual(decimal.Decimal('0.0000'),
+                             result['uuid1']['vif_0_tx'])
+            self.assertEqual(decimal.Decimal('0.0000'),
+                             result['uuid1']['cpu0'])
+
+    def test_average_overflow(self):
+        xml = RRD_UPDATES_XML.replace('<v>2048</v>', '<v>1.7E+308</v>')
+        xml = xml.replace('<v>1024</v>', '<v>1.7E+308</v>')
+        for numpy in (vm_utils.numpy, None):
+            self.stubs.Set(vm_utils, 'numpy', numpy)
+            result = vm_utils._parse_rrd_update(xml, 1000)
+            self.assertTrue(result['uuid1']['memory'].is_nan())
+            self.assertEqual(decimal.Decimal('0.2000'),
+                             result['uuid1']['cpu0'])
+
+
+class SparseCopyTestCase(test.TestCase):
+
+    def setUp(self):
+        super(SparseCopyTestCase, self).setUp()
+        self.useFixture(fixtures.NestedTempfile())
+        self.src = tempfile.NamedTemporaryFile()
+        self.dst = tempfile.NamedTemporaryFile()
+        # Zero runs at the start, in the middle and at the end, with a run
+        # of data crossing a chunk boundary and a short last block
+        self.data = ('\0' * 8192 + 'a' * 4096 + '\0' * 4096 + 'b' * 5000 +
+                     '\0' * 16384 + 'c' * 10 + '\0' * 2000)
+        self.src.write(self.data)
+        self.src.flush()
+
+    def _test_copy(self, chunk_size=16384, virtual_size=None):
+        if virtual_size is None:
+            virtual_size = len(self.data)
+        stats = vm_utils._sparse_copy(self.src.name, self.dst.name,
+                                      virtual_size, block_size=4096,
+                                      chunk_size=chunk_size)
+        self.assertEqual(virtual_size, stats['bytes_read'])
+        copied = open(self.dst.name).read()
+        # Zeros at the end are seeked over, so the file may be shorter
+        self.assertEqual(self.data[:virtual_size],
+                         copied.ljust(virtual_size, '\0'))
+        return stats
+
+    def test_copy(self):
+        stats = self._test_copy()
+        # Blocks that are not all zero get written out whole
+        self.assertEqual(8192 + 4096 + 12288, stats['skipped_bytes'])
+
+    def test_copy_without_numpy(self):
+        self.stubs.Set(vm_utils, 'numpy', None)
+        stats = self._test_copy()
+        self.assertEqual(8192 + 4096 + 12288, stats['skipped_bytes'])
+
+    def test_copy_single_chunk(self):
+        self._test_copy(chunk_size=4 * 1024 * 1024)
+
+    def test_copy_partial(self):
+        stats = self._test_copy(virtual_size=16384)
+        self.assertEqual(12288, stats['skipped_bytes'])
+
+    def test_yields_on_time_budget(self):
+        sleeps = []
+        self.stubs.Set(vm_utils.greenthread, 'sleep', sleeps.append)
+        self.stubs.Set(vm_utils, 'SPARSE_COPY_YIELD_INTERVAL', 3600)
+        self._test_copy(chunk_size=4096)
+        self.assertEqual([], sleeps)
+
+        self.stubs.Set(vm_utils, 'SPARSE_COPY_YIELD_INTERVAL', 0)
+        self._test_copy(chunk_size=4096)
+        self.assertEqual([0] * 10, sleeps)
+
+    def test_find_zero_runs(self):
+        data = '\0' * 8 + 'a' * 8 + '\0' * 20
+        for numpy in (vm_utils.numpy, None):
+            self.stubs.Set(vm_utils, 'numpy', numpy)
+            self.assertEqual([(True, 8), (False, 8), (True, 20)],
+                             vm_utils._find_zero_runs(data, 8))
+            self.assertEqual([(False, 16), (True, 20)],
+                             vm_utils._find_zero_runs(data, 16))
@@ -47,6 +47,7 @@ from nova.openstack.common import importutils
 from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import processutils
+from nova.openstack.common.rootwrap import client as rootwrap_client
 from nova.openstack.common.rpc import common as rpc_common
 from nova.openstack.common import timeutils
 
@@ -78,6 +79,11 @@ utils_opts = [
                default="/etc/nova/rootwrap.conf",
                help='Path to the rootwrap configuration file to use for '
                     'running commands as root'),
+    cfg.BoolOpt('use_rootwrap_daemon',
+                default=False,
+                help='Run commands as root through a long-lived '
+                     'nova-rootwrap-daemon instead of starting '
+                     'nova-rootwrap for every command'),
     cfg.StrOpt('tempdir',
                default=None,
                help='Explicitly specify the temporary working directory'),
@@ -150,8 +156,72 @@ def vpn_ping(address, port, timeout=0.05, session_id=None):
         return server_sess
 
 
+_ROOTWRAP_CLIENT = None
+
+
+def _get_rootwrap_client():
+    global _ROOTWRAP_CLIENT
+    if _ROOTWRAP_CLIENT is None:
+        _ROOTWRAP_CLIENT = rootwrap_client.Client(
+            ['sudo', 'nova-rootwrap-daemon', CONF.rootwrap_config])
+    return _ROOTWRAP_CLIENT
+
+
+def _use_rootwrap_daemon(kwargs):
+    return (CONF.use_rootwrap_daemon and kwargs.get('run_as_root') and
+            'root_helper' not in kwargs and not kwargs.get('shell') and
+            os.geteuid() != 0)
+
+
+def _execute_in_rootwrap_daemon(*cmd, **kwargs):
+    """Run a command as root through nova-rootwrap-daemon.
+
+    Accepts the same arguments as processutils.execute() and raises the
+    same errors, but saves starting sudo and nova-rootwrap for every
+    command.
+    """
+    process_input = kwargs.pop('process_input', None)
+    check_exit_code = kwargs.pop('check_exit_code', [0])
+    ignore_exit_code = False
+    delay_on_retry = kwargs.pop('delay_on_retry', True)
+    attempts = kwargs.pop('attempts', 1)
+    kwargs.pop('run_as_root', None)
+    kwargs.pop('shell', None)
+
+    if isinstance(check_exit_code, bool):
+        ignore_exit_code = not check_exit_code
+        check_exit_code = [0]
+    elif isinstance(check_exit_code, int):
+        check_exit_code = [check_exit_code]
+
+    if kwargs:
+        raise processutils.UnknownArgumentError(
+            _('Got unknown keyword args to utils.execute: %r') % kwargs)
+
+    cmd = map(str, cmd)
+    while attempts > 0:
+        attempts -= 1
+        LOG.debug(_('Running cmd (rootwrap daemon): %s'), ' '.join(cmd))
+        returncode, stdout, stderr = _get_rootwrap_client().execute(
+            cmd, process_input)
+        if returncode:
+            LOG.debug(_('Result was %s') % returncode)
+            if not ignore_exit_code and returncode not in check_exit_code:
+                if attempts:
+                    LOG.debug(_('%r failed. Retrying.'), cmd)
+                    if delay_on_retry:
+                        time.sleep(random.randint(20, 200) / 100.0)
+                    continue
+                raise processutils.ProcessExecutionError(
+                    exit_code=returncode, stdout=stdout, stderr=stderr,
+                    cmd=' '.join(cmd))
+        return stdout, stderr
+
+
 def execute(*cmd, **kwargs):
     """Convenience wrapper around oslo's execute() method."""
+    if _use_rootwrap_daemon(kwargs):
+        return _execute_in_rootwrap_daemon(*cmd, **kwargs)
     if 'run_as_root' in kwargs and not 'root_helper' in kwargs:
         kwargs['root_helper'] = 'sudo nova-rootwrap %s' % CONF.rootwrap_config
     return processutils.execute(*cmd, **kwargs)
@@ -159,6 +229,15 @@ def execute(*cmd, **kwargs):
 
 def trycmd(*args, **kwargs):
     """Convenience wrapper around oslo's trycmd() method."""
+    if _use_rootwrap_daemon(kwargs):
+        discard_warnings = kwargs.pop('discard_warnings', False)
+        try:
+            out, err = _execute_in_rootwrap_daemon(*args, **kwargs)
+        except processutils.ProcessExecutionError as exn:
+            return '', str(exn)
+        if discard_warnings:
+            err = ''
+        return out, err
     if 'run_as_root' in kwargs and not 'root_helper' in kwargs:
         kwargs['root_helper'] = 'sudo nova-rootwrap %s' % CONF.rootwrap_config
     return processutils.trycmd(*args, **kwargs)
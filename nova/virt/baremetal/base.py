@@ -70,6 +70,19 @@ class PowerManager(object):
         """Returns True or False according as the node's power state."""
         return True
 
+    @classmethod
+    def get_power_states(cls, nodes):
+        """Returns is_power_on() of many nodes.
+
+        :param nodes: list of (node, instance) tuples
+        :returns: a dict mapping node id to True, False or None
+        """
+        states = {}
+        for node, instance in nodes:
+            pm = cls(node=node, instance=instance)
+            states[node['id']] = pm.is_power_on()
+        return states
+
     # TODO(NTTdocomo): split out console methods to its own class
     def start_console(self):
         pass
@@ -96,6 +96,10 @@ def bm_node_get(context, bm_node_id):
     return IMPL.bm_node_get(context, bm_node_id)
 
 
+def bm_node_get_by_ids(context, bm_node_ids):
+    return IMPL.bm_node_get_by_ids(context, bm_node_ids)
+
+
 def bm_node_get_by_instance_uuid(context, instance_uuid):
     return IMPL.bm_node_get_by_instance_uuid(context,
                                              instance_uuid)
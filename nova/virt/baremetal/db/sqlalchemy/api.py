@@ -138,6 +138,16 @@ def bm_node_get(context, bm_node_id):
     return result
 
 
+@sqlalchemy_api.require_admin_context
+def bm_node_get_by_ids(context, bm_node_ids):
+    if not bm_node_ids:
+        return []
+    bm_node_ids = [int(bm_node_id) for bm_node_id in bm_node_ids]
+    return model_query(context, models.BareMetalNode, read_deleted="no").\
+                     filter(models.BareMetalNode.id.in_(bm_node_ids)).\
+                     all()
+
+
 @sqlalchemy_api.require_admin_context
 def bm_node_get_by_instance_uuid(context, instance_uuid):
     if not uuidutils.is_uuid_like(instance_uuid):
@@ -0,0 +1,222 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Waiting for bare-metal deployments to complete.
+
+nova-baremetal-deploy-helper casts 'deploy_done' to the compute host of a
+node once it has recorded the outcome of a deployment. The compute host
+then checks the state of all the nodes it waits for with a single query
+right away. The same query also runs every deploy_poll_interval seconds,
+so deployments are still noticed when a cast gets lost.
+"""
+
+import datetime
+
+import eventlet
+from eventlet import event
+from oslo.config import cfg
+
+from nova import context as nova_context
+from nova.openstack.common import log as logging
+from nova.openstack.common import rpc
+from nova.openstack.common.rpc import dispatcher as rpc_dispatcher
+from nova.openstack.common.rpc import proxy as rpc_proxy
+from nova.openstack.common import timeutils
+from nova.virt.baremetal import baremetal_states
+from nova.virt.baremetal import db
+
+deploy_waiter_opts = [
+    cfg.StrOpt('deploy_topic',
+               default='baremetal_deploy',
+               help='The topic deployment results are sent to compute '
+                    'hosts on'),
+    cfg.IntOpt('deploy_poll_interval',
+               default=5,
+               help='Seconds between checks of the state of the nodes '
+                    'being deployed, in case a deployment result is not '
+                    'received'),
+    ]
+
+LOG = logging.getLogger(__name__)
+
+baremetal_group = cfg.OptGroup(name='baremetal',
+                               title='Baremetal Options')
+
+CONF = cfg.CONF
+CONF.register_group(baremetal_group)
+CONF.register_opts(deploy_waiter_opts, baremetal_group)
+CONF.import_opt('host', 'nova.netconf')
+
+_DEPLOY_RPC_API_VERSION = '1.0'
+
+
+class DeployRPCAPI(rpc_proxy.RpcProxy):
+    """Client side of the deployment result API.
+
+    API version history:
+        1.0 - Initial version.
+    """
+
+    BASE_RPC_API_VERSION = _DEPLOY_RPC_API_VERSION
+
+    def __init__(self):
+        super(DeployRPCAPI, self).__init__(
+                topic=CONF.baremetal.deploy_topic,
+                default_version=self.BASE_RPC_API_VERSION)
+
+    def deploy_done(self, ctxt, host, node_id, task_state):
+        """Tell the compute host of a node that its deployment ended."""
+        self.cast(ctxt, self.make_msg('deploy_done', node_id=node_id,
+                                      task_state=task_state),
+                  topic=rpc.queue_get_for(ctxt, self.topic, host))
+
+
+class DeployWaiter(object):
+    """Wait for the deployments of a compute host with a shared poller."""
+
+    RPC_API_VERSION = _DEPLOY_RPC_API_VERSION
+
+    def __init__(self, host=None):
+        self.host = host or CONF.host
+        self._pending = {}
+        self._poller = None
+        self._wakeup = event.Event()
+        self._conn = None
+
+    def _start_consumer(self):
+        if self._conn is not None:
+            return
+        try:
+            conn = rpc.create_connection(new=True)
+            dispatcher = rpc_dispatcher.RpcDispatcher([self])
+            topic = rpc.queue_get_for(None, CONF.baremetal.deploy_topic,
+                                      self.host)
+            conn.create_consumer(topic, dispatcher, fanout=False)
+            conn.consume_in_thread()
+        except Exception:
+            LOG.exception(_("Failed to listen for deployment results, "
+                            "polling only"))
+            return
+        self._conn = conn
+
+    def stop_consumer(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def deploy_done(self, context, node_id, task_state):
+        """Called through RPC once a deployment ended."""
+        LOG.debug(_("Deployment to node %(node_id)s ended with "
+                    "%(task_state)s") % locals())
+        self._wake_poller()
+
+    def _wake_poller(self):
+        if not self._wakeup.ready():
+            self._wakeup.send()
+
+    def wait(self, node_id, instance_uuid, timeout=0):
+        """Wait until the deployment of an instance to a node ended.
+
+        :param timeout: seconds to wait at most, 0 waits forever
+        :returns: None on success, or an error message to be formatted
+                  with the instance uuid
+        """
+        self._start_consumer()
+        expiration = None
+        if timeout:
+            expiration = timeutils.utcnow() + datetime.timedelta(
+                    seconds=timeout)
+        waiter = {'instance_uuid': instance_uuid,
+                  'expiration': expiration,
+                  'started': False,
+                  'event': event.Event()}
+        self._pending[node_id] = waiter
+        if self._poller is None:
+            self._poller = eventlet.spawn(self._poll_loop)
+        else:
+            self._wake_poller()
+        return waiter['event'].wait()
+
+    def _poll_loop(self):
+        context = nova_context.get_admin_context()
+        try:
+            while self._pending:
+                try:
+                    self._poll(context)
+                except Exception as e:
+                    # Let every waiter see the error, as it would have
+                    # when polling on its own
+                    pending, self._pending = self._pending, {}
+                    for waiter in pending.values():
+                        waiter['event'].send_exception(e)
+                    break
+                if not self._pending:
+                    break
+                with eventlet.Timeout(self._get_poll_timeout(), False):
+                    self._wakeup.wait()
+                self._wakeup = event.Event()
+        finally:
+            self._poller = None
+
+    def _get_poll_timeout(self):
+        timeout = CONF.baremetal.deploy_poll_interval
+        now = timeutils.utcnow()
+        for waiter in self._pending.values():
+            if waiter['expiration'] is not None:
+                left = timeutils.delta_seconds(now, waiter['expiration'])
+                timeout = min(timeout, left)
+        return max(timeout, 0)
+
+    def _poll(self, context):
+        """Check all the nodes being deployed with a single query."""
+        rows = db.bm_node_get_by_ids(context, self._pending.keys())
+        rows = dict((row['id'], row) for row in rows)
+        now = timeutils.utcnow()
+        for node_id, waiter in self._pending.items():
+            error = None
+            done = False
+            row = rows.get(node_id)
+            instance_uuid = waiter['instance_uuid']
+            if row is None:
+                error = _("Baremetal node deleted while waiting "
+                          "for deployment of instance %s")
+            elif instance_uuid != row['instance_uuid']:
+                error = _("Node associated with another instance"
+                          " while waiting for deploy of %s")
+            else:
+                status = row['task_state']
+                if (status == baremetal_states.DEPLOYING
+                        and not waiter['started']):
+                    LOG.info(_("PXE deploy started for instance %s")
+                                % instance_uuid)
+                    waiter['started'] = True
+                elif status in (baremetal_states.DEPLOYDONE,
+                                baremetal_states.ACTIVE):
+                    LOG.info(_("PXE deploy completed for instance %s")
+                                % instance_uuid)
+                    done = True
+                elif status == baremetal_states.DEPLOYFAIL:
+                    error = _("PXE deploy failed for instance %s")
+
+            if (not done and not error and waiter['expiration'] is not None
+                    and now > waiter['expiration']):
+                error = _("Timeout reached while waiting for "
+                          "PXE deploy of instance %s")
+            if done or error:
+                del self._pending[node_id]
+                waiter['event'].send(error)
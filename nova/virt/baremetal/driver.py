@@ -106,6 +106,17 @@ def _update_state(context, node, instance, state):
     db.bm_node_update(context, node['id'], values)
 
 
+def _get_power_state(is_power_on):
+    # NOTE(deva): Power manager may not be able to determine power state
+    #             in which case it may return "None" here.
+    if is_power_on:
+        return power_state.RUNNING
+    elif is_power_on is False:
+        return power_state.SHUTDOWN
+    else:
+        return power_state.NOSTATE
+
+
 def get_power_manager(**kwargs):
     cls = importutils.import_class(CONF.baremetal.power_manager)
     return cls(**kwargs)
@@ -358,22 +369,24 @@ class BareMetalDriver(driver.ComputeDriver):
         node = _get_baremetal_node_by_instance_uuid(inst_uuid)
         pm = get_power_manager(node=node, instance=instance)
 
-        # NOTE(deva): Power manager may not be able to determine power state
-        #             in which case it may return "None" here.
-        ps = pm.is_power_on()
-        if ps:
-            pstate = power_state.RUNNING
-        elif ps is False:
-            pstate = power_state.SHUTDOWN
-        else:
-            pstate = power_state.NOSTATE
-
-        return {'state': pstate,
+        return {'state': _get_power_state(pm.is_power_on()),
                 'max_mem': node['memory_mb'],
                 'mem': node['memory_mb'],
                 'num_cpu': node['cpus'],
                 'cpu_time': 0}
 
+    def get_power_states(self, instances):
+        context = nova_context.get_admin_context()
+        nodes = dict((node['instance_uuid'], node) for node in
+                     db.bm_node_get_associated(context,
+                                               service_host=CONF.host))
+        nodes = [(nodes[instance['uuid']], instance)
+                 for instance in instances if instance['uuid'] in nodes]
+        pm_class = importutils.import_class(CONF.baremetal.power_manager)
+        states = pm_class.get_power_states(nodes)
+        return dict((instance['uuid'], _get_power_state(states[node['id']]))
+                    for node, instance in nodes)
+
     def refresh_security_group_rules(self, security_group_id):
         self.firewall_driver.refresh_security_group_rules(security_group_id)
         return True
@@ -424,6 +437,14 @@ class BareMetalDriver(driver.ComputeDriver):
             pass
         return resource
 
+    def get_available_resources(self, nodenames):
+        context = nova_context.get_admin_context()
+        nodes = db.bm_node_get_all(context, service_host=CONF.host)
+        resources = dict((str(node['uuid']), self._node_resource(node))
+                         for node in nodes)
+        return dict((nodename, resources.get(nodename, {}))
+                    for nodename in nodenames)
+
     def ensure_filtering_rules_for_instance(self, instance_ref, network_info):
         self.firewall_driver.setup_basic_filtering(instance_ref, network_info)
         self.firewall_driver.prepare_instance_filter(instance_ref,
@@ -0,0 +1,175 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Master image cache for bare-metal instance images.
+
+Images are fetched from Glance once into $instances_path/$base_dir_name,
+named after the SHA1 of their image id like the libvirt image cache does,
+and every instance gets its own copy of the master. The copy is made with
+cp --reflink=auto, which shares the data blocks on filesystems that
+support it. Hardlinks are not used because file injection modifies the
+instance's image in place.
+
+Masters are evicted least recently used first once the cache grows beyond
+[baremetal]image_cache_size_mb.
+"""
+
+import hashlib
+import os
+import re
+
+from oslo.config import cfg
+
+from nova.openstack.common import fileutils
+from nova.openstack.common import log as logging
+from nova import utils
+from nova.virt.baremetal import utils as bm_utils
+from nova.virt.libvirt import utils as libvirt_utils
+
+image_cache_opts = [
+    cfg.IntOpt('image_cache_size_mb',
+               default=10240,
+               help='Maximum size of the cache of bare-metal instance '
+                    'images, in MB. Least recently used images are removed '
+                    'once it is exceeded; 0 means unlimited'),
+    ]
+
+LOG = logging.getLogger(__name__)
+
+baremetal_group = cfg.OptGroup(name='baremetal',
+                               title='Baremetal Options')
+
+CONF = cfg.CONF
+CONF.register_group(baremetal_group)
+CONF.register_opts(image_cache_opts, baremetal_group)
+CONF.import_opt('instances_path', 'nova.compute.manager')
+CONF.import_opt('base_dir_name', 'nova.virt.libvirt.imagecache')
+
+# Masters are named after the hex SHA1 of their image id
+_MASTER_RE = re.compile('^[0-9a-f]{%d}$' % (hashlib.sha1().digest_size * 2))
+
+
+class ImageCache(object):
+    """Glance images shared by the bare-metal instances of a host."""
+
+    def __init__(self, base_dir=None, max_size_mb=None):
+        self._base_dir = base_dir
+        self._max_size_mb = max_size_mb
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def base_dir(self):
+        if self._base_dir is not None:
+            return self._base_dir
+        return os.path.join(CONF.instances_path, CONF.base_dir_name)
+
+    @property
+    def max_size_mb(self):
+        if self._max_size_mb is not None:
+            return self._max_size_mb
+        return CONF.baremetal.image_cache_size_mb
+
+    @property
+    def lock_path(self):
+        return os.path.join(CONF.instances_path, 'locks')
+
+    def get_master_path(self, image_id):
+        return os.path.join(self.base_dir,
+                            hashlib.sha1(str(image_id)).hexdigest())
+
+    def cache_image(self, context, target, image_id, user_id, project_id):
+        """Create target as a copy of the master of image_id.
+
+        The master is fetched from Glance unless it is cached already.
+        Concurrent requests for the same image wait for a single fetch.
+        """
+        if os.path.exists(target):
+            return
+        fileutils.ensure_tree(self.base_dir)
+        master = self.get_master_path(image_id)
+
+        @utils.synchronized(os.path.basename(master), external=True,
+                            lock_path=self.lock_path)
+        def fetch_and_clone():
+            if os.path.exists(master):
+                self.hits += 1
+                # Mark the master as recently used for eviction
+                os.utime(master, None)
+            else:
+                self.misses += 1
+                LOG.debug(_("Fetching image %(image_id)s into the image "
+                            "cache") % locals())
+                libvirt_utils.fetch_image(context, master, image_id,
+                                          user_id, project_id)
+            utils.execute('cp', '--reflink=auto', master, target)
+
+        fetch_and_clone()
+        self.evict(keep=master)
+
+    def _list_masters(self):
+        masters = []
+        for name in os.listdir(self.base_dir):
+            if not _MASTER_RE.match(name):
+                continue
+            path = os.path.join(self.base_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Removed by someone else meanwhile
+                continue
+            masters.append((st.st_mtime, st.st_size, path))
+        return masters
+
+    def evict(self, keep=None):
+        """Remove least recently used masters until the cache fits.
+
+        :param keep: path of a master that must not be removed
+        :returns: list of the removed masters
+        """
+        if self.max_size_mb <= 0:
+            return []
+        limit = self.max_size_mb * 1024 * 1024
+        masters = sorted(self._list_masters())
+        total = sum(size for (_mtime, size, _path) in masters)
+        removed = []
+        for (_mtime, size, path) in masters:
+            if total <= limit:
+                break
+            if path == keep:
+                continue
+
+            @utils.synchronized(os.path.basename(path), external=True,
+                                lock_path=self.lock_path)
+            def remove_master():
+                LOG.info(_("Removing %(path)s from the image cache") %
+                         locals())
+                bm_utils.unlink_without_raise(path)
+
+            remove_master()
+            removed.append(path)
+            total -= size
+        return removed
+
+    def get_stats(self):
+        """Return hit and fetch counters along with the cache size."""
+        masters = self._list_masters() if os.path.isdir(self.base_dir) else []
+        return {'hits': self.hits,
+                'fetches': self.misses,
+                'entries': len(masters),
+                'size': sum(size for (_mtime, size, _path) in masters)}
@@ -24,7 +24,9 @@ Baremetal IPMI power manager.
 import os
 import stat
 import tempfile
+import time
 
+from eventlet import greenpool
 from oslo.config import cfg
 
 from nova import exception
@@ -49,6 +51,14 @@ opts = [
     cfg.IntOpt('ipmi_power_retry',
                default=5,
                help='maximal number of retries for IPMI operations'),
+    cfg.IntOpt('ipmi_power_state_ttl',
+               default=10,
+               help='seconds a polled IPMI power state is reused for '
+                    'power state syncs'),
+    cfg.IntOpt('ipmi_power_state_pool_size',
+               default=20,
+               help='maximal number of nodes whose IPMI power state is '
+                    'polled at once'),
     ]
 
 baremetal_group = cfg.OptGroup(name='baremetal',
@@ -69,6 +79,32 @@ def _make_password_file(password):
     return path
 
 
+class PowerStateCache(object):
+    """Power states of IPMI nodes, remembered for a short while."""
+
+    def __init__(self):
+        self._states = {}
+
+    def get(self, node_id, ttl):
+        """Return the power state of a node if polled within ttl seconds.
+
+        :raises: KeyError if there is no such state
+        """
+        polled_at, state = self._states[node_id]
+        if time.time() - polled_at > ttl:
+            raise KeyError(node_id)
+        return state
+
+    def set(self, node_id, state):
+        self._states[node_id] = (time.time(), state)
+
+    def invalidate(self, node_id):
+        self._states.pop(node_id, None)
+
+
+_POWER_STATES = PowerStateCache()
+
+
 def _get_console_pid_path(node_id):
     name = "%s.pid" % node_id
     path = os.path.join(CONF.baremetal.terminal_pid_dir, name)
@@ -152,6 +188,7 @@ class IPMI(base.PowerManager):
                 raise loopingcall.LoopingCallDone()
             try:
                 self.retries += 1
+                _POWER_STATES.invalidate(self.node_id)
                 self._exec_ipmitool("power on")
             except Exception:
                 LOG.exception(_("IPMI power on failed"))
@@ -174,6 +211,7 @@ class IPMI(base.PowerManager):
                 raise loopingcall.LoopingCallDone()
             try:
                 self.retries += 1
+                _POWER_STATES.invalidate(self.node_id)
                 self._exec_ipmitool("power off")
             except Exception:
                 LOG.exception(_("IPMI power off failed"))
@@ -239,10 +277,45 @@ class IPMI(base.PowerManager):
         #               viewvc/ipmitool/ipmitool/lib/ipmi_chassis.c
         res = self._exec_ipmitool("power status")[0]
         if res == ("Chassis Power is on\n"):
-            return True
+            state = True
         elif res == ("Chassis Power is off\n"):
-            return False
-        return None
+            state = False
+        else:
+            state = None
+        _POWER_STATES.set(self.node_id, state)
+        return state
+
+    @classmethod
+    def get_power_states(cls, nodes):
+        """Returns the power state of many nodes.
+
+        States polled within the last ipmi_power_state_ttl seconds are
+        reused; the other nodes are polled concurrently, at most
+        ipmi_power_state_pool_size at a time.
+
+        :param nodes: list of (node, instance) tuples
+        :returns: a dict mapping node id to True, False or None
+        """
+        states = {}
+        stale = []
+        for node, instance in nodes:
+            try:
+                states[node['id']] = _POWER_STATES.get(
+                        node['id'], CONF.baremetal.ipmi_power_state_ttl)
+            except KeyError:
+                stale.append(node)
+
+        def _poll(node):
+            try:
+                return node['id'], cls(node).is_power_on()
+            except Exception:
+                LOG.exception(_("Failed to get the power state of node %s")
+                              % node['id'])
+                return node['id'], None
+
+        pool = greenpool.GreenPool(CONF.baremetal.ipmi_power_state_pool_size)
+        states.update(pool.imap(_poll, stale))
+        return states
 
     def start_console(self):
         if not self.port:
@@ -20,7 +20,6 @@
 Class for PXE bare-metal nodes.
 """
 
-import datetime
 import os
 
 from oslo.config import cfg
@@ -30,11 +29,10 @@ from nova import exception
 from nova.openstack.common.db import exception as db_exc
 from nova.openstack.common import fileutils
 from nova.openstack.common import log as logging
-from nova.openstack.common import loopingcall
-from nova.openstack.common import timeutils
-from nova.virt.baremetal import baremetal_states
 from nova.virt.baremetal import base
 from nova.virt.baremetal import db
+from nova.virt.baremetal import deploy_waiter
+from nova.virt.baremetal import image_cache
 from nova.virt.baremetal import utils as bm_utils
 
 pxe_opts = [
@@ -239,6 +237,8 @@ class PXE(base.NodeDriver):
 
     def __init__(self, virtapi):
         super(PXE, self).__init__(virtapi)
+        self.image_cache = image_cache.ImageCache()
+        self.deploy_waiter = deploy_waiter.DeployWaiter()
 
     def _collect_mac_addresses(self, context, node):
         macs = set()
@@ -274,7 +274,9 @@ class PXE(base.NodeDriver):
         Both sets of kernel and ramdisk are needed for PXE booting, so these
         are stored under CONF.baremetal.tftp_root.
 
-        At present, the AMI is cached and certain files are injected.
+        The AMI is fetched once into a host wide image cache, and every
+        instance gets its own copy of it. Certain files are then injected
+        into that copy.
         Debian/ubuntu-specific assumptions are made regarding the injected
         files. In a future revision, this functionality will be replaced by a
         more scalable and os-agnostic approach: the deployment ramdisk will
@@ -286,12 +288,11 @@ class PXE(base.NodeDriver):
 
         LOG.debug(_("Fetching image %(ami)s for instance %(name)s") %
                         {'ami': image_meta['id'], 'name': instance['name']})
-        bm_utils.cache_image(context=context,
-                             target=image_path,
-                             image_id=image_meta['id'],
-                             user_id=instance['user_id'],
-                             project_id=instance['project_id']
-                        )
+        self.image_cache.cache_image(context=context,
+                                     target=image_path,
+                                     image_id=image_meta['id'],
+                                     user_id=instance['user_id'],
+                                     project_id=instance['project_id'])
 
         return [image_meta['id'], image_path]
 
@@ -448,50 +449,10 @@ class PXE(base.NodeDriver):
 
     def activate_node(self, context, node, instance):
         """Wait for PXE deployment to complete."""
-
-        locals = {'error': '', 'started': False}
-
-        def _wait_for_deploy():
-            """Called at an interval until the deployment completes."""
-            try:
-                row = db.bm_node_get(context, node['id'])
-                if instance['uuid'] != row.get('instance_uuid'):
-                    locals['error'] = _("Node associated with another instance"
-                                        " while waiting for deploy of %s")
-                    raise loopingcall.LoopingCallDone()
-
-                status = row.get('task_state')
-                if (status == baremetal_states.DEPLOYING
-                        and locals['started'] == False):
-                    LOG.info(_("PXE deploy started for instance %s")
-                                % instance['uuid'])
-                    locals['started'] = True
-                elif status in (baremetal_states.DEPLOYDONE,
-                                baremetal_states.ACTIVE):
-                    LOG.info(_("PXE deploy completed for instance %s")
-                                % instance['uuid'])
-                    raise loopingcall.LoopingCallDone()
-                elif status == baremetal_states.DEPLOYFAIL:
-                    locals['error'] = _("PXE deploy failed for instance %s")
-            except exception.NodeNotFound:
-                locals['error'] = _("Baremetal node deleted while waiting "
-                                    "for deployment of instance %s")
-
-            if (CONF.baremetal.pxe_deploy_timeout and
-                    timeutils.utcnow() > expiration):
-                locals['error'] = _("Timeout reached while waiting for "
-                                     "PXE deploy of instance %s")
-            if locals['error']:
-                raise loopingcall.LoopingCallDone()
-
-        expiration = timeutils.utcnow() + datetime.timedelta(
-                            seconds=CONF.baremetal.pxe_deploy_timeout)
-        timer = loopingcall.FixedIntervalLoopingCall(_wait_for_deploy)
-        timer.start(interval=1).wait()
-
-        if locals['error']:
-            raise exception.InstanceDeployFailure(
-                    locals['error'] % instance['uuid'])
+        error = self.deploy_waiter.wait(node['id'], instance['uuid'],
+                                        CONF.baremetal.pxe_deploy_timeout)
+        if error:
+            raise exception.InstanceDeployFailure(error % instance['uuid'])
 
     def deactivate_node(self, context, node, instance):
         pass
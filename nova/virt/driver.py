@@ -154,6 +154,19 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_power_states(self, instances):
+        """Get the power state of many instances with a single query.
+
+        :param instances: list of instance dicts to look up
+        :returns: a dict mapping instance uuid to one of the power_state
+                  codes. Instances unknown to the hypervisor are left out.
+
+        Drivers that cannot do better than one get_info() call per
+        instance should not implement this; callers fall back to
+        get_info() on NotImplementedError.
+        """
+        raise NotImplementedError()
+
     def get_num_instances(self):
         """Return the total number of virtual machines.
 
@@ -429,6 +442,23 @@ class ComputeDriver(object):
         """
         raise NotImplementedError()
 
+    def get_available_resources(self, nodenames):
+        """Retrieve resource information for several nodes at once.
+
+        :param nodenames: nodes which the caller want to get resources from
+        :returns: dict of nodename => dictionary describing resources, as
+                  returned by get_available_resource()
+
+        .. note::
+
+            This implementation works for all drivers, but it is
+            not particularly efficient. Maintainers of drivers managing
+            many nodes are encouraged to override this method with
+            something more efficient.
+        """
+        return dict((nodename, self.get_available_resource(nodename))
+                    for nodename in nodenames)
+
     def pre_live_migration(self, ctxt, instance_ref,
                            block_device_info, network_info,
                            migrate_data=None):
@@ -252,6 +252,11 @@ class FakeDriver(driver.ComputeDriver):
                 'num_cpu': 2,
                 'cpu_time': 0}
 
+    def get_power_states(self, instances):
+        return dict((instance['uuid'], self.instances[instance['name']].state)
+                    for instance in instances
+                    if instance['name'] in self.instances)
+
     def get_diagnostics(self, instance_name):
         return {'cpu0_time': 17300000000,
                 'memory': 524288,
@@ -21,6 +21,7 @@
 Handling of VM disk images.
 """
 
+import collections
 import os
 import re
 
@@ -37,6 +38,12 @@ image_opts = [
     cfg.BoolOpt('force_raw_images',
                 default=True,
                 help='Force backing images to raw format'),
+    cfg.IntOpt('qemu_img_info_cache_size',
+               default=1024,
+               help='Number of qemu-img info results to keep in memory. '
+                    'Entries are keyed by path, inode, mtime and size so '
+                    'a modified image is always inspected again. '
+                    'Set to 0 to disable the cache'),
 ]
 
 CONF = cfg.CONF
@@ -174,14 +181,68 @@ class QemuImgInfo(object):
         return contents
 
 
+class QemuImgInfoCache(object):
+    """LRU cache of parsed qemu-img info output.
+
+    An entry is only reused while the file keeps the same inode, mtime and
+    size, which covers images being replaced, resized or written to.
+    """
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def get(self, path):
+        """Return the cached QemuImgInfo for path, or run qemu-img."""
+        key = self._key(path)
+        entry = self._entries.pop(path, None)
+        if key is not None and entry is not None and entry[0] == key:
+            self._entries[path] = entry
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
+                                 'qemu-img', 'info', path)
+        info = QemuImgInfo(out)
+        if key is not None and CONF.qemu_img_info_cache_size > 0:
+            self._entries[path] = (key, info)
+            while len(self._entries) > CONF.qemu_img_info_cache_size:
+                self._entries.popitem(last=False)
+        return info
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        """Return hit and fork counters along with the cache size."""
+        return {'hits': self.hits,
+                'subprocesses': self.misses,
+                'entries': len(self._entries)}
+
+
+_QEMU_IMG_INFO_CACHE = QemuImgInfoCache()
+
+
 def qemu_img_info(path):
     """Return an object containing the parsed output from qemu-img info."""
     if not os.path.exists(path):
         return QemuImgInfo()
 
-    out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
-                             'qemu-img', 'info', path)
-    return QemuImgInfo(out)
+    return _QEMU_IMG_INFO_CACHE.get(path)
+
+
+def qemu_img_info_cache_stats():
+    """Return counters of the shared qemu-img info cache."""
+    return _QEMU_IMG_INFO_CACHE.get_stats()
 
 
 def convert_image(source, dest, out_format, run_as_root=False):
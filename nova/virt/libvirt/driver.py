@@ -78,6 +78,7 @@ from nova.openstack.common import log as logging
 from nova.openstack.common import loopingcall
 from nova.openstack.common.notifier import api as notifier
 from nova.openstack.common import processutils
+from nova.openstack.common import timeutils
 from nova import utils
 from nova import version
 from nova.virt import configdrive
@@ -85,6 +86,7 @@ from nova.virt.disk import api as disk
 from nova.virt import driver
 from nova.virt import event as virtevent
 from nova.virt import firewall
+from nova.virt import images
 from nova.virt.libvirt import blockinfo
 from nova.virt.libvirt import config as vconfig
 from nova.virt.libvirt import firewall as libvirt_firewall
@@ -2385,6 +2387,26 @@ class LibvirtDriver(driver.ComputeDriver):
                 'cpu_time': cpu_time,
                 'id': virt_dom.ID()}
 
+    def get_power_states(self, instances):
+        """Look up the power state of many instances in one pass.
+
+        All domains are listed at once and only their info is fetched, so
+        a host with hundreds of instances needs no per-instance lookups.
+        """
+        wanted = set(instance['name'] for instance in instances)
+        states = {}
+        for domain in self._list_all_domains():
+            try:
+                name = domain.name()
+                if name in wanted:
+                    states[name] = LIBVIRT_POWER_STATE[domain.info()[0]]
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+        return dict((instance['uuid'], states[instance['name']])
+                    for instance in instances
+                    if instance['name'] in states)
+
     def _create_domain(self, xml=None, domain=None,
                        instance=None, launch_flags=0):
         """Create a domain.
@@ -2629,9 +2651,10 @@ class LibvirtDriver(driver.ComputeDriver):
 
         return info
 
-    def get_vcpu_used(self):
+    def get_vcpu_used(self, snapshot=None):
         """Get vcpu usage number of physical computer.
 
+        :param snapshot: DomainSnapshot to use instead of querying libvirt
         :returns: The total number of vcpu that currently used.
 
         """
@@ -2640,31 +2663,16 @@ class LibvirtDriver(driver.ComputeDriver):
         if CONF.libvirt_type == 'lxc':
             return total + 1
 
-        dom_ids = self.list_instance_ids()
-        for dom_id in dom_ids:
-            try:
-                dom = self._conn.lookupByID(dom_id)
-                vcpus = dom.vcpus()
-                if vcpus is None:
-                    LOG.debug(_("couldn't obtain the vpu count from domain id:"
-                                " %s") % dom_id)
-                else:
-                    total += len(vcpus[1])
-            except libvirt.libvirtError as err:
-                if err.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
-                    LOG.debug(_("List of domains returned by libVirt: %s")
-                              % dom_ids)
-                    LOG.warn(_("libVirt can't find a domain with id: %s")
-                             % dom_id)
-                    continue
-                raise
-            # NOTE(gtt116): give change to do other task.
-            greenthread.sleep(0)
+        if snapshot is None:
+            snapshot = self.get_domain_snapshot()
+        for dom in snapshot.active_domains():
+            total += dom.vcpus
         return total
 
-    def get_memory_mb_used(self):
+    def get_memory_mb_used(self, snapshot=None):
         """Get the free memory size(MB) of physical computer.
 
+        :param snapshot: DomainSnapshot to use instead of querying libvirt
         :returns: the total usage of memory(MB).
 
         """
@@ -2677,11 +2685,13 @@ class LibvirtDriver(driver.ComputeDriver):
         idx2 = m.index('Buffers:')
         idx3 = m.index('Cached:')
         if CONF.libvirt_type == 'xen':
+            if snapshot is None:
+                snapshot = self.get_domain_snapshot()
             used = 0
-            for domain_id in self.list_instance_ids():
+            for dom in snapshot.active_domains():
                 # skip dom0
-                dom_mem = int(self._conn.lookupByID(domain_id).info()[2])
-                if domain_id != 0:
+                dom_mem = int(dom.memory)
+                if dom.id != 0:
                     used += dom_mem
                 else:
                     # the mem reported by dom0 is be greater of what
@@ -2697,6 +2707,58 @@ class LibvirtDriver(driver.ComputeDriver):
             # Convert it to MB
             return self.get_memory_mb_total() - avail / 1024
 
+    def _list_all_domains(self):
+        """Return handles for all running and defined domains."""
+        # NOTE: listAllDomains returns every domain handle in a single
+        #       round trip; older libvirt needs a lookup per domain.
+        try:
+            return self._conn.listAllDomains(0)
+        except AttributeError:
+            pass
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                raise
+
+        domains = []
+        for domain_id in self.list_instance_ids():
+            try:
+                domains.append(self._conn.lookupByID(domain_id))
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+                LOG.warn(_("libVirt can't find a domain with id: %s")
+                         % domain_id)
+        for name in self._conn.listDefinedDomains():
+            try:
+                domains.append(self._conn.lookupByName(name))
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+        return domains
+
+    def get_domain_snapshot(self):
+        """Collect usage data of all domains in a single pass.
+
+        Every domain is enumerated once and queried for its info and XML
+        description, which is all the resource audit needs for vcpu,
+        memory, disk and interface accounting.
+
+        :returns: a DomainSnapshot
+        """
+        domains = []
+        for domain in self._list_all_domains():
+            try:
+                domains.append(DomainStats(domain, domain.info(),
+                                           domain.XMLDesc(0)))
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+                # Domain went away while we were looking at it
+                continue
+            # NOTE(gtt116): give change to do other task.
+            greenthread.sleep(0)
+        return DomainSnapshot(domains)
+
     def get_hypervisor_type(self):
         """Get hypervisor type.
 
@@ -2889,17 +2951,19 @@ class LibvirtDriver(driver.ComputeDriver):
 
             """
             disk_free_gb = disk_info_dict['free']
-            disk_over_committed = self.get_disk_over_committed_size_total()
+            disk_over_committed = self.get_disk_over_committed_size_total(
+                snapshot)
             # Disk available least size
             available_least = disk_free_gb * (1024 ** 3) - disk_over_committed
             return (available_least / (1024 ** 3))
 
         disk_info_dict = self.get_local_gb_info()
+        snapshot = self.get_domain_snapshot()
         dic = {'vcpus': self.get_vcpu_total(),
                'memory_mb': self.get_memory_mb_total(),
                'local_gb': disk_info_dict['total'],
-               'vcpus_used': self.get_vcpu_used(),
-               'memory_mb_used': self.get_memory_mb_used(),
+               'vcpus_used': self.get_vcpu_used(snapshot),
+               'memory_mb_used': self.get_memory_mb_used(snapshot),
                'local_gb_used': disk_info_dict['used'],
                'hypervisor_type': self.get_hypervisor_type(),
                'hypervisor_version': self.get_hypervisor_version(),
@@ -3470,15 +3534,23 @@ class LibvirtDriver(driver.ComputeDriver):
                               'over_committed_disk_size': over_commit_size})
         return jsonutils.dumps(disk_info)
 
-    def get_disk_over_committed_size_total(self):
-        """Return total over committed disk size for all instances."""
+    def get_disk_over_committed_size_total(self, snapshot=None):
+        """Return total over committed disk size for all instances.
+
+        :param snapshot: DomainSnapshot to use instead of querying libvirt
+        """
         # Disk size that all instance uses : virtual_size - disk_size
-        instances_name = self.list_instances()
+        if snapshot is None:
+            snapshot = self.get_domain_snapshot()
         disk_over_committed_size = 0
-        for i_name in instances_name:
+        for dom in snapshot.domains:
+            # We skip domains with ID 0 (hypervisors).
+            if dom.id == 0:
+                continue
+            i_name = dom.name
             try:
                 disk_infos = jsonutils.loads(
-                        self.get_instance_disk_info(i_name))
+                        self.get_instance_disk_info(i_name, xml=dom.xml))
                 for info in disk_infos:
                     disk_over_committed_size += int(
                         info['over_committed_disk_size'])
@@ -3493,6 +3565,9 @@ class LibvirtDriver(driver.ComputeDriver):
                 pass
             # NOTE(gtt116): give change to do other task.
             greenthread.sleep(0)
+        LOG.debug(_("qemu-img info cache: %(hits)d hits, "
+                    "%(subprocesses)d subprocesses, %(entries)d entries"),
+                  images.qemu_img_info_cache_stats())
         return disk_over_committed_size
 
     def unfilter_instance(self, instance_ref, network_info):
@@ -3714,23 +3789,6 @@ class LibvirtDriver(driver.ComputeDriver):
         self._cleanup_resize(instance, network_info)
 
     def get_diagnostics(self, instance):
-        def get_io_devices(xml_doc):
-            """get the list of io devices from the xml document."""
-            result = {"volumes": [], "ifaces": []}
-            try:
-                doc = etree.fromstring(xml_doc)
-            except Exception:
-                return result
-            blocks = [('./devices/disk', 'volumes'),
-                ('./devices/interface', 'ifaces')]
-            for block, key in blocks:
-                section = doc.findall(block)
-                for node in section:
-                    for child in node.getchildren():
-                        if child.tag == 'target' and child.get('dev'):
-                            result[key].append(child.get('dev'))
-            return result
-
         domain = self._lookup_by_name(instance['name'])
         output = {}
         # get cpu time, might launch an exception if the method
@@ -3743,8 +3801,7 @@ class LibvirtDriver(driver.ComputeDriver):
         except libvirt.libvirtError:
             pass
         # get io status
-        xml = domain.XMLDesc(0)
-        dom_io = get_io_devices(xml)
+        dom_io = DomainStats.get_io_devices(domain.XMLDesc(0))
         for disk in dom_io["volumes"]:
             try:
                 # blockStats might launch an exception if the method
@@ -3812,6 +3869,66 @@ class LibvirtDriver(driver.ComputeDriver):
         self.firewall_driver.setup_basic_filtering(instance, nw_info)
 
 
+class DomainStats(object):
+    """Usage data of a single domain, collected by get_domain_snapshot."""
+    def __init__(self, domain, info, xml):
+        self.domain = domain
+        self.id = domain.ID()
+        self.name = domain.name()
+        (self.state, self.max_memory, self.memory,
+         self.vcpus, self.cpu_time) = info[:5]
+        self.xml = xml
+        self._io_devices = None
+
+    @property
+    def active(self):
+        return self.id >= 0
+
+    @property
+    def io_devices(self):
+        """Target device names of the disks and interfaces of the domain."""
+        if self._io_devices is None:
+            self._io_devices = self.get_io_devices(self.xml)
+        return self._io_devices
+
+    @staticmethod
+    def get_io_devices(xml_doc):
+        """get the list of io devices from the xml document."""
+        result = {"volumes": [], "ifaces": []}
+        try:
+            doc = etree.fromstring(xml_doc)
+        except Exception:
+            return result
+        blocks = [('./devices/disk', 'volumes'),
+            ('./devices/interface', 'ifaces')]
+        for block, key in blocks:
+            section = doc.findall(block)
+            for node in section:
+                for child in node.getchildren():
+                    if child.tag == 'target' and child.get('dev'):
+                        result[key].append(child.get('dev'))
+        return result
+
+
+class DomainSnapshot(object):
+    """Point in time view of all domains on the host.
+
+    Built by LibvirtDriver.get_domain_snapshot and shared by the resource
+    audit so that libvirt is only walked once per update.
+    """
+    def __init__(self, domains):
+        self.created_at = timeutils.utcnow()
+        self.domains = domains
+        self._by_name = dict((dom.name, dom) for dom in domains)
+
+    def get(self, name):
+        """Return the DomainStats for the named domain, or None."""
+        return self._by_name.get(name)
+
+    def active_domains(self):
+        return [dom for dom in self.domains if dom.active]
+
+
 class HostState(object):
     """Manages information about the compute node through libvirt."""
     def __init__(self, driver):
@@ -3832,8 +3949,9 @@ class HostState(object):
         """Retrieve status info from libvirt."""
         LOG.debug(_("Updating host stats"))
         data = {}
+        snapshot = self.driver.get_domain_snapshot()
         data["vcpus"] = self.driver.get_vcpu_total()
-        data["vcpus_used"] = self.driver.get_vcpu_used()
+        data["vcpus_used"] = self.driver.get_vcpu_used(snapshot)
         data["cpu_info"] = jsonutils.loads(self.driver.get_cpu_info())
         disk_info_dict = self.driver.get_local_gb_info()
         data["disk_total"] = disk_info_dict['total']
@@ -3841,7 +3959,7 @@ class HostState(object):
         data["disk_available"] = disk_info_dict['free']
         data["host_memory_total"] = self.driver.get_memory_mb_total()
         data["host_memory_free"] = (data["host_memory_total"] -
-                                    self.driver.get_memory_mb_used())
+                                    self.driver.get_memory_mb_used(snapshot))
         data["hypervisor_type"] = self.driver.get_hypervisor_type()
         data["hypervisor_version"] = self.driver.get_hypervisor_version()
         data["hypervisor_hostname"] = self.driver.get_hypervisor_hostname()
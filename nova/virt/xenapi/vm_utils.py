@@ -23,13 +23,17 @@ their attributes like VDIs, VIFs, as well as their lookup functions.
 
 import contextlib
 import decimal
+import itertools
+import math
 import os
 import re
+import StringIO
 import time
 import urllib
 import urlparse
 import uuid
 from xml.dom import minidom
+from xml.etree import cElementTree as etree
 from xml.parsers import expat
 
 from eventlet import greenthread
@@ -43,6 +47,7 @@ from nova.compute import task_states
 from nova import exception
 from nova.image import glance
 from nova.openstack.common import excutils
+from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import processutils
 from nova.openstack.common import strutils
@@ -53,6 +58,7 @@ from nova.virt.disk.vfs import localfs as vfsimpl
 from nova.virt.xenapi import agent
 from nova.virt.xenapi import volume_utils
 
+numpy = importutils.try_import('numpy')
 
 LOG = logging.getLogger(__name__)
 
@@ -145,6 +151,9 @@ MBR_SIZE_SECTORS = 63
 MBR_SIZE_BYTES = MBR_SIZE_SECTORS * SECTOR_SIZE
 KERNEL_DIR = '/boot/guest'
 MAX_VDI_CHAIN_SIZE = 16
+SPARSE_COPY_CHUNK_SIZE = 4 * 1024 * 1024
+# Seconds _sparse_copy runs at most before yielding to other greenthreads
+SPARSE_COPY_YIELD_INTERVAL = 0.1
 
 
 class ImageType(object):
@@ -1537,8 +1546,7 @@ def compile_metrics(start_time, stop_time=None):
 
     xml = _get_rrd_updates(_get_rrd_server(), start_time)
     if xml:
-        doc = minidom.parseString(xml)
-        return _parse_rrd_update(doc, start_time, stop_time)
+        return _parse_rrd_update(xml, start_time, stop_time)
 
     raise exception.CouldNotFetchMetrics()
 
@@ -1679,85 +1687,156 @@ def _get_rrd_updates(server, start_time):
         return None
 
 
-def _parse_rrd_meta(doc):
-    data = {}
-    meta = doc.getElementsByTagName('meta')[0]
-    for tag in ('start', 'end', 'step'):
-        data[tag] = int(meta.getElementsByTagName(tag)[0].firstChild.data)
-    legend = meta.getElementsByTagName('legend')[0]
-    data['legend'] = [child.firstChild.data for child in legend.childNodes]
-    return data
+def _parse_rrd_xport(xml):
+    """Stream the meta data and the samples out of an RRD xport document.
 
-
-def _parse_rrd_data(doc):
-    dnode = doc.getElementsByTagName('data')[0]
-    return [dict(
-            time=int(child.getElementsByTagName('t')[0].firstChild.data),
-            values=[decimal.Decimal(valnode.firstChild.data)
-                  for valnode in child.getElementsByTagName('v')])
-            for child in dnode.childNodes]
-
-
-def _parse_rrd_update(doc, start, until=None):
-    sum_data = {}
-    meta = _parse_rrd_meta(doc)
-    data = _parse_rrd_data(doc)
+    Returns the meta data along with the list of sample times and the
+    list of rows of sample values, newest first like in the document.
+    """
+    meta = {}
+    legend = []
+    times = []
+    rows = []
+    for _event, elem in etree.iterparse(StringIO.StringIO(xml)):
+        tag = elem.tag
+        if tag == 'row':
+            times.append(int(elem.findtext('t')))
+            rows.append([valnode.text for valnode in elem.findall('v')])
+            # Only the parsed values are kept, not the tree
+            elem.clear()
+        elif tag == 'entry':
+            legend.append(elem.text)
+        elif tag in ('start', 'end', 'step'):
+            meta[tag] = int(elem.text)
+    meta['legend'] = legend
+    return meta, times, rows
+
+
+def _parse_rrd_update(xml, start, until=None):
+    meta, times, rows = _parse_rrd_xport(xml)
+    vif_cols = []
+    other_cols = []
     for col, collabel in enumerate(meta['legend']):
-        _datatype, _objtype, uuid, name = collabel.split(':')
-        vm_data = sum_data.get(uuid, dict())
+        name = collabel.split(':')[3]
         if name.startswith('vif'):
-            vm_data[name] = _integrate_series(data, col, start, until)
+            vif_cols.append(col)
         else:
-            vm_data[name] = _average_series(data, col, until)
-        sum_data[uuid] = vm_data
+            other_cols.append(col)
+
+    if numpy is not None:
+        times = numpy.array(times, dtype=numpy.int64)
+        values = numpy.array(rows, dtype=numpy.float64).reshape(
+                len(rows), len(meta['legend']))
+        if until:
+            keep = times <= until
+            times = times[keep]
+            values = values[keep]
+        vif_values = values[:, vif_cols]
+        other_values = values[:, other_cols]
+    else:
+        if until:
+            rows = [row for (sample_time, row) in zip(times, rows)
+                    if sample_time <= until]
+            times = [sample_time for sample_time in times
+                     if sample_time <= until]
+        vif_values = [[float(row[col]) for row in rows] for col in vif_cols]
+        other_values = [[float(row[col]) for row in rows]
+                        for col in other_cols]
+
+    results = zip(vif_cols, _integrate_series(times, vif_values, start))
+    results += zip(other_cols, _average_series(other_values))
+    sum_data = {}
+    for col, result in results:
+        _datatype, _objtype, uuid, name = meta['legend'][col].split(':')
+        sum_data.setdefault(uuid, {})[name] = result
     return sum_data
 
 
-def _average_series(data, col, until=None):
-    vals = [row['values'][col] for row in data
-            if (not until or (row['time'] <= until)) and
-                row['values'][col].is_finite()]
-    if vals:
-        try:
-            return (sum(vals) / len(vals)).quantize(decimal.Decimal('1.0000'))
-        except decimal.InvalidOperation:
-            # (mdragon) Xenserver occasionally returns odd values in
-            # data that will throw an error on averaging (see bug 918490)
-            # These are hard to find, since, whatever those values are,
-            # Decimal seems to think they are a valid number, sortof.
-            # We *think* we've got the the cases covered, but just in
-            # case, log and return NaN, so we don't break reporting of
-            # other statistics.
-            LOG.error(_("Invalid statistics data from Xenserver: %s")
-                      % str(vals))
-            return decimal.Decimal('NaN')
+def _to_decimal(value, series):
+    if not math.isinf(value) and not math.isnan(value):
+        return decimal.Decimal('%.4f' % value)
+    # (mdragon) Xenserver occasionally returns odd values in data that
+    # will throw an error on averaging (see bug 918490). Log and return
+    # NaN, so we don't break reporting of other statistics.
+    LOG.error(_("Invalid statistics data from Xenserver: %s") % str(series))
+    return decimal.Decimal('NaN')
+
+
+def _average_series(values):
+    """Average the finite samples of every series.
+
+    :param values: 2-D array with a column of samples per series, or a list
+                   of the series when NumPy is not available
+    :returns: list of the averages quantized to 4 decimals, 0 for series
+              without any finite sample
+    """
+    if numpy is not None:
+        finite = numpy.isfinite(values)
+        counts = finite.sum(axis=0)
+        with numpy.errstate(invalid='ignore', over='ignore'):
+            sums = numpy.where(finite, values, 0.0).sum(axis=0)
+            averages = sums / numpy.maximum(counts, 1)
+        series = values.T
+    else:
+        series = values
+        counts = []
+        averages = []
+        for samples in series:
+            samples = [val for val in samples
+                       if not math.isinf(val) and not math.isnan(val)]
+            counts.append(len(samples))
+            averages.append(sum(samples) / max(len(samples), 1))
+
+    results = []
+    for count, average, samples in zip(counts, averages, series):
+        if count:
+            results.append(_to_decimal(float(average), samples))
+        else:
+            results.append(decimal.Decimal('0.0000'))
+    return results
+
+
+def _integrate_series(times, values, start):
+    """Integrate every series over time with the trapezoid rule.
+
+    Samples come newest first and are integrated from start on, with the
+    oldest sample also standing for the time between start and itself.
+    NaN samples count as 0.
+
+    :param values: 2-D array with a column of samples per series, or a list
+                   of the series when NumPy is not available
+    :returns: list of the integrals quantized to 4 decimals
+    """
+    if numpy is not None:
+        if not len(times):
+            return [decimal.Decimal('0.0000')] * values.shape[1]
+        times = times[::-1]
+        values = numpy.where(numpy.isnan(values), 0.0, values)[::-1]
+        prev_times = numpy.concatenate(([int(start)], times[:-1]))
+        prev_values = numpy.concatenate((values[:1], values[:-1]))
+        intervals = (times - prev_times).reshape(len(times), 1)
+        with numpy.errstate(invalid='ignore', over='ignore'):
+            totals = (0.5 * (prev_values + values) * intervals).sum(axis=0)
+        series = values.T
     else:
-        return decimal.Decimal('0.0000')
-
-
-def _integrate_series(data, col, start, until=None):
-    total = decimal.Decimal('0.0000')
-    prev_time = int(start)
-    prev_val = None
-    for row in reversed(data):
-        if not until or (row['time'] <= until):
-            time = row['time']
-            val = row['values'][col]
-            if val.is_nan():
-                val = decimal.Decimal('0.0000')
-            if prev_val is None:
+        series = values
+        totals = []
+        for samples in series:
+            sample_total = 0.0
+            prev_time = int(start)
+            prev_val = None
+            for sample_time, val in reversed(zip(times, samples)):
+                if math.isnan(val):
+                    val = 0.0
+                if prev_val is None:
+                    prev_val = val
+                sample_total += (0.5 * (prev_val + val) *
+                                 (sample_time - prev_time))
+                prev_time = sample_time
                 prev_val = val
-            if prev_val >= val:
-                total += ((val * (time - prev_time)) +
-                          (decimal.Decimal('0.5000') * (prev_val - val) *
-                          (time - prev_time)))
-            else:
-                total += ((prev_val * (time - prev_time)) +
-                          (decimal.Decimal('0.5000') * (val - prev_val) *
-                          (time - prev_time)))
-            prev_time = time
-            prev_val = val
-    return total.quantize(decimal.Decimal('1.0000'))
+            totals.append(sample_total)
+    return [_to_decimal(float(total), samples)
+            for (total, samples) in zip(totals, series)]
 
 
 def _get_all_vdis_in_sr(session, sr_ref):
@@ -2138,17 +2217,53 @@ def _resize_part_and_fs(dev, start, old_sectors, new_sectors):
     utils.execute('tune2fs', '-j', partition_path, run_as_root=True)
 
 
-def _sparse_copy(src_path, dst_path, virtual_size, block_size=4096):
-    """Copy data, skipping long runs of zeros to create a sparse file."""
+def _find_zero_runs(data, block_size):
+    """Split data into runs of all zero blocks and of other blocks.
+
+    :returns: list of (is_zero, length) tuples covering all of data
+    """
+    num_blocks = len(data) // block_size
+    if numpy is not None and num_blocks and not block_size % 8:
+        # Check all the blocks with a single pass over the data
+        words = numpy.frombuffer(data, dtype=numpy.uint64,
+                                 count=num_blocks * block_size // 8)
+        zero_blocks = list(~words.reshape(num_blocks, -1).any(axis=1))
+    else:
+        empty_block = '\0' * block_size
+        view = memoryview(data)
+        zero_blocks = [view[offset:offset + block_size] == empty_block
+                       for offset in xrange(0, num_blocks * block_size,
+                                            block_size)]
+    if len(data) > num_blocks * block_size:
+        # A short last block
+        zero_blocks.append(not data[num_blocks * block_size:].strip('\0'))
+
+    runs = []
+    offset = 0
+    for is_zero, blocks in itertools.groupby(zero_blocks):
+        length = min(len(list(blocks)) * block_size, len(data) - offset)
+        runs.append((bool(is_zero), length))
+        offset += length
+    return runs
+
+
+def _sparse_copy(src_path, dst_path, virtual_size, block_size=4096,
+                 chunk_size=SPARSE_COPY_CHUNK_SIZE):
+    """Copy data, skipping long runs of zeros to create a sparse file.
+
+    Data is read chunk_size bytes at a time, and blocks of block_size zeros
+    within each chunk are seeked over instead of being written.
+    """
     start_time = time.time()
-    EMPTY_BLOCK = '\0' * block_size
+    # Keep chunks aligned on blocks
+    chunk_size = max(chunk_size // block_size, 1) * block_size
     bytes_read = 0
     skipped_bytes = 0
     left = virtual_size
 
     LOG.debug(_("Starting sparse_copy src=%(src_path)s dst=%(dst_path)s "
-                "virtual_size=%(virtual_size)d block_size=%(block_size)d"),
-              locals())
+                "virtual_size=%(virtual_size)d block_size=%(block_size)d "
+                "chunk_size=%(chunk_size)d"), locals())
 
     # NOTE(sirp): we need read/write access to the devices; since we don't have
     # the luxury of shelling out to a sudo'd command, we temporarily take
@@ -2157,30 +2272,40 @@ def _sparse_copy(src_path, dst_path, virtual_size, block_size=4096):
         with utils.temporary_chown(dst_path):
             with open(src_path, "r") as src:
                 with open(dst_path, "w") as dst:
-                    data = src.read(min(block_size, left))
-                    while data:
-                        if data == EMPTY_BLOCK:
-                            dst.seek(block_size, os.SEEK_CUR)
-                            left -= block_size
-                            bytes_read += block_size
-                            skipped_bytes += block_size
-                        else:
-                            dst.write(data)
-                            data_len = len(data)
-                            left -= data_len
-                            bytes_read += data_len
-
-                        if left <= 0:
+                    last_yield = time.time()
+                    while left > 0:
+                        data = src.read(min(chunk_size, left))
+                        if not data:
                             break
-
-                        data = src.read(min(block_size, left))
-                        greenthread.sleep(0)
+                        offset = 0
+                        for is_zero, length in _find_zero_runs(data,
+                                                               block_size):
+                            if is_zero:
+                                dst.seek(length, os.SEEK_CUR)
+                                skipped_bytes += length
+                            else:
+                                dst.write(buffer(data, offset, length))
+                            offset += length
+                        left -= len(data)
+                        bytes_read += len(data)
+
+                        # Let other greenthreads run now and then rather
+                        # than after every chunk
+                        if (time.time() - last_yield >=
+                                SPARSE_COPY_YIELD_INTERVAL):
+                            greenthread.sleep(0)
+                            last_yield = time.time()
 
     duration = time.time() - start_time
-    compression_pct = float(skipped_bytes) / bytes_read * 100
+    compression_pct = float(skipped_bytes) / max(bytes_read, 1) * 100
+    throughput_mb = bytes_read / 1024.0 / 1024.0 / max(duration, 0.001)
 
     LOG.debug(_("Finished sparse_copy in %(duration).2f secs, "
-                "%(compression_pct).2f%% reduction in size"), locals())
+                "%(compression_pct).2f%% reduction in size, "
+                "%(throughput_mb).2f MB/s"), locals())
+    return {'bytes_read': bytes_read,
+            'skipped_bytes': skipped_bytes,
+            'duration': duration}
 
 
 def _copy_partition(session, src_ref, dst_ref, partition, virtual_size):
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for the capacity computation of the cells state manager.
+
+Replaces the DB calls the CellStateManager makes with generated compute
+nodes, flavors and child cells, then reports how long it takes to
+compute the capacity of the cell from scratch, to update it after some
+of the compute hosts changed, and to add up the capacities of the cell
+and its children as they are reported to parent cells.
+
+Run like:
+
+    ./tools/cells_capacity_bench.py --hosts 5000 --flavors 100
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(__file__),
+                                                os.pardir, os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+from nova.openstack.common import gettextutils
+gettextutils.install('nova')
+
+from nova.cells import state
+from nova import db
+
+
+def make_compute_nodes(num_hosts):
+    return [{'service': {'host': 'host%d' % i, 'disabled': False},
+             'memory_mb': 256 * 1024,
+             'local_gb': 2048,
+             'free_ram_mb': random.randint(0, 256 * 1024),
+             'free_disk_gb': random.randint(0, 2048)}
+            for i in xrange(num_hosts)]
+
+
+def make_instance_types(num_flavors):
+    return [{'memory_mb': 512 * (1 + i % 32),
+             'root_gb': 10 * (1 + i % 8),
+             'ephemeral_gb': 20 * (i % 5)}
+            for i in xrange(num_flavors)]
+
+
+def make_cells(num_cells):
+    return [{'name': 'child%d' % i, 'is_parent': False}
+            for i in xrange(num_cells)]
+
+
+def timed(func, *args):
+    began = time.time()
+    result = func(*args)
+    return result, (time.time() - began) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--hosts', type=int, default=5000,
+                        help='number of compute hosts in the cell')
+    parser.add_argument('--flavors', type=int, default=100,
+                        help='number of flavors')
+    parser.add_argument('--changed', type=float, default=1.0,
+                        help='percentage of hosts changing between updates')
+    parser.add_argument('--children', type=int, default=30,
+                        help='number of child cells')
+    args = parser.parse_args()
+
+    compute_nodes = make_compute_nodes(args.hosts)
+    instance_types = make_instance_types(args.flavors)
+    cells = make_cells(args.children)
+    db.compute_node_get_all = lambda context: compute_nodes
+    db.instance_type_get_all = lambda context: instance_types
+    db.cell_get_all = lambda context: cells
+
+    manager, elapsed = timed(state.CellStateManager)
+    print "Initial capacity of %d hosts and %d flavors: %.1f ms" % (
+        args.hosts, args.flavors, elapsed)
+
+    for node in random.sample(compute_nodes,
+                              int(args.hosts * args.changed / 100)):
+        node['free_ram_mb'] = random.randint(0, 256 * 1024)
+    _result, elapsed = timed(manager._update_our_capacity, None)
+    print "Update after %.1f%% of the hosts changed: %.1f ms" % (
+        args.changed, elapsed)
+
+    _result, elapsed = timed(manager._update_our_capacity, None)
+    print "Update with no changes: %.1f ms" % elapsed
+
+    for cell in manager.get_child_cells():
+        cell.update_capacities(manager.get_my_state().capacities)
+    _result, elapsed = timed(manager.get_our_capacities)
+    print "Capacities reported to parents with %d children: %.1f ms" % (
+        args.children, elapsed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for object PUT and GET throughput of nova-objectstore.
+
+Starts an S3Application on a temporary directory inside this process,
+uploads an object of the given size and downloads it again, streaming
+both ways on the client side, and reports the throughput along with how
+much the peak RSS of the process grew. Passing --legacy serves objects
+the way s3server used to, reading and writing them in one piece.
+
+Run like:
+
+    ./tools/objectstore_bench.py --size-mb 1024
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import hashlib
+import httplib
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import routes
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(__file__),
+                                                os.pardir, os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+from nova.openstack.common import gettextutils
+gettextutils.install('nova')
+
+from nova.objectstore import s3server
+from nova import wsgi
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class LegacyObjectHandler(s3server.ObjectHandler):
+    """Object GET and PUT holding the whole object in memory."""
+
+    def get(self, bucket, object_name):
+        path = self._object_path(bucket, object_name)
+        with open(path) as object_file:
+            self.finish(object_file.read())
+
+    def put(self, bucket, object_name):
+        path = self._object_path(bucket, object_name)
+        with open(path, 'w') as object_file:
+            object_file.write(self.request.body)
+        self.set_header('ETag',
+                        '"%s"' % hashlib.md5(self.request.body).hexdigest())
+        self.finish()
+
+
+class ZeroFile(object):
+    """File-like object returning size bytes of zeros."""
+
+    def __init__(self, size):
+        self.left = size
+
+    def read(self, size=CHUNK_SIZE):
+        size = min(size, self.left, CHUNK_SIZE)
+        self.left -= size
+        return '\0' * size
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def request(port, method, path, body=None, headers=None):
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    conn.request(method, path, body, headers or {})
+    return conn.getresponse()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size-mb', type=int, default=1024,
+                        help='size of the object in MB')
+    parser.add_argument('--legacy', action='store_true',
+                        help='serve objects the way s3server used to')
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    directory = tempfile.mkdtemp(prefix='objectstore_bench-')
+    try:
+        mapper = routes.Mapper()
+        if args.legacy:
+            # Routes match in order, so this one wins over the one
+            # S3Application connects
+            mapper.connect('/{bucket}/{object_name}',
+                           controller=lambda *a, **kw: LegacyObjectHandler(
+                               application)(*a, **kw))
+        application = s3server.S3Application(directory, mapper=mapper)
+        server = wsgi.Server('objectstore_bench', application,
+                             host='127.0.0.1', port=0)
+        server.start()
+        request(server.port, 'PUT', '/bench/').read()
+
+        rss = max_rss_mb()
+        began = time.time()
+        response = request(server.port, 'PUT', '/bench/object',
+                           ZeroFile(size), {'Content-Length': str(size)})
+        response.read()
+        elapsed = time.time() - began
+        print "PUT: %.1f MB/s, peak RSS +%.1f MB" % (
+            args.size_mb / elapsed, max_rss_mb() - rss)
+
+        rss = max_rss_mb()
+        began = time.time()
+        response = request(server.port, 'GET', '/bench/object')
+        received = 0
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            received += len(chunk)
+        elapsed = time.time() - began
+        print "GET: %.1f MB/s, peak RSS +%.1f MB" % (
+            args.size_mb / elapsed, max_rss_mb() - rss)
+        server.stop()
+
+        if received != size:
+            print >> sys.stderr, "ERROR: received %d of %d bytes" % (
+                received, size)
+            return 1
+        return 0
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
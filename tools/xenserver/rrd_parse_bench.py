@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for parsing XenServer rrd_updates into VM metrics.
+
+Generates an rrd_updates document for a number of VMs with a number of
+data sources each, and times how long turning it into the per VM metrics
+of compile_metrics takes with the former minidom/Decimal implementation,
+the pure Python one and the NumPy one of vm_utils. Also verifies that all
+of them return the same metrics, to the 4 decimals they are rounded to.
+
+Run like:
+
+    ./tools/xenserver/rrd_parse_bench.py --vms 100 --sources 20 --rows 60
+"""
+
+import argparse
+import decimal
+import os
+import random
+import sys
+import time
+from xml.dom import minidom
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(__file__),
+                                                os.pardir, os.pardir,
+                                                os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+from nova.openstack.common import gettextutils
+gettextutils.install('nova')
+
+from nova.virt.xenapi import vm_utils
+
+STEP = 5
+
+
+def make_rrd_updates(num_vms, num_sources, num_rows, start):
+    legend = []
+    for vm in xrange(num_vms):
+        for source in xrange(num_sources):
+            if source % 2:
+                name = 'vif_%d_tx' % source
+            else:
+                name = 'cpu%d' % source
+            legend.append('AVERAGE:vm:vm-%d:%s' % (vm, name))
+
+    lines = ['<xport><meta><start>%d</start><step>%d</step>'
+             '<end>%d</end><rows>%d</rows><columns>%d</columns><legend>'
+             % (start, STEP, start + num_rows * STEP, num_rows,
+                len(legend))]
+    lines.extend('<entry>%s</entry>' % entry for entry in legend)
+    lines.append('</legend></meta><data>')
+    for row in xrange(num_rows, 0, -1):
+        values = []
+        for col in xrange(len(legend)):
+            if random.random() < 0.01:
+                values.append('NaN')
+            else:
+                values.append('%.4E' % (random.random() * 10 ** (col % 7)))
+        lines.append('<row><t>%d</t>%s</row>' % (
+                start + row * STEP,
+                ''.join('<v>%s</v>' % value for value in values)))
+    lines.append('</data></xport>')
+    return ''.join(lines)
+
+
+def legacy_parse_rrd_update(xml, start, until=None):
+    """The minidom and Decimal based parsing vm_utils used to do."""
+    doc = minidom.parseString(xml)
+    meta = doc.getElementsByTagName('meta')[0]
+    legend = meta.getElementsByTagName('legend')[0]
+    legend = [child.firstChild.data for child in legend.childNodes]
+    dnode = doc.getElementsByTagName('data')[0]
+    data = [dict(
+            time=int(child.getElementsByTagName('t')[0].firstChild.data),
+            values=[decimal.Decimal(valnode.firstChild.data)
+                    for valnode in child.getElementsByTagName('v')])
+            for child in dnode.childNodes]
+
+    sum_data = {}
+    for col, collabel in enumerate(legend):
+        _datatype, _objtype, uuid, name = collabel.split(':')
+        rows = [row for row in data if not until or row['time'] <= until]
+        if name.startswith('vif'):
+            total = decimal.Decimal('0.0000')
+            prev_time = int(start)
+            prev_val = None
+            for row in reversed(rows):
+                val = row['values'][col]
+                if val.is_nan():
+                    val = decimal.Decimal('0.0000')
+                if prev_val is None:
+                    prev_val = val
+                total += ((min(prev_val, val) * (row['time'] - prev_time)) +
+                          (decimal.Decimal('0.5000') * abs(prev_val - val) *
+                           (row['time'] - prev_time)))
+                prev_time = row['time']
+                prev_val = val
+            result = total.quantize(decimal.Decimal('1.0000'))
+        else:
+            vals = [row['values'][col] for row in rows
+                    if row['values'][col].is_finite()]
+            if vals:
+                result = (sum(vals) / len(vals)).quantize(
+                        decimal.Decimal('1.0000'))
+            else:
+                result = decimal.Decimal('0.0000')
+        sum_data.setdefault(uuid, {})[name] = result
+    return sum_data
+
+
+def time_parse(parse, xml, start, repeat):
+    best = None
+    for i in xrange(repeat):
+        began = time.time()
+        result = parse(xml, start)
+        elapsed = time.time() - began
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def count_differences(expected, result):
+    differences = 0
+    for uuid, metrics in expected.iteritems():
+        for name, value in metrics.iteritems():
+            if abs(value - result[uuid][name]) > decimal.Decimal('0.0001'):
+                differences += 1
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--vms', type=int, default=100,
+                        help='number of VMs in the document')
+    parser.add_argument('--sources', type=int, default=20,
+                        help='data sources per VM')
+    parser.add_argument('--rows', type=int, default=60,
+                        help='samples per data source')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per implementation, the best one counts')
+    args = parser.parse_args()
+
+    start = int(time.time()) - (args.rows + 1) * STEP
+    xml = make_rrd_updates(args.vms, args.sources, args.rows, start)
+    print "document:       %.1f MB" % (len(xml) / 1024.0 / 1024.0)
+
+    legacy_time, expected = time_parse(legacy_parse_rrd_update, xml, start,
+                                       args.repeat)
+    print "minidom:        %.3fs" % legacy_time
+
+    numpy = vm_utils.numpy
+    implementations = [('pure python', None)]
+    if numpy is not None:
+        implementations.append(('numpy', numpy))
+    else:
+        print "numpy:          not installed"
+
+    differences = 0
+    for name, module in implementations:
+        vm_utils.numpy = module
+        elapsed, result = time_parse(vm_utils._parse_rrd_update, xml, start,
+                                     args.repeat)
+        print "%-15s %.3fs (%.1fx)" % (name + ':', elapsed,
+                                       legacy_time / elapsed)
+        differences += count_differences(expected, result)
+    vm_utils.numpy = numpy
+
+    if differences:
+        print >> sys.stderr, "ERROR: %d metrics differ" % differences
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())